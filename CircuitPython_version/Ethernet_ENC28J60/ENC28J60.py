@@ -33,6 +33,7 @@ from adafruit_bus_device.spi_device import SPIDevice
 from microcontroller import Pin
 from micropython import const
 from time import sleep
+from supervisor import ticks_ms
 from sys import exit
 import struct
 
@@ -43,16 +44,39 @@ __repo__ = 'https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60'
 ENC28J60_ETH_RX_BUFFER_SIZE = const(1536)
 # RX error codes
 ENC28J60_ETH_RX_ERR_UNSPECIFIED = const(-1)
+ENC28J60_ETH_RX_ERR_RESET = const(-2) # corrupt next packet pointer, the RX ring was reset and its frames are lost
 # TX buffer size
 ENC28J60_ETH_TX_BUFFER_SIZE = const(1536)
 # TX error codes
 ENC28J60_ETH_TX_ERR_MSGSIZE = const(-1)
 ENC28J60_ETH_TX_ERR_LINKDOWN = const(-2)
+ENC28J60_ETH_TX_ERR_TIMEOUT = const(-3)
+ENC28J60_ETH_TX_ERR_ABORTED = const(-4)
+# Retransmissions of a frame aborted by a collision (errata: half-duplex aborts may stall the TX logic)
+ENC28J60_TX_RETRY_LIMIT = const(3)
+# ms before a frame that does not complete is sent again after a TX reset, a full frame takes 1.2 ms at 10 Mbit/s
+ENC28J60_TX_IDLE_TIMEOUT = const(50)
+# supervisor.ticks_ms() wraps at 2**29 ms (about 6 days), intervals are compared with ticksDiff
+ENC28J60_TICKS_PERIOD = const(1 << 29)
+ENC28J60_TICKS_MAX = const(ENC28J60_TICKS_PERIOD - 1)
+ENC28J60_TICKS_HALFPERIOD = const(ENC28J60_TICKS_PERIOD // 2)
+# MISTAT reads before a MII operation is given up, one takes about 10 us and a read is longer than that
+ENC28J60_MII_POLL_LIMIT = const(1000)
 # Receive and transmit buffers
 ENC28J60_RX_BUFFER_START = const(0x0000)
 ENC28J60_RX_BUFFER_STOP = const(0x17FF)
 ENC28J60_TX_BUFFER_START = const(0x1800)
 ENC28J60_TX_BUFFER_STOP = const(0x1FFF)
+ENC28J60_SRAM_SIZE = const(0x2000)
+# Every received frame is preceded by the next packet pointer and the receive status vector
+ENC28J60_RX_HEADER_SIZE = const(6)
+# The transmit status vector is written by the chip after the last byte of the frame
+ENC28J60_TX_STATUS_VECTOR_SIZE = const(7)
+# SPI clock calibration: the chip is specified up to 20 MHz, the probe pattern has many bit transitions
+ENC28J60_BAUDRATE_MIN = const(1_000_000)
+ENC28J60_BAUDRATE_MAX = const(20_000_000)
+ENC28J60_PROBE_PATTERN = b'\x00\xff\xaa\x55\x0f\xf0\x33\xcc\x01\x02\x04\x08\x10\x20\x40\x80\xfe\xfd\xfb\xf7\xef\xdf\xbf\x7f'
+ENC28J60_BAUDRATE_NVM_TAG = b'EB' # microcontroller.nvm: tag + baudrate (little endian, 4 bytes)
 # SPI command set
 ENC28J60_CMD_RCR = const(0x00)
 ENC28J60_CMD_RBM = const(0x3A)
@@ -404,6 +428,21 @@ ENC28J60_TX_CTRL_PHUGEEN = const(0x08)
 ENC28J60_TX_CTRL_PPADEN = const(0x04)
 ENC28J60_TX_CTRL_PCRCEN = const(0x02)
 ENC28J60_TX_CTRL_POVERRIDE = const(0x01)
+# Transmit status vector, bits 31:16 (bits 15:0 are the byte count, 47:32 the bytes on the wire)
+ENC28J60_TSV_TRANSMIT_UNDERRUN = const(0x8000)
+ENC28J60_TSV_TRANSMIT_GIANT = const(0x4000)
+ENC28J60_TSV_LATE_COLLISION = const(0x2000)
+ENC28J60_TSV_EXCESSIVE_COLLISION = const(0x1000)
+ENC28J60_TSV_EXCESSIVE_DEFER = const(0x0800)
+ENC28J60_TSV_PACKET_DEFER = const(0x0400)
+ENC28J60_TSV_BROADCAST = const(0x0200)
+ENC28J60_TSV_MULTICAST = const(0x0100)
+ENC28J60_TSV_DONE = const(0x0080)
+ENC28J60_TSV_LENGTH_OUT_OF_RANGE = const(0x0040)
+ENC28J60_TSV_LENGTH_CHECK_ERROR = const(0x0020)
+ENC28J60_TSV_CRC_ERROR = const(0x0010)
+ENC28J60_TSV_COLLISION_COUNT = const(0x000F)
+ENC28J60_TSV_ABORTED = const(0xB800) # underrun, late collision, excessive collisions or defer
 # Receive status vector
 ENC28J60_RSV_VLAN_TYPE = const(0x4000)
 ENC28J60_RSV_UNKNOWN_OPCODE = const(0x2000)
@@ -418,6 +457,22 @@ ENC28J60_RSV_LENGTH_CHECK_ERROR = const(0x0020)
 ENC28J60_RSV_CRC_ERROR = const(0x0010)
 ENC28J60_RSV_CARRIER_EVENT = const(0x0004)
 ENC28J60_RSV_DROP_EVENT = const(0x0001)
+# Shadow register cache: bits of each register that only the driver changes.
+# EIR, ESTAT, EPKTCNT, ERDPT/EWRPT (auto-increment), ECON1.TXRTS/DMAST and ECON2.PKTDEC (cleared by the chip) are volatile.
+# ERXRDPTH is not cached, writing it commits the latched ERXRDPTL; EDMACS, MII and PHY registers always go to the chip
+ENC28J60_SHADOW_MASKS: dict = {
+    ENC28J60_ECON1: ENC28J60_ECON1_TXRST | ENC28J60_ECON1_RXRST | ENC28J60_ECON1_CSUMEN | ENC28J60_ECON1_RXEN | ENC28J60_ECON1_BSEL1 | ENC28J60_ECON1_BSEL0,
+    ENC28J60_ECON2: ENC28J60_ECON2_AUTOINC | ENC28J60_ECON2_PWRSV | ENC28J60_ECON2_VRPS,
+    ENC28J60_EIE: 0xFF,
+    ENC28J60_ETXSTL: 0xFF, ENC28J60_ETXSTH: 0xFF, ENC28J60_ETXNDL: 0xFF, ENC28J60_ETXNDH: 0xFF,
+    ENC28J60_ERXRDPTL: 0xFF,
+    ENC28J60_EDMASTL: 0xFF, ENC28J60_EDMASTH: 0xFF, ENC28J60_EDMANDL: 0xFF, ENC28J60_EDMANDH: 0xFF,
+    ENC28J60_EDMADSTL: 0xFF, ENC28J60_EDMADSTH: 0xFF,
+    ENC28J60_EPMM0: 0xFF, ENC28J60_EPMM1: 0xFF, ENC28J60_EPMM2: 0xFF, ENC28J60_EPMM3: 0xFF,
+    ENC28J60_EPMM4: 0xFF, ENC28J60_EPMM5: 0xFF, ENC28J60_EPMM6: 0xFF, ENC28J60_EPMM7: 0xFF,
+    ENC28J60_EPMCSL: 0xFF, ENC28J60_EPMCSH: 0xFF, ENC28J60_EPMOL: 0xFF, ENC28J60_EPMOH: 0xFF,
+    ENC28J60_ERXFCON: 0xFF,
+}
 # Functions:
 def LSB(val: int) -> int:
     """Return LSB of value"""
@@ -425,33 +480,139 @@ def LSB(val: int) -> int:
 def MSB(val: int) -> int:
     """Return MSB of value"""
     return ((val >> 8) & 0xFF)
+def ticksAdd(ticks: int, delta: int) -> int:
+    """Return the ticks_ms() value delta ms after ticks"""
+    return (ticks + delta) & ENC28J60_TICKS_MAX
+def ticksDiff(end: int, start: int) -> int:
+    """Return end - start in ms for two ticks_ms() values less than half a period apart, negative if end is before start"""
+    diff: int = (end - start) & ENC28J60_TICKS_MAX
+    return ((diff + ENC28J60_TICKS_HALFPERIOD) & ENC28J60_TICKS_MAX) - ENC28J60_TICKS_HALFPERIOD
 # Classes:
+class ENC28J60_TxStatus:
+    """Transmit status of the last completed frame"""
+    def __init__(self) -> None:
+        self.flags: int = 0 # ENC28J60_TSV_* bits
+        self.length: int = 0 # bytes in the frame, padding and CRC included
+        self.wireLength: int = 0 # bytes put on the wire, collided attempts included
+        self.retries: int = 0 # retransmissions by the driver
+    def decode(self, tsv: bytearray, retries: int) -> None:
+        self.length, self.flags, self.wireLength = struct.unpack_from("<HHH", tsv)
+        self.retries = retries
+    @property
+    def collisions(self) -> int:
+        return self.flags & ENC28J60_TSV_COLLISION_COUNT
+    @property
+    def deferred(self) -> bool:
+        return (self.flags & (ENC28J60_TSV_PACKET_DEFER | ENC28J60_TSV_EXCESSIVE_DEFER)) != 0
+    @property
+    def aborted(self) -> bool:
+        return (self.flags & ENC28J60_TSV_ABORTED) != 0 or (self.flags & ENC28J60_TSV_DONE) == 0
+    @property
+    def ok(self) -> bool:
+        return not self.aborted and (self.flags & (ENC28J60_TSV_CRC_ERROR | ENC28J60_TSV_LENGTH_CHECK_ERROR | ENC28J60_TSV_TRANSMIT_GIANT)) == 0
+class ENC28J60_BusSession:
+    """Context that keeps the SPI bus locked and configured while it is open, opcodes inside it are only framed by CS.
+    Sessions nest, only the outermost one locks and unlocks the bus"""
+    def __init__(self, nic) -> None:
+        self._nic = nic
+        self._acquired: list = []
+    def __enter__(self):
+        self._acquired.append(self._nic._AcquireBus())
+        return self._nic
+    def __exit__(self, *exc) -> bool:
+        if self._acquired.pop(): self._nic._ReleaseBus()
+        return False
 class ENC28J60:
     """This class provides control over ENC28J60 Ethernet chips"""
-    # best baudrate for ENC28J60 is between 100_000 - 10_000_000!!!
+    # best baudrate for ENC28J60 is between 100_000 - 10_000_000!!! ENC28J60_CalibrateBaudrate finds the fastest one that works
     spi_detect: bool = False
     def __init__(self, spi: SPI, cs: Pin,
     baudrate: int=120_000,
     macAddr: bytearray=None,
     fullDuplex: bool=True,
-    enableMulticastRx: bool=False):
+    enableMulticastRx: bool=False,
+    miiScan: bool=True,
+    txSlots: int=2,
+    intPin: Pin=None,
+    sharedBus: bool=False,
+    rxBufferSize: int=ENC28J60_RX_BUFFER_STOP - ENC28J60_RX_BUFFER_START + 1):
         try:
             # CS pin
             self._cs = DigitalInOut(cs)
             self._cs.direction = Direction.OUTPUT
             # SPI
-            self._spi = SPIDevice(spi, self._cs, baudrate=baudrate)
+            # sharedBus=True when other code on this bus configures it without SPIDevice, the bus is then configured on every access
+            self._spi = SPIDevice(spi, self._cs, baudrate=baudrate, cache_configuration=not sharedBus)
             ENC28J60.spi_detect = True
         except Exception:
             ENC28J60.spi_detect = False
         else:
             self.fullDuplex: bool = fullDuplex
             self.enableMulticastRx: bool = enableMulticastRx
+            # SRAM partition: the RX ring starts at address 0, the TX buffer takes the rest of the 8 KB
+            rxBufferSize &= ~1 # ERXND must be odd, ERXRDPT is parked on it when the next packet is at ERXST
+            if rxBufferSize < ENC28J60_ETH_RX_BUFFER_SIZE + ENC28J60_RX_HEADER_SIZE or \
+                ENC28J60_SRAM_SIZE - rxBufferSize < 1 + ENC28J60_ETH_TX_BUFFER_SIZE + ENC28J60_TX_STATUS_VECTOR_SIZE:
+                raise ValueError(f"rxBufferSize={rxBufferSize} leaves no room for a full frame in RX or TX")
+            self._rxStart: int = ENC28J60_RX_BUFFER_START
+            self._rxStop: int = ENC28J60_RX_BUFFER_START + rxBufferSize - 1
+            self._txStart: int = self._rxStop + 1
+            self._txStop: int = ENC28J60_SRAM_SIZE - 1
+            # Keep the MII interface scanning PHSTAT2 so the link state is a single register read
+            self.miiScan: bool = miiScan
+            self._miiScanning: bool = False
+            # The TX buffer is split in slots, the next frame is written while the previous one is on the wire
+            self.txSlots: int = max(1, txSlots)
+            self._txSlotSize: int = (self._txStop - self._txStart + 1) // self.txSlots & ~1
+            self._txSlot: int = 0
+            self._txInFlight: tuple = None # (start, end) of the frame being transmitted
+            self._txAttempts: int = 0 # retransmissions of the frame in flight
+            self._tsv = bytearray(ENC28J60_TX_STATUS_VECTOR_SIZE)
+            self._txStatus = ENC28J60_TxStatus()
+            # In full duplex there are no collisions or deferrals, the TSV is only read when the frame was aborted
+            self.txReadTsv: bool = not fullDuplex
+            self.txRetryLimit: int = ENC28J60_TX_RETRY_LIMIT
+            # Completed transmissions
+            self.txFrames: int = 0
+            self.txBytes: int = 0
+            self.txErrors: int = 0
+            self.txCollisions: int = 0
+            self.txDeferrals: int = 0
+            self.txRetries: int = 0
+            self.txTimeouts: int = 0
+            # Received frames with an RSV error, frames dropped before reaching the RX ring
+            self.rxErrors: int = 0
+            self.rxCrcErrors: int = 0
+            self.rxLengthErrors: int = 0
+            self.rxDropEvents: int = 0 # RSV drop event: at least one frame was dropped before this one
+            self.rxOverflows: int = 0 # drop events caused by a full RX ring or EPKTCNT at 255 (EIR.RXERIF)
+            self.rxResets: int = 0
+            self._readPointer: int = -1
+            self._rxChecksum: int = -1 # DMA checksum of the last received frame, -1 if not computed
+            self._rxFilterInit: int = 0 # ERXFCON written by ENC28J60_Init
+            self._hashTable = bytearray(8) # EHT0-7 as last written
+            self._rxFrameAddr: int = -1 # SRAM address of the last received frame
             self._revId: int = 0
             self._tmpBytearray1B= bytearray(1)
             self._tmpBytearray2B = bytearray(2)
             self._tmpBytearray3B = bytearray(3)
             self._tmpBytearray6B = bytearray(6)
+            self._tmpChecksum2B = bytearray(2) # WriteSram uses the other scratch buffers
+            self._bus: SPI = None # set while the bus is held for a batch of commands
+            self._session = ENC28J60_BusSession(self)
+            self._shadow: dict = {} # last known value of the ENC28J60_SHADOW_MASKS bits, per register
+            self._spiOpsSaved: int = 0 # SPI commands answered or elided by the shadow cache
+            # INT pin, the NIC pulls it low when a packet is pending. Falling edges are counted in the background
+            self._intCounter = None
+            self._intKeys = None
+            if intPin is not None:
+                try:
+                    from countio import Counter, Edge
+                    self._intCounter = Counter(intPin, edge=Edge.FALL)
+                except ImportError: # ports without countio
+                    from keypad import Keys, Event
+                    self._intKeys = Keys((intPin,), value_when_pressed=False, pull=True)
+                    self._intEvent = Event()
             # MAC Address
             if macAddr: self.macAddr = bytearray(macAddr)
             else: self.macAddr = bytearray(b'\x0e\x5f\x5f\x19\x98\x00')
@@ -462,6 +623,19 @@ class ENC28J60:
         """Return MAC Address"""
         return self.macAddr
     @property
+    def ENC28J60_GetRxBufferSize(self) -> int:
+        """Return the size of the RX ring in bytes"""
+        return self._rxStop - self._rxStart + 1
+    @property
+    def ENC28J60_GetTxBufferSize(self) -> int:
+        """Return the size of the TX buffer in bytes"""
+        return self._txStop - self._txStart + 1
+    def ENC28J60_GetRxCapacity(self, frameLen: int=ENC28J60_ETH_RX_BUFFER_SIZE - 4) -> int:
+        """Return how many frames of frameLen bytes (without CRC) the RX ring holds before the NIC starts dropping"""
+        # Each frame takes its header, the CRC and a padding byte to the next even address, one byte always stays free
+        frameSize: int = (ENC28J60_RX_HEADER_SIZE + frameLen + 4 + 1) & ~1
+        return min((self.ENC28J60_GetRxBufferSize - 1) // frameSize, 255) # EPKTCNT saturates at 255
+    @property
     def ENC28J60_GetRevId(self) -> int:
         """Return RevID"""
         if self._revId is None or self._revId == 0:
@@ -479,79 +653,92 @@ class ENC28J60:
 
         # Initialize driver specific variables
         self._currentBank: int = 0xFFFF
-        self._nextPacket: int = ENC28J60_RX_BUFFER_START
+        self._nextPacket: int = self._rxStart
+        self._miiScanning = False
+        self._txSlot = 0
+        self._txInFlight = None
+        self._readPointer: int = -1 # ERDPT value left by the last RBM burst, -1 if unknown
 
         # Read silicon revision ID
         self._revId = self.ENC28J60_ReadReg(ENC28J60_EREVID) & ENC28J60_EREVID_REV
 
+        # Configure the MAC, the buffers and the filters in one batch, sorted by bank
+        regs: list = []
+
         # Disable CLKOUT output
-        self.ENC28J60_WriteReg(ENC28J60_ECOCON, ENC28J60_ECOCON_COCON_DISABLED)
+        regs.append((ENC28J60_ECOCON, ENC28J60_ECOCON_COCON_DISABLED))
 
         # Set the MAC address of the station
-        self.ENC28J60_WriteReg(ENC28J60_MAADR5, self.macAddr[0])
-        self.ENC28J60_WriteReg(ENC28J60_MAADR4, self.macAddr[1])
-        self.ENC28J60_WriteReg(ENC28J60_MAADR3, self.macAddr[2])
-        self.ENC28J60_WriteReg(ENC28J60_MAADR2, self.macAddr[3])
-        self.ENC28J60_WriteReg(ENC28J60_MAADR1, self.macAddr[4])
-        self.ENC28J60_WriteReg(ENC28J60_MAADR0, self.macAddr[5])
+        regs.append((ENC28J60_MAADR5, self.macAddr[0]))
+        regs.append((ENC28J60_MAADR4, self.macAddr[1]))
+        regs.append((ENC28J60_MAADR3, self.macAddr[2]))
+        regs.append((ENC28J60_MAADR2, self.macAddr[3]))
+        regs.append((ENC28J60_MAADR1, self.macAddr[4]))
+        regs.append((ENC28J60_MAADR0, self.macAddr[5]))
 
         # Set receive buffer location
-        self.ENC28J60_WriteReg(ENC28J60_ERXSTL, LSB(ENC28J60_RX_BUFFER_START))
-        self.ENC28J60_WriteReg(ENC28J60_ERXSTH, MSB(ENC28J60_RX_BUFFER_START))
-        self.ENC28J60_WriteReg(ENC28J60_ERXNDL, LSB(ENC28J60_RX_BUFFER_STOP))
-        self.ENC28J60_WriteReg(ENC28J60_ERXNDH, MSB(ENC28J60_RX_BUFFER_STOP))
+        regs.append((ENC28J60_ERXSTL, LSB(self._rxStart)))
+        regs.append((ENC28J60_ERXSTH, MSB(self._rxStart)))
+        regs.append((ENC28J60_ERXNDL, LSB(self._rxStop)))
+        regs.append((ENC28J60_ERXNDH, MSB(self._rxStop)))
 
         # The ERXRDPT register defines a location within the FIFO where the receive hardware is forbidden to write to
-        self.ENC28J60_WriteReg(ENC28J60_ERXRDPTL, LSB(ENC28J60_RX_BUFFER_STOP))
-        self.ENC28J60_WriteReg(ENC28J60_ERXRDPTH, MSB(ENC28J60_RX_BUFFER_STOP))
+        regs.append((ENC28J60_ERXRDPTL, LSB(self._rxStop)))
+        regs.append((ENC28J60_ERXRDPTH, MSB(self._rxStop)))
 
         # Configure the receive filters
         if self.enableMulticastRx:
-            self.ENC28J60_WriteReg(ENC28J60_ERXFCON, ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN | ENC28J60_ERXFCON_MCEN)
+            self._rxFilterInit = ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN | ENC28J60_ERXFCON_MCEN
         else:
-            self.ENC28J60_WriteReg(ENC28J60_ERXFCON, ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN)
+            self._rxFilterInit = ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN
+        regs.append((ENC28J60_ERXFCON, self._rxFilterInit))
 
         # Initialize the hash table
-        self.ENC28J60_WriteReg(ENC28J60_EHT0, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT1, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT2, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT3, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT4, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT5, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT6, 0x00)
-        self.ENC28J60_WriteReg(ENC28J60_EHT7, 0x00)
+        self._hashTable[:] = bytes(8)
+        regs.append((ENC28J60_EHT0, 0x00))
+        regs.append((ENC28J60_EHT1, 0x00))
+        regs.append((ENC28J60_EHT2, 0x00))
+        regs.append((ENC28J60_EHT3, 0x00))
+        regs.append((ENC28J60_EHT4, 0x00))
+        regs.append((ENC28J60_EHT5, 0x00))
+        regs.append((ENC28J60_EHT6, 0x00))
+        regs.append((ENC28J60_EHT7, 0x00))
 
         # Pull the MAC out of reset
-        self.ENC28J60_WriteReg(ENC28J60_MACON2, 0x00)
+        regs.append((ENC28J60_MACON2, 0x00))
 
         # Enable the MAC to receive frames
-        self.ENC28J60_WriteReg(ENC28J60_MACON1, ENC28J60_MACON1_TXPAUS | ENC28J60_MACON1_RXPAUS | ENC28J60_MACON1_MARXEN)
+        regs.append((ENC28J60_MACON1, ENC28J60_MACON1_TXPAUS | ENC28J60_MACON1_RXPAUS | ENC28J60_MACON1_MARXEN))
 
         # Enable automatic padding, always append a valid CRC and check frame length. MAC can operate in half-duplex or full-duplex mode
         if self.fullDuplex:
-            self.ENC28J60_WriteReg(ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN | ENC28J60_MACON3_FULDPX)
+            regs.append((ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN | ENC28J60_MACON3_FULDPX))
         else:
-            self.ENC28J60_WriteReg(ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN)
+            regs.append((ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN))
 
         # When the medium is occupied, the MAC will wait indefinitely for it to become free when attempting to transmit
-        self.ENC28J60_WriteReg(ENC28J60_MACON4, ENC28J60_MACON4_DEFER)
+        regs.append((ENC28J60_MACON4, ENC28J60_MACON4_DEFER))
 
         # Maximum frame length that can be received or transmitted
-        self.ENC28J60_WriteReg(ENC28J60_MAMXFLL, LSB(ENC28J60_ETH_RX_BUFFER_SIZE))
-        self.ENC28J60_WriteReg(ENC28J60_MAMXFLH, MSB(ENC28J60_ETH_RX_BUFFER_SIZE))
+        regs.append((ENC28J60_MAMXFLL, LSB(ENC28J60_ETH_RX_BUFFER_SIZE)))
+        regs.append((ENC28J60_MAMXFLH, MSB(ENC28J60_ETH_RX_BUFFER_SIZE)))
 
         # Configure the back-to-back inter-packet gap register
         if self.fullDuplex:
-            self.ENC28J60_WriteReg(ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_FD)
+            regs.append((ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_FD))
         else:
-            self.ENC28J60_WriteReg(ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_HD)
+            regs.append((ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_HD))
 
         # Configure the non-back-to-back inter-packet gap register
-        self.ENC28J60_WriteReg(ENC28J60_MAIPGL, ENC28J60_MAIPGL_DEFAULT)
-        self.ENC28J60_WriteReg(ENC28J60_MAIPGH, ENC28J60_MAIPGH_DEFAULT)
+        regs.append((ENC28J60_MAIPGL, ENC28J60_MAIPGL_DEFAULT))
+        regs.append((ENC28J60_MAIPGH, ENC28J60_MAIPGH_DEFAULT))
 
         # Collision window register
-        self.ENC28J60_WriteReg(ENC28J60_MACLCON2, ENC28J60_MACLCON2_COLWIN_DEFAULT)
+        regs.append((ENC28J60_MACLCON2, ENC28J60_MACLCON2_COLWIN_DEFAULT))
+
+        # One bank switch per bank, starting with the selected one. The sort is stable: the order inside a bank is kept
+        regs.sort(key=lambda reg: ((reg[0] & REG_BANK_MASK) != self._currentBank, reg[0] & REG_BANK_MASK))
+        self.ENC28J60_WriteRegs(regs)
 
         # Set the PHY to the proper duplex mode
         if self.fullDuplex:
@@ -565,34 +752,86 @@ class ENC28J60:
         # LEDA displays link status and LEDB displays TX/RX activity
         # self.ENC28J60_WritePhyReg(ENC28J60_PHLCON, ENC28J60_PHLCON_LACFG_LINK | ENC28J60_PHLCON_LBCFG_TX_RX | ENC28J60_PHLCON_LFRQ_40_MS | ENC28J60_PHLCON_STRCH)
 
-        # Clear interrupt flags
-        self.ENC28J60_WriteReg(ENC28J60_EIR, 0x00)
-
-        # Configure interrupts as desired
-        self.ENC28J60_WriteReg(ENC28J60_EIE, ENC28J60_EIE_INTIE | ENC28J60_EIE_PKTIE | ENC28J60_EIE_LINKIE)
-        # | ENC28J60_EIE_TXIE | ENC28J60_EIE_TXERIE)
-
         # Configure PHY interrupts as desired
         self.ENC28J60_WritePhyReg(ENC28J60_PHIE, ENC28J60_PHIE_PLNKIE | ENC28J60_PHIE_PGEIE)
 
-        # Set RXEN to enable reception
-        self.ENC28J60_WriteReg(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+        self.ENC28J60_WriteRegs([
+            # Clear interrupt flags
+            (ENC28J60_EIR, 0x00),
+            # Configure interrupts as desired, with an INT pin only packets drive it: LINKIF would hold INT low until PHIR is read
+            (ENC28J60_EIE, ENC28J60_EIE_INTIE | ENC28J60_EIE_PKTIE | (0 if self.ENC28J60_HasIntPin else ENC28J60_EIE_LINKIE)), # | ENC28J60_EIE_TXIE | ENC28J60_EIE_TXERIE
+            # Set RXEN to enable reception
+            (ENC28J60_ECON1, ENC28J60_ECON1_RXEN),
+        ])
+
+        # Start the continuous link status scan
+        if self.miiScan:
+            self.ENC28J60_StartMiiScan()
         # Show event
         self.ENC28J60_Event('Ethernet initialized')
+    @property
+    def ENC28J60_Session(self) -> ENC28J60_BusSession:
+        """with nic.ENC28J60_Session: holds the bus for a whole TX or RX operation"""
+        return self._session
     def ENC28J60_WriteSpi(self, data: bytearray) -> None:
-        self._cs.value = 0
-        with self._spi as bus:
-            bus.write(data)
-        self._cs.value = 1
+        acquired: bool = self._AcquireBus()
+        try:
+            # The bus is locked and configured, only frame the command with CS
+            self._cs.value = 0
+            self._bus.write(data)
+            self._cs.value = 1
+        finally:
+            if acquired: self._ReleaseBus()
+    def _AcquireBus(self) -> bool:
+        """Lock and configure the bus once for several commands, return False if it is already held"""
+        if self._bus is not None:
+            return False
+        bus: SPI = self._spi.spi
+        while not bus.try_lock():
+            pass
+        # Skipped when the ENC28J60 was the last device to configure this bus
+        self._spi.apply_configuration()
+        self._bus = bus
+        return True
+    def _ReleaseBus(self) -> None:
+        self._bus.unlock()
+        self._bus = None
     def ENC28J60_SoftReset(self) -> None:
         self._tmpBytearray1B[0] = ENC28J60_CMD_SRC
         self.ENC28J60_WriteSpi(self._tmpBytearray1B)
+        # Reset values, the other cached registers are learned on their first write
+        self._shadow.clear()
+        self._shadow[ENC28J60_ECON1] = 0x00
+        self._shadow[ENC28J60_ECON2] = ENC28J60_ECON2_AUTOINC
+        self._shadow[ENC28J60_EIE] = 0x00
         self.ENC28J60_Event('SPIDevice softreset')
+    @property
+    def ENC28J60_GetSpiOpsSaved(self) -> int:
+        """Number of SPI commands the shadow register cache made unnecessary"""
+        return self._spiOpsSaved
     def ENC28J60_ClearBit(self, address: int, mask: int) -> None:
+        owned: int = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            shadow: int = self._shadow.get(address, -1)
+            if shadow >= 0:
+                # Nothing to do when only cached bits are cleared and they are clear already
+                if (mask & ~owned) == 0 and (shadow & mask) == 0:
+                    self._spiOpsSaved += 1
+                    return None
+                self._shadow[address] = shadow & ~mask
         self._tmpBytearray2B[0] = (ENC28J60_CMD_BFC | (address & REG_ADDR_MASK))
         self._tmpBytearray2B[1] = mask
         self.ENC28J60_WriteSpi(self._tmpBytearray2B)
     def ENC28J60_SetBit(self, address: int, mask: int) -> None:
+        owned: int = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            shadow: int = self._shadow.get(address, -1)
+            if shadow >= 0:
+                # Nothing to do when only cached bits are set and they are set already
+                if (mask & ~owned) == 0 and (shadow & mask) == mask:
+                    self._spiOpsSaved += 1
+                    return None
+                self._shadow[address] = shadow | (mask & owned)
         self._tmpBytearray2B[0] = (ENC28J60_CMD_BFS | (address & REG_ADDR_MASK))
         self._tmpBytearray2B[1] = mask
         self.ENC28J60_WriteSpi(self._tmpBytearray2B)
@@ -600,8 +839,8 @@ class ENC28J60:
         # uint16_t address
         bank: int = address & REG_BANK_MASK
 
-        # Rewrite the bank number only if a change is detected
-        if (bank == self._currentBank):
+        # Rewrite the bank number only if a change is detected, EIE to ECON1 are mapped in every bank
+        if (bank == self._currentBank) or (address & REG_ADDR_MASK) >= (ENC28J60_EIE & REG_ADDR_MASK):
             return None
 
         # Select the relevant bank
@@ -620,6 +859,14 @@ class ENC28J60:
         self._currentBank = bank
         return None
     def ENC28J60_WriteReg(self, address: int, data: int) -> None:
+        owned: int = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            # A register the driver fully owns already holds data, skip the write and its bank switch
+            if owned == 0xFF and self._shadow.get(address, -1) == data:
+                self._spiOpsSaved += 1
+                return None
+            self._shadow[address] = data & owned
+
         # Make sure the corresponding bank is selected
         self.ENC28J60_SelectBank(address)
 
@@ -627,12 +874,28 @@ class ENC28J60:
         self._tmpBytearray2B[0] = (ENC28J60_CMD_WCR | (address & REG_ADDR_MASK))
         self._tmpBytearray2B[1] = data
         self.ENC28J60_WriteSpi(self._tmpBytearray2B)
+    def ENC28J60_WriteRegs(self, regs: list) -> None:
+        """Write a list of (address, value) pairs in order with one bus acquisition.
+        SelectBank skips repeated switches, so pairs of the same bank should be next to each other"""
+        acquired: bool = self._AcquireBus()
+        try:
+            for address, data in regs:
+                self.ENC28J60_WriteReg(address, data)
+        finally:
+            if acquired: self._ReleaseBus()
     def ENC28J60_ReadReg(self, address: int) -> int:
+        owned: int = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned == 0xFF and address in self._shadow:
+            self._spiOpsSaved += 1
+            return self._shadow[address]
+
        # Make sure the corresponding bank is selected
         self.ENC28J60_SelectBank(address)
 
-        self._cs.value = 0 # CS is acivate
-        with self._spi as bus:
+        acquired: bool = self._AcquireBus()
+        try:
+            bus: SPI = self._bus
+            self._cs.value = 0 # CS is acivate
             data: int = 0
             if (address & REG_TYPE_MASK) != ETH_REG_TYPE:
                 # Write opcode and register address
@@ -651,23 +914,57 @@ class ENC28J60:
                 bus.write_readinto(self._tmpBytearray2B, self._tmpBytearray2B)
                 data = self._tmpBytearray2B[1]
 
-        # Terminate the operation by raising the CS pin
-        self._cs.value = 1 # CS is deacivate
+            # Terminate the operation by raising the CS pin
+            self._cs.value = 1 # CS is deacivate
+        finally:
+            if acquired: self._ReleaseBus()
 
         # Return register contents
         return data
+    def ENC28J60_WaitMii(self, mask: int, operation: str) -> None:
+        """Poll MISTAT until the bits in mask are clear, a missing or unpowered chip reads 0xFF and never clears them"""
+        for _ in range(ENC28J60_MII_POLL_LIMIT):
+            if (self.ENC28J60_ReadReg(ENC28J60_MISTAT) & mask) == 0:
+                return None
+        raise RuntimeError(f"ENC28J60 MII {operation} timed out, is the chip connected?")
+    def ENC28J60_StartMiiScan(self) -> None:
+        """Let the MII interface read PHSTAT2 into MIRDL/MIRDH continuously"""
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_MIREGADR, ENC28J60_PHSTAT2 & REG_ADDR_MASK),
+            (ENC28J60_MICMD, ENC28J60_MICMD_MIISCAN),
+        ])
+
+        # Wait for the first scan result
+        self.ENC28J60_WaitMii(ENC28J60_MISTAT_NVALID, "scan")
+        self._miiScanning = True
+    def ENC28J60_StopMiiScan(self) -> None:
+        """Stop the MII scan, it has to be stopped before any other PHY access"""
+        self.ENC28J60_WriteReg(ENC28J60_MICMD, 0)
+
+        # Wait for the last scan cycle to complete
+        self.ENC28J60_WaitMii(ENC28J60_MISTAT_BUSY, "scan stop")
+        self._miiScanning = False
     def ENC28J60_WritePhyReg(self, address: int, data: int) -> None:
-        # Write register address
-        self.ENC28J60_WriteReg(ENC28J60_MIREGADR, address & REG_ADDR_MASK)
-        # Write the lower 8 bits
-        self.ENC28J60_WriteReg(ENC28J60_MIWRL, LSB(data))
-        # Write the upper 8 bits
-        self.ENC28J60_WriteReg(ENC28J60_MIWRH, MSB(data))
+        scanning: bool = self._miiScanning
+        if scanning: self.ENC28J60_StopMiiScan()
+
+        self.ENC28J60_WriteRegs([
+            # Write register address
+            (ENC28J60_MIREGADR, address & REG_ADDR_MASK),
+            # Write the lower 8 bits
+            (ENC28J60_MIWRL, LSB(data)),
+            # Write the upper 8 bits, this starts the PHY write
+            (ENC28J60_MIWRH, MSB(data)),
+        ])
 
         # Wait until the PHY register has been written
-        while (self.ENC28J60_ReadReg(ENC28J60_MISTAT) & ENC28J60_MISTAT_BUSY) != 0:
-            pass
+        self.ENC28J60_WaitMii(ENC28J60_MISTAT_BUSY, "PHY write")
+
+        if scanning: self.ENC28J60_StartMiiScan()
     def ENC28J60_ReadPhyReg(self, address: int) -> int:
+        scanning: bool = self._miiScanning
+        if scanning: self.ENC28J60_StopMiiScan()
+
         # Write register address
         self.ENC28J60_WriteReg(ENC28J60_MIREGADR, address & REG_ADDR_MASK)
 
@@ -675,8 +972,7 @@ class ENC28J60:
         self.ENC28J60_WriteReg(ENC28J60_MICMD, ENC28J60_MICMD_MIIRD)
 
         # Wait for the read operation to complete
-        while 0 != (self.ENC28J60_ReadReg(ENC28J60_MISTAT) & ENC28J60_MISTAT_BUSY):
-            pass
+        self.ENC28J60_WaitMii(ENC28J60_MISTAT_BUSY, "PHY read")
 
         # Clear command register
         self.ENC28J60_WriteReg(ENC28J60_MICMD, 0)
@@ -687,12 +983,16 @@ class ENC28J60:
         # Read the upper 8 bits
         data |= self.ENC28J60_ReadReg(ENC28J60_MIRDH) << 8
 
+        if scanning: self.ENC28J60_StartMiiScan()
+
         # Return register contents
         return data
     def ENC28J60_WriteBuffer(self, chunks: list):
-        self._cs.value = 0 # CS is activate
+        acquired: bool = self._AcquireBus()
+        try:
+            bus: SPI = self._bus
+            self._cs.value = 0 # CS is activate
 
-        with self._spi as bus:
             # Write opcode, Write per-packet control byte
             self._tmpBytearray2B[0] = ENC28J60_CMD_WBM
             self._tmpBytearray2B[1] = 0x00
@@ -702,13 +1002,17 @@ class ENC28J60:
             for data in chunks:
                 bus.write(data)
 
-        # Terminate the operation by raising the CS pin
-        self._cs.value = 1 # CS is deactivate
+            # Terminate the operation by raising the CS pin
+            self._cs.value = 1 # CS is deactivate
+        finally:
+            if acquired: self._ReleaseBus()
     def ENC28J60_ReadBuffer(self, data: bytearray | memoryview) -> None:
-        # Pull the CS pin low
-        self._cs.value = 0
+        acquired: bool = self._AcquireBus()
+        try:
+            bus: SPI = self._bus
+            # Pull the CS pin low
+            self._cs.value = 0
 
-        with self._spi as bus:
             # Write opcode
             self._tmpBytearray1B[0] = ENC28J60_CMD_RBM
             bus.write(self._tmpBytearray1B)
@@ -716,9 +1020,255 @@ class ENC28J60:
             # Copy data from SRAM buffer
             bus.readinto(data)
 
-        # Terminate the operation by raising the CS pin
-        self._cs.value = 1
+            # Terminate the operation by raising the CS pin
+            self._cs.value = 1
+        finally:
+            if acquired: self._ReleaseBus()
+    def ENC28J60_WriteSram(self, address: int, data: bytearray) -> None:
+        """Overwrite SRAM at address, without the per-packet control byte"""
+        with self._session as nic:
+            nic.ENC28J60_WriteRegs([
+                (ENC28J60_EWRPTL, LSB(address)),
+                (ENC28J60_EWRPTH, MSB(address)),
+            ])
+            self._cs.value = 0 # CS is activate
+            self._tmpBytearray1B[0] = ENC28J60_CMD_WBM
+            self._bus.write(self._tmpBytearray1B)
+            self._bus.write(data)
+            self._cs.value = 1 # CS is deactivate
+    def ENC28J60_ReadSram(self, address: int, data: bytearray) -> None:
+        """Read SRAM at address into data"""
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_ERDPTL, LSB(address)),
+            (ENC28J60_ERDPTH, MSB(address)),
+        ])
+        self._readPointer = -1 # ERDPT no longer points to the next packet
+        self.ENC28J60_ReadBuffer(data)
+    def ENC28J60_ProbeBus(self, seed: int=0) -> bool:
+        """Write a test pattern (XORed with seed) to the TX buffer and read it back, then read registers whose value is known.
+        False when the SPI clock is too fast for the wiring. The TX buffer content is lost"""
+        self.ENC28J60_WaitTxIdle()
+        pattern = bytearray(ENC28J60_PROBE_PATTERN)
+        for idx in range(len(pattern)):
+            pattern[idx] ^= seed & 0xFF
+        readback = bytearray(len(pattern))
+        self.ENC28J60_WriteSram(self._txStart, pattern)
+        self.ENC28J60_ReadSram(self._txStart, readback)
+        if readback != pattern:
+            return False
+        # ERDPT auto-incremented over the pattern, EREVID and the MAC address (MAC registers send a dummy byte first) are known
+        end: int = self._txStart + len(pattern)
+        return self.ENC28J60_ReadReg(ENC28J60_ERDPTL) == LSB(end) and self.ENC28J60_ReadReg(ENC28J60_ERDPTH) == MSB(end) and \
+            (self.ENC28J60_ReadReg(ENC28J60_EREVID) & ENC28J60_EREVID_REV) == self.ENC28J60_GetRevId and \
+            self.ENC28J60_ReadReg(ENC28J60_MAADR5) == self.macAddr[0] and self.ENC28J60_ReadReg(ENC28J60_MAADR0) == self.macAddr[5]
+    def ENC28J60_CalibrateBaudrate(self, minBaudrate: int=ENC28J60_BAUDRATE_MIN, maxBaudrate: int=ENC28J60_BAUDRATE_MAX,
+        margin: int=1, rounds: int=4, nvmOffset: int=-1) -> int:
+        """Double the SPI clock from minBaudrate while ENC28J60_ProbeBus passes rounds times, after a failure go back margin
+        steps below the last good rate. Call it after ENC28J60_Init. With nvmOffset >= 0 the chosen rate is kept in
+        microcontroller.nvm (when the board has one), the next boots only verify it. When minBaudrate itself fails the
+        baudrate the driver was built with is kept and nothing is cached. Return the baudrate in use.
+        A failed probe may call ENC28J60_Init again, the receive filters and hash table are then back to their defaults"""
+        busBaudrate: int = self._spi.baudrate # ENC28J60_Init worked at this rate
+        nvm = None
+        if nvmOffset >= 0:
+            from microcontroller import nvm # None on boards without nonvolatile memory
+            if nvm is not None and len(nvm) < nvmOffset + 6:
+                nvm = None
+        if nvm is not None:
+            tag, cached = struct.unpack("<2sI", bytes(nvm[nvmOffset:nvmOffset + 6]))
+            if tag == ENC28J60_BAUDRATE_NVM_TAG and minBaudrate <= cached <= maxBaudrate:
+                self._spi.baudrate = cached
+                if all(self.ENC28J60_ProbeBus(seed) for seed in range(rounds)):
+                    self.ENC28J60_Event(f"SPI baudrate {cached} (cached)")
+                    return cached
+
+        self._spi.baudrate = minBaudrate
+        if not all(self.ENC28J60_ProbeBus(seed) for seed in range(rounds)):
+            self._spi.baudrate = busBaudrate
+            if not self.ENC28J60_ProbeBus():
+                self.ENC28J60_Init()
+            self.ENC28J60_Event(f"SPI baudrate {busBaudrate}, {minBaudrate} does not work")
+            return busBaudrate
+        good: list = [minBaudrate]
+        failed: bool = False
+        rate: int = minBaudrate
+        while rate < maxBaudrate:
+            rate = min(rate * 2, maxBaudrate)
+            self._spi.baudrate = rate
+            if not all(self.ENC28J60_ProbeBus(seed) for seed in range(rounds)):
+                failed = True
+                break
+            good.append(rate)
+        # The last good rate is marginal when the next step failed
+        rate = good[max(0, len(good) - 1 - margin)] if failed else good[-1]
+        self._spi.baudrate = rate
+        if failed and not self.ENC28J60_ProbeBus():
+            # Writes at the failing rate may have hit the wrong registers
+            self.ENC28J60_Init()
+
+        if nvm is not None:
+            cache: bytes = struct.pack("<2sI", ENC28J60_BAUDRATE_NVM_TAG, rate)
+            if bytes(nvm[nvmOffset:nvmOffset + 6]) != cache: # flash wears out, write only when it changed
+                nvm[nvmOffset:nvmOffset + 6] = cache
+        self.ENC28J60_Event(f"SPI baudrate {rate}")
+        return rate
+    def ENC28J60_RxAddress(self, address: int, offset: int) -> int:
+        """address + offset inside the RX ring, wrapping at ERXND"""
+        address += offset
+        if address > self._rxStop:
+            address -= self._rxStop - self._rxStart + 1
+        return address
+    def ENC28J60_DmaChecksum(self, begin: int, end: int) -> int:
+        """One's complement checksum of SRAM[begin..end] (end included) computed by the DMA, same result as calcChecksum.
+        The DMA wraps at ERXND when the range is in the RX ring"""
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_EDMASTL, LSB(begin)),
+            (ENC28J60_EDMASTH, MSB(begin)),
+            (ENC28J60_EDMANDL, LSB(end)),
+            (ENC28J60_EDMANDH, MSB(end)),
+        ])
+        # CSUMEN stays set between checksums, the shadow cache skips setting it again
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_CSUMEN)
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_DMAST)
+
+        # DMAST is cleared by the chip when the checksum is ready
+        while (self.ENC28J60_ReadReg(ENC28J60_ECON1) & ENC28J60_ECON1_DMAST) != 0:
+            pass
+        return (self.ENC28J60_ReadReg(ENC28J60_EDMACSH) << 8) | self.ENC28J60_ReadReg(ENC28J60_EDMACSL)
+    def ENC28J60_SetRxFilter(self, flags: int) -> None:
+        """Write ERXFCON, ENC28J60_ERXFCON_* flags"""
+        self.ENC28J60_WriteReg(ENC28J60_ERXFCON, flags)
+    def ENC28J60_SetPatternFilter(self, fields: list, flags: int=-1) -> None:
+        """Program the pattern match filter, fields: [(offset, data)] bytes the frame must contain, offsets from the destination MAC.
+        All fields must fit in a 64 byte window. flags (ERXFCON) defaults to the init filters with PMEN instead of BCEN:
+        frames to our MAC still pass, broadcasts only pass if they match the pattern"""
+        first: int = min(offset for offset, data in fields)
+        last: int = max(offset + len(data) for offset, data in fields)
+        if last - first > 64:
+            raise ValueError(f"Pattern fields span {last - first} bytes, the window is 64")
+        # The lowest window covering the fields, a window running past the end of a short frame would fail it
+        window: int = max(0, last - 64)
+        pattern = bytearray(64)
+        mask = bytearray(8)
+        for offset, data in fields:
+            for idx in range(len(data)):
+                pattern[offset - window + idx] = data[idx]
+                mask[(offset - window + idx) >> 3] |= 1 << ((offset - window + idx) & 0x07)
+
+        # The chip checksums the selected bytes as one stream, the same way as the DMA
+        chksm: int = 0
+        high: bool = True
+        for idx in range(64):
+            if mask[idx >> 3] & (1 << (idx & 0x07)):
+                chksm += pattern[idx] << 8 if high else pattern[idx]
+                high = not high
+        chksm = (chksm >> 16) + (chksm & 0xFFFF)
+        chksm += chksm >> 16
+        chksm = ~chksm & 0xFFFF
+
+        if flags < 0:
+            flags = (self._rxFilterInit & ~ENC28J60_ERXFCON_BCEN) | ENC28J60_ERXFCON_PMEN
+        regs: list = [(ENC28J60_EPMM0 + idx, mask[idx]) for idx in range(8)]
+        regs.append((ENC28J60_EPMCSL, LSB(chksm)))
+        regs.append((ENC28J60_EPMCSH, MSB(chksm)))
+        regs.append((ENC28J60_EPMOL, LSB(window)))
+        regs.append((ENC28J60_EPMOH, MSB(window)))
+        regs.append((ENC28J60_ERXFCON, flags))
+        self.ENC28J60_WriteRegs(regs)
+    def ENC28J60_HashTableBit(self, macAddr: bytes) -> int:
+        """Bit of the hash table (0-63, EHT0 bit 0 first) selected by the destination macAddr: bits 28:23 of its CRC"""
+        crc: int = 0xFFFFFFFF
+        for byte in macAddr:
+            for _ in range(8):
+                # The CRC register shifts MSB first, the address bits come in LSB first
+                feedback: int = ((crc >> 31) ^ byte) & 0x01
+                crc = (crc << 1) & 0xFFFFFFFF
+                if feedback:
+                    crc ^= 0x04C11DB7
+                byte >>= 1
+        return (crc >> 23) & 0x3F
+    def ENC28J60_SetHashTable(self, table: bytearray) -> int:
+        """Write the 8 byte hash table, only the EHT registers that changed are written. Return their number"""
+        regs: list = []
+        for idx in range(8):
+            if table[idx] != self._hashTable[idx]:
+                regs.append((ENC28J60_EHT0 + idx, table[idx]))
+                self._hashTable[idx] = table[idx]
+        if regs:
+            self.ENC28J60_WriteRegs(regs)
+        return len(regs)
+    def ENC28J60_ClearPatternFilter(self) -> None:
+        """Back to the receive filters set by ENC28J60_Init"""
+        self.ENC28J60_SetRxFilter(self._rxFilterInit)
+    def ENC28J60_ReleasePacket(self, nextPacket: int) -> None:
+        """Give the RX ring back to the chip up to nextPacket, frames are released in the order they were received"""
+        # Advance the ERXRDPT pointer, taking care to wrap back at the end of the received memory buffer
+        if nextPacket == self._rxStart:
+            rxReadPointer: int = self._rxStop
+        else:
+            rxReadPointer = nextPacket - 1
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_ERXRDPTL, LSB(rxReadPointer)),
+            (ENC28J60_ERXRDPTH, MSB(rxReadPointer)),
+        ])
+    def ENC28J60_CheckRxOverflow(self) -> bool:
+        """True if frames were dropped because the RX ring was full or EPKTCNT saturated, counted in rxOverflows.
+        ReceivePacket calls it when an RSV reports a drop event, so the check costs nothing while no frame is lost"""
+        if (self.ENC28J60_ReadReg(ENC28J60_EIR) & ENC28J60_EIR_RXERIF) == 0:
+            return False
+        self.rxOverflows += 1
+        self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_RXERIF)
+        return True
+    def ENC28J60_ResetRx(self) -> None:
+        """Reset the receive logic and the RX ring, the frames it holds are lost"""
+        self.rxResets += 1
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_RXRST)
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_RXRST)
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_ERXSTL, LSB(self._rxStart)),
+            (ENC28J60_ERXSTH, MSB(self._rxStart)),
+            (ENC28J60_ERXNDL, LSB(self._rxStop)),
+            (ENC28J60_ERXNDH, MSB(self._rxStop)),
+            (ENC28J60_ERXRDPTL, LSB(self._rxStop)),
+            (ENC28J60_ERXRDPTH, MSB(self._rxStop)),
+        ])
+        self._nextPacket = self._rxStart
+        self._readPointer = -1
+        self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_RXERIF)
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+        self.ENC28J60_Event('RX ring reset')
+    @property
+    def ENC28J60_GetRxNextPacket(self) -> int:
+        """Address of the packet after the last received one, pass it to ENC28J60_ReleasePacket"""
+        return self._nextPacket
+    @property
+    def ENC28J60_GetRxFrameAddr(self) -> int:
+        """SRAM address of the first byte of the last received frame"""
+        return self._rxFrameAddr
+    def ENC28J60_DmaCopy(self, begin: int, end: int, dest: int) -> None:
+        """Copy SRAM[begin..end] (end included) to dest inside the chip, the source wraps at ERXND in the RX ring"""
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_EDMASTL, LSB(begin)),
+            (ENC28J60_EDMASTH, MSB(begin)),
+            (ENC28J60_EDMANDL, LSB(end)),
+            (ENC28J60_EDMANDH, MSB(end)),
+            (ENC28J60_EDMADSTL, LSB(dest)),
+            (ENC28J60_EDMADSTH, MSB(dest)),
+        ])
+        # With CSUMEN clear DMAST starts a copy, it is cleared by the chip when it is done
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_CSUMEN)
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_DMAST)
+        while (self.ENC28J60_ReadReg(ENC28J60_ECON1) & ENC28J60_ECON1_DMAST) != 0:
+            pass
+    @property
+    def ENC28J60_GetRxChecksum(self) -> int:
+        """DMA checksum of the last received frame, -1 if ReceivePacket did not compute it"""
+        return self._rxChecksum
     def ENC28J60_IsLinkUp(self) -> bool:
+        if self._miiScanning:
+            # MIRDH holds the upper byte of PHSTAT2, refreshed by the MII scan
+            return (self.ENC28J60_ReadReg(ENC28J60_MIRDH) & MSB(ENC28J60_PHSTAT2_LSTAT)) != 0
         return (self.ENC28J60_ReadPhyReg(ENC28J60_PHSTAT2) & ENC28J60_PHSTAT2_LSTAT) != 0
     def ENC28J60_IsLinkStateChanged(self) -> bool:
         # Read interrupt status register
@@ -726,7 +1276,6 @@ class ENC28J60:
 
         # Check whether the link state has changed
         if (status & ENC28J60_EIR_LINKIF) == 0:
-            self.ENC28J60_Event('Ethernet link stat has changed')
             return False
 
         # Clear PHY interrupts flags
@@ -734,14 +1283,146 @@ class ENC28J60:
 
         # Clear interrupt flag
         self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_LINKIF)
+        self.ENC28J60_Event('Ethernet link state has changed')
         return True
     def ENC28J60_GetRxPacketCnt(self) -> int:
         return self.ENC28J60_ReadReg(ENC28J60_EPKTCNT)
-    def ENC28J60_SendPacket(self, chunks: list) -> int:
+    @property
+    def ENC28J60_HasIntPin(self) -> bool:
+        return self._intCounter is not None or self._intKeys is not None
+    def ENC28J60_IsIntPending(self) -> bool:
+        """True when INT fell since the last call, always True without an INT pin. No SPI traffic"""
+        if self._intCounter is not None:
+            if self._intCounter.count == 0:
+                return False
+            self._intCounter.reset()
+            return True
+        if self._intKeys is not None:
+            pending: bool = False
+            while self._intKeys.events.get_into(self._intEvent):
+                pending = pending or self._intEvent.pressed
+            return pending
+        return True
+    def ENC28J60_RearmInt(self) -> None:
+        """Toggle INTIE so INT falls again if a packet is still pending, INT stays low without a new edge otherwise"""
+        if not self.ENC28J60_HasIntPin:
+            return None
+        self.ENC28J60_ClearBit(ENC28J60_EIE, ENC28J60_EIE_INTIE)
+        self.ENC28J60_SetBit(ENC28J60_EIE, ENC28J60_EIE_INTIE)
+    def ENC28J60_PollTx(self) -> bool:
+        """Non-blocking, True once the frame in flight is completed (or none is), its status is in ENC28J60_GetTxStatus.
+        Frames aborted by a late or excessive collision are sent again up to txRetryLimit times"""
+        if self._txInFlight is None:
+            return True
+        status: int = self.ENC28J60_ReadReg(ENC28J60_EIR)
+        if (status & (ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)) == 0:
+            return False
+        txStatus: ENC28J60_TxStatus = self._txStatus
+        if (status & ENC28J60_EIR_TXERIF) != 0:
+            # Errata: an aborted transmission can leave TXRTS set
+            self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+            self.ENC28J60_ClearBit(ENC28J60_ESTAT, ENC28J60_ESTAT_LATECOL | ENC28J60_ESTAT_TXABRT)
+            self.ENC28J60_ReadSram(self._txInFlight[1] + 1, self._tsv)
+            txStatus.decode(self._tsv, self._txAttempts)
+            if (txStatus.flags & (ENC28J60_TSV_LATE_COLLISION | ENC28J60_TSV_EXCESSIVE_COLLISION)) != 0 and self._txAttempts < self.txRetryLimit:
+                # The frame is still in the TX buffer, ETXST and ETXND still point to it
+                self._txAttempts += 1
+                self.txRetries += 1
+                self.ENC28J60_StartTx()
+                return False
+            # TXERIF: the frame was aborted, whatever the TSV says when TXRTS was stuck
+            txStatus.flags &= ~ENC28J60_TSV_DONE
+        elif self.txReadTsv:
+            self.ENC28J60_ReadSram(self._txInFlight[1] + 1, self._tsv)
+            txStatus.decode(self._tsv, self._txAttempts)
+        else:
+            # Sent without error in full duplex, padded to 60 bytes plus the CRC
+            txStatus.length = max(self._txInFlight[1] - self._txInFlight[0], 60) + 4
+            txStatus.wireLength = txStatus.length
+            txStatus.flags = ENC28J60_TSV_DONE
+            txStatus.retries = self._txAttempts
+        self._txInFlight = None
+
+        if txStatus.ok:
+            self.txFrames += 1
+            self.txBytes += txStatus.length
+        else:
+            self.txErrors += 1
+        self.txCollisions += txStatus.collisions
+        if txStatus.deferred: self.txDeferrals += 1
+        return True
+    def ENC28J60_WaitTx(self, timeout: int) -> bool:
+        """Wait up to timeout ms for the frame in flight, False if it is still being sent"""
+        start: int = ticks_ms()
+        while not self.ENC28J60_PollTx():
+            if ticksDiff(ticks_ms(), start) >= timeout:
+                self.txTimeouts += 1
+                return False
+        return True
+    def ENC28J60_WaitTxIdle(self, timeout: int=ENC28J60_TX_IDLE_TIMEOUT) -> bool:
+        """Wait until the frame on the wire has been sent. A frame still in flight after timeout ms (errata: TXRTS
+        can stay set) is sent again up to txRetryLimit times, then aborted. False if it was aborted"""
+        while not self.ENC28J60_WaitTx(timeout):
+            if self._txAttempts >= self.txRetryLimit:
+                self.ENC28J60_AbortTx()
+                return False
+            # StartTx resets the transmit logic, ETXST and ETXND still point to the frame
+            self._txAttempts += 1
+            self.txRetries += 1
+            self.ENC28J60_StartTx()
+        return True
+    def ENC28J60_AbortTx(self) -> None:
+        """Reset the transmit logic and drop the frame in flight, it is counted as an error"""
+        if self._txInFlight is None:
+            return None
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+        self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
+        txStatus: ENC28J60_TxStatus = self._txStatus
+        txStatus.length = 0
+        txStatus.wireLength = 0
+        txStatus.flags = 0 # not done: aborted
+        txStatus.retries = self._txAttempts
+        self._txInFlight = None
+        self.txErrors += 1
+    @property
+    def ENC28J60_GetTxStatus(self) -> ENC28J60_TxStatus:
+        """Status of the last completed frame, updated by ENC28J60_PollTx"""
+        return self._txStatus
+    def ENC28J60_StartTx(self) -> None:
+        """Send the frame between ETXST and ETXND"""
+        # It is recommended to reset the transmit logic before attempting to transmit a packet
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+
+        # Interrupt flags should be cleared after the reset is completed
+        self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
+
+        # Start transmission
+        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+    def ENC28J60_SendPacket(self, chunks: list, checksums: list=None, copyFrom: tuple=None, timeout: int=None) -> int:
+        """checksums: [(csBegin, csEnd, csField, csSeed)] offsets in the frame, the DMA checksums frame[csBegin:csEnd]
+        plus csSeed (an unfolded sum, e.g. the pseudo-header) and the result is written at frame[csField].
+        copyFrom: (address, length) of data kept in the RX ring, the DMA appends it after the chunks.
+        timeout: ms to wait for the frame to be sent, None returns as soon as the transmission is started"""
+        # The bus is locked and configured once for all the opcodes of the frame
+        with self._session:
+            length: int = self._SendPacket(chunks, checksums, copyFrom)
+        if timeout is None or length < 0:
+            return length
+        if not self.ENC28J60_WaitTx(timeout):
+            return ENC28J60_ETH_TX_ERR_TIMEOUT
+        if not self._txStatus.ok:
+            return ENC28J60_ETH_TX_ERR_ABORTED
+        return length
+    def _SendPacket(self, chunks: list, checksums: list, copyFrom: tuple) -> int:
         # Retrieve the length of the packet
         length: int = 0
         for data in chunks:
             length += len(data)
+        if copyFrom is not None:
+            length += copyFrom[1]
 
         # Check the frame length
         if length > ENC28J60_ETH_TX_BUFFER_SIZE:
@@ -751,41 +1432,91 @@ class ENC28J60:
         if self.ENC28J60_IsLinkUp() == False:
             return ENC28J60_ETH_TX_ERR_LINKDOWN
 
-        # It is recommended to reset the transmit logic before attempting to transmit a packet
-        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
-        self.ENC28J60_ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
-
-        # Interrupt flags should be cleared after the reset is completed
-        self.ENC28J60_ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
-
-        # Set transmit buffer location
-        self.ENC28J60_WriteReg(ENC28J60_ETXSTL, LSB(ENC28J60_TX_BUFFER_START))
-        self.ENC28J60_WriteReg(ENC28J60_ETXSTH, MSB(ENC28J60_TX_BUFFER_START))
-
-        # Point to start of transmit buffer
-        self.ENC28J60_WriteReg(ENC28J60_EWRPTL, LSB(ENC28J60_TX_BUFFER_START))
-        self.ENC28J60_WriteReg(ENC28J60_EWRPTH, MSB(ENC28J60_TX_BUFFER_START))
+        # Pick the next slot, a frame larger than a slot uses the whole TX buffer
+        if length + 1 + ENC28J60_TX_STATUS_VECTOR_SIZE <= self._txSlotSize:
+            start: int = self._txStart + self._txSlot * self._txSlotSize
+            self._txSlot = (self._txSlot + 1) % self.txSlots
+        else:
+            start = self._txStart
+            self._txSlot = 1 % self.txSlots
+        # The control byte is at start, ETXND points to the last byte of the frame
+        end: int = start + length
+
+        # Never overwrite the frame that is still on the wire (including its status vector)
+        if self._txInFlight is not None:
+            if start <= self._txInFlight[1] + ENC28J60_TX_STATUS_VECTOR_SIZE and self._txInFlight[0] <= end + ENC28J60_TX_STATUS_VECTOR_SIZE:
+                self.ENC28J60_WaitTxIdle()
+
+        # Point to start of the slot
+        self.ENC28J60_WriteRegs([
+            (ENC28J60_EWRPTL, LSB(start)),
+            (ENC28J60_EWRPTH, MSB(start)),
+        ])
 
         # Copy the data to the transmit buffer
         self.ENC28J60_WriteBuffer(chunks)
-
-        # ETXND should point to the last byte in the data payload
-        self.ENC28J60_WriteReg(ENC28J60_ETXNDL, LSB(ENC28J60_TX_BUFFER_START + length))
-        self.ENC28J60_WriteReg(ENC28J60_ETXNDH, MSB(ENC28J60_TX_BUFFER_START + length))
-
-        # Start transmission
-        self.ENC28J60_SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+        if copyFrom is not None and copyFrom[1] > 0:
+            # The tail of the frame is copied from the RX ring inside the chip, it never crosses SPI
+            self.ENC28J60_DmaCopy(copyFrom[0], self.ENC28J60_RxAddress(copyFrom[0], copyFrom[1] - 1), end - copyFrom[1] + 1)
+
+        # Fill in the checksums over the data already in the TX buffer, the frame starts after the control byte
+        if checksums:
+            for csBegin, csEnd, csField, csSeed in checksums:
+                chksm: int = (~self.ENC28J60_DmaChecksum(start + 1 + csBegin, start + csEnd) & 0xFFFF) + csSeed
+                while chksm >> 16:
+                    chksm = (chksm >> 16) + (chksm & 0xFFFF)
+                # 0x0000 and 0xFFFF are the same in one's complement, a zero UDP checksum would mean "no checksum"
+                chksm = (~chksm & 0xFFFF) or 0xFFFF
+                self._tmpChecksum2B[0] = MSB(chksm)
+                self._tmpChecksum2B[1] = LSB(chksm)
+                self.ENC28J60_WriteSram(start + 1 + csField, self._tmpChecksum2B)
+
+        # ETXST and ETXND must not change while the previous frame is being sent
+        self.ENC28J60_WaitTxIdle()
+
+        self.ENC28J60_WriteRegs([
+            # Set transmit buffer location
+            (ENC28J60_ETXSTL, LSB(start)),
+            (ENC28J60_ETXSTH, MSB(start)),
+            # ETXND should point to the last byte in the data payload
+            (ENC28J60_ETXNDL, LSB(end)),
+            (ENC28J60_ETXNDH, MSB(end)),
+        ])
+
+        self.ENC28J60_StartTx()
+        self._txInFlight = (start, end)
+        self._txAttempts = 0
         return length
-    def ENC28J60_ReceivePacket(self, rxBuffer: bytearray) -> int:
-        if self.ENC28J60_GetRxPacketCnt() == 0:
+    def ENC28J60_ReceivePacket(self, rxBuffer: bytearray, pending: bool=False, checksumFrom: int=0, checksumMin: int=0, keep: bool=False) -> int:
+        """Read the next frame into rxBuffer, pending=True skips the EPKTCNT check when the caller already did it.
+        checksumFrom > 0 lets the DMA checksum frames of at least checksumMin bytes from that offset to the CRC.
+        keep=True leaves the frame in the RX ring (for DMA copies) until ENC28J60_ReleasePacket(ENC28J60_GetRxNextPacket)"""
+        # The bus is locked and configured once for all the opcodes of the frame
+        with self._session:
+            return self._ReceivePacket(rxBuffer, pending, checksumFrom, checksumMin, keep)
+    def _ReceivePacket(self, rxBuffer: bytearray, pending: bool, checksumFrom: int, checksumMin: int, keep: bool) -> int:
+        if not pending and self.ENC28J60_GetRxPacketCnt() == 0:
             return 0
-    
-        # Point to the start of the received packet
-        self.ENC28J60_WriteReg(ENC28J60_ERDPTL, LSB(self._nextPacket))
-        self.ENC28J60_WriteReg(ENC28J60_ERDPTH, MSB(self._nextPacket))
+        packetStart: int = self._nextPacket
+        self._rxChecksum = -1
+        self._rxFrameAddr = self.ENC28J60_RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE)
+
+        # Point to the start of the received packet, the previous burst normally left ERDPT there already
+        if self._readPointer != self._nextPacket:
+            self.ENC28J60_WriteRegs([
+                (ENC28J60_ERDPTL, LSB(self._nextPacket)),
+                (ENC28J60_ERDPTH, MSB(self._nextPacket)),
+            ])
+
+        # Header and frame are read in one RBM burst, the read pointer auto-increments and wraps inside the RX buffer
+        bus: SPI = self._bus
+        self._cs.value = 0 # CS is activate
+        # Write opcode
+        self._tmpBytearray1B[0] = ENC28J60_CMD_RBM
+        bus.write(self._tmpBytearray1B)
 
         # The packet is preceded by a 6-byte header
-        self.ENC28J60_ReadBuffer(self._tmpBytearray6B)
+        bus.readinto(self._tmpBytearray6B)
 
         # Unpack header, little-endian
         headerStruct: tuple = struct.unpack("<HHH", self._tmpBytearray6B)
@@ -799,25 +1530,50 @@ class ENC28J60:
         # Get the receive status vector (RSV)
         status: int = headerStruct[2]
 
+        # Frames start at even addresses inside the ring, any other pointer means the header is garbage
+        if self._nextPacket < self._rxStart or self._nextPacket > self._rxStop or (self._nextPacket & 0x01) != 0:
+            self._cs.value = 1 # CS is deactivate
+            self.ENC28J60_ResetRx()
+            return ENC28J60_ETH_RX_ERR_RESET
+
         # Make sure no error occurred
+        whole: bool = False
         if (status & ENC28J60_RSV_RECEIVED_OK) != 0:
             # Limit the number of data to read
+            whole = length <= ENC28J60_ETH_RX_BUFFER_SIZE and length <= len(rxBuffer)
             length = min(length, ENC28J60_ETH_RX_BUFFER_SIZE)
             length = min(length, len(rxBuffer))
 
             # Read the Ethernet frame
-            self.ENC28J60_ReadBuffer(memoryview(rxBuffer)[0:length])
+            bus.readinto(memoryview(rxBuffer)[0:length])
+
+            # Frames start at even addresses, also read the padding byte so ERDPT lands on the next packet
+            if whole and (length & 0x01) != 0:
+                bus.readinto(self._tmpBytearray1B)
         else:
             # The received packet contains an error
             length = ENC28J60_ETH_RX_ERR_UNSPECIFIED
+            self.rxErrors += 1
+            if (status & ENC28J60_RSV_CRC_ERROR) != 0: self.rxCrcErrors += 1
+            if (status & ENC28J60_RSV_LENGTH_CHECK_ERROR) != 0: self.rxLengthErrors += 1
 
-        # Advance the ERXRDPT pointer, taking care to wrap back at the end of the received memory buffer
-        if self._nextPacket == ENC28J60_RX_BUFFER_START:
-            self.ENC28J60_WriteReg(ENC28J60_ERXRDPTL, LSB(ENC28J60_RX_BUFFER_STOP))
-            self.ENC28J60_WriteReg(ENC28J60_ERXRDPTH, MSB(ENC28J60_RX_BUFFER_STOP))
-        else:
-            self.ENC28J60_WriteReg(ENC28J60_ERXRDPTL, LSB(self._nextPacket - 1))
-            self.ENC28J60_WriteReg(ENC28J60_ERXRDPTH, MSB(self._nextPacket - 1))
+        # Terminate the operation by raising the CS pin
+        self._cs.value = 1 # CS is deactivate
+        self._readPointer = self._nextPacket if whole else -1
+
+        # Frames were dropped between the previous frame and this one
+        if (status & ENC28J60_RSV_DROP_EVENT) != 0:
+            self.rxDropEvents += 1
+            self.ENC28J60_CheckRxOverflow()
+
+        # The frame is still in the RX ring until ERXRDPT moves, the DMA can checksum it there
+        if checksumFrom > 0 and whole and length >= checksumMin and checksumFrom < length - 4:
+            self._rxChecksum = self.ENC28J60_DmaChecksum(
+                self.ENC28J60_RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE + checksumFrom),
+                self.ENC28J60_RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE + length - 4 - 1))
+
+        if not keep:
+            self.ENC28J60_ReleasePacket(self._nextPacket)
 
         # Decrement the packet counter
         self.ENC28J60_SetBit(ENC28J60_ECON2, ENC28J60_ECON2_PKTDEC)
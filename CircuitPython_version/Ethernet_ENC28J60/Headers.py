@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# This is version for circuitpython 7.2 or higher and MicroPython v1.17,
+# the same file is used by CircuitPython_version/Ethernet_ENC28J60/Network.py and MicroPython_version/examples/Ntw.py
+
+# This file implements the header layouts of the IP stack: Ethernet, ARP, IPv4, ICMPv4 and UDP.
+# Fields are read at fixed offsets from the frame: no format string is parsed per packet and a field costs
+# no bytes object. Neither port has struct.Struct to precompile a format.
+
+from micropython import const
+
+__version__ = '0.1.0v'
+__repo__ = 'https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60'
+
+# Ethernet, from the frame start
+ETH_DST             = const(0)
+ETH_SRC             = const(6)
+ETH_TYPE            = const(12)
+ETH_HDR_LEN         = const(14)
+ETH_VLAN_TYPE       = const(16) # EtherType after an 802.1Q tag
+ETH_VLAN_HDR_LEN    = const(18)
+
+# ARP for IPv4 over Ethernet, from the ARP header
+ARP_HTYPE           = const(0)
+ARP_PTYPE           = const(2)
+ARP_OPER            = const(6)
+ARP_SHA             = const(8)
+ARP_SPA             = const(14)
+ARP_THA             = const(18)
+ARP_TPA             = const(24)
+ARP_HDR_LEN         = const(28)
+
+# IPv4, from the IPv4 header
+IP4_VER_IHL         = const(0)
+IP4_TOS             = const(1)
+IP4_TOTLEN          = const(2)
+IP4_IDENT           = const(4)
+IP4_FLAGS_FRAG      = const(6)
+IP4_TTL             = const(8)
+IP4_PROTO           = const(9)
+IP4_CHKSM           = const(10)
+IP4_SRC             = const(12)
+IP4_DST             = const(16)
+IP4_HDR_LEN         = const(20) # without options
+
+IP4_FLAG_MF         = const(0x2000)
+IP4_FRAG_MASK       = const(0x1FFF)
+IP4_BCAST_HALF      = const(0xFFFF) # both 16 bit words of 255.255.255.255
+
+# ICMPv4, from the ICMP header
+ICMP4_TYPE          = const(0)
+ICMP4_CODE          = const(1)
+ICMP4_CHKSM         = const(2)
+ICMP4_HDR_LEN       = const(4) # type, code, checksum; echo identifier and sequence follow
+
+# UDP, from the UDP header
+UDP_SRC_PORT        = const(0)
+UDP_DST_PORT        = const(2)
+UDP_LEN             = const(4)
+UDP_CHKSM           = const(6)
+UDP_HDR_LEN         = const(8)
+
+
+def u16(buf, offset):
+    '''Big-endian 16 bit field at offset'''
+    return (buf[offset] << 8) | buf[offset + 1]
+
+
+def putU16(buf, offset, value):
+    buf[offset] = (value >> 8) & 0xFF
+    buf[offset + 1] = value & 0xFF
+
+
+def copyAddr(dst, buf, offset):
+    '''Copy the IPv4 address at offset into dst, a bytearray(4) kept by its owner: no slice or bytes object'''
+    dst[0] = buf[offset]
+    dst[1] = buf[offset + 1]
+    dst[2] = buf[offset + 2]
+    dst[3] = buf[offset + 3]
+
+
+def addrSum(buf, offset=0):
+    '''Sum of the two 16 bit words of an IPv4 address, its share of a pseudo header checksum'''
+    return ((buf[offset] << 8) | buf[offset + 1]) + ((buf[offset + 2] << 8) | buf[offset + 3])
+
@@ -17,7 +17,10 @@
 from micropython import const
 import ENC28J60
 from Protection import DOS
-import struct
+from supervisor import ticks_ms
+from Headers import u16, putU16, addrSum, copyAddr, ETH_DST, ETH_SRC, ETH_TYPE, ETH_HDR_LEN, ETH_VLAN_TYPE, ETH_VLAN_HDR_LEN, \
+    ARP_OPER, ARP_SHA, ARP_SPA, ARP_TPA, IP4_VER_IHL, IP4_TOTLEN, IP4_IDENT, IP4_FLAGS_FRAG, IP4_PROTO, IP4_CHKSM, IP4_SRC, IP4_DST, \
+    IP4_HDR_LEN, IP4_FLAG_MF, IP4_FRAG_MASK, IP4_BCAST_HALF, UDP_SRC_PORT, UDP_DST_PORT, UDP_LEN, UDP_CHKSM, UDP_HDR_LEN
 
 __version__ = '0.4.0v'
 __repo__ = 'https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60'
@@ -43,11 +46,41 @@ ICMP4_ECHO_REPLY = const(0)
 ICMP4_UNREACHABLE = const(3)
 ICMP4_ECHO_REQUEST = const(8)
 
+# Shorter data is cheaper to checksum in Python than with the ENC28J60 DMA (about a dozen SPI commands)
+CHECKSUM_OFFLOAD_MIN = const(256)
+# Echo replies with at least this much data are reflected: the data is copied from the RX ring by the ENC28J60 DMA
+# (8 more SPI commands, but no copy, checksum or transfer of the data in Python)
+REFLECT_MIN = const(64)
+# Link monitor: LINKIF is polled this often (ms), a new link state counts once it held this long (ms)
+LINK_POLL_INTERVAL = const(500)
+LINK_DEBOUNCE = const(1000)
+# Frames sent while the link is down are held, up to this many, and sent when it returns
+TX_HOLD_MAX = const(4)
+# txPkt result for a held frame
+TX_HELD = const(0)
+
 class Network:
     """This class handle network protcol: ARP, ICMP, IP, UDP, TCP"""
-    def __init__(self, nicSpi, nicCsPin, dosConf: tuple):
-        self.rxBuff = bytearray(ENC28J60.ENC28J60_ETH_RX_BUFFER_SIZE)
-        self.nic = ENC28J60.ENC28J60(nicSpi, nicCsPin)
+    def __init__(self, nicSpi, nicCsPin, dosConf: tuple, rxPoolSize: int=4, nicIntPin=None, nicSharedBus: bool=False,
+        nicRxBufferSize: int=ENC28J60.ENC28J60_RX_BUFFER_STOP - ENC28J60.ENC28J60_RX_BUFFER_START + 1):
+        # RX frame pool: frames are drained from the NIC into free buffers, then processed
+        self.rxPool: list = [Packet(self, bytearray(ENC28J60.ENC28J60_ETH_RX_BUFFER_SIZE), 0) for _ in range(rxPoolSize)]
+        self.rxFree: list = list(self.rxPool) # free list, used as a stack
+        self.rxFreeCnt: int = rxPoolSize
+        self.rxReady: list = [None] * rxPoolSize # received frames waiting for processing, ring
+        self.rxReadyHead: int = 0
+        self.rxReadyCnt: int = 0
+        # Queued frames kept in the NIC RX ring for their handler, see rxKeepInNic
+        self.rxNicKept: int = 0
+        # Checksums over at least this many bytes are computed by the NIC DMA
+        self.checksumOffloadMin: int = CHECKSUM_OFFLOAD_MIN
+        self.reflectMin: int = REFLECT_MIN
+        self.nic = ENC28J60.ENC28J60(nicSpi, nicCsPin, intPin=nicIntPin, sharedBus=nicSharedBus, rxBufferSize=nicRxBufferSize)
+        # A drop is reported in the RSV of the next received frame only: EIR.RXERIF is also checked from the drain when
+        # EPKTCNT reaches 3/4 of what the ring holds in minimum size frames, and when the NIC is found empty after frames
+        rxCapacity: int = self.nic.ENC28J60_GetRxCapacity(60)
+        self.rxNicHigh: int = rxCapacity - rxCapacity // 4
+        self.rxNicPending: bool = False
 
         # Eth settings:
         self.myMacAddr = self.nic.ENC28J60_GetMacAddr
@@ -56,8 +89,15 @@ class Network:
         self.myIp4Addr: bytearray
         self.netIp4Mask: bytearray
         self.gwIp4Addr: bytearray
+        # myIp4Addr as two 16 bit words, compared with received addresses: small ints, a 32 bit one would be a long
+        self.myIp4Hi: int = -1
+        self.myIp4Lo: int = -1
         self.configIp4Done: bool = False
 
+        # Hardware RX filter: the UDP port of the broadcast pattern, None for ARP requests for my IP
+        self.rxFilterUdpPort = None
+        self.rxFilterOn: bool = False
+
         # Stats
         self.ip4TxCount: int = 0
         self.ip4RxCount: int = 0
@@ -65,6 +105,30 @@ class Network:
         self.arpTable = {}
         self.udp4UniBind = {} # {port:callback(Pkt)}
         self.udp4BcastBind = {} # {port:callback(Pkt)}
+        # Protocol handlers, frames and datagrams of other types are dropped before their headers are decoded
+        self.ethHandlers = {ETH_TYPE_IP4: procIp4, ETH_TYPE_ARP: procArp} # {EtherType:handler(Pkt)}
+        self.ip4Handlers = {IP4_TYPE_ICMP: procIcmp4, IP4_TYPE_UDP: procUdp4, IP4_TYPE_TCP: procTcp4} # {proto:handler(Pkt, bcast)}
+        # Multicast: {group IP: joins}, groups per NIC hash table bit and the table as written to the NIC
+        self.mcastGroups = {}
+        self.mcastWords: list = [] # (high, low) 16 bit words of each joined group, procIp4 matches without a bytes object
+        self.mcastHashRef = [0] * 64 # a bytearray would overflow at 256 groups on one bit
+        self.mcastHashTable = bytearray(8)
+
+        # Link monitor: debounced state, raw state and when it last changed, callbacks cb(up: bool)
+        self.linkUp: bool = False
+        self.linkRaw: bool = False
+        self.linkRawSince: int = 0
+        self.linkPollNext: int = 0
+        self.linkPollInterval: int = LINK_POLL_INTERVAL
+        self.linkDebounce: int = LINK_DEBOUNCE
+        self.linkCallbacks: list = []
+        self.linkFlaps: int = 0
+        # Frames held while the link is down: (frame, checksums)
+        self.txHold: list = []
+        self.txHoldMax: int = TX_HOLD_MAX
+        self.txHoldDropped: int = 0
+        # SPI tracer, see traceSpi
+        self.spiTracer = None
 
         # Queues: mehrdad-mixtape
         self.ARP_Q = []
@@ -92,43 +156,250 @@ class Network:
             2. client and server should be in same network
             3. power-off and power-on the system""")
         else: self.event("ENC28J60 revision ID: 0x{:02x}".format(self.nic.ENC28J60_GetRevId))
+        self.nic.ENC28J60_IsLinkStateChanged()
+        self.linkUp = self.linkRaw = self.nic.ENC28J60_IsLinkUp()
+        self.linkPollNext = ticks_ms()
     def setIPv4(self, myIp4Addr: list, netIp4Mask: list, gwIp4Addr: list) -> None:
         self.myIp4Addr = bytearray(myIp4Addr)
+        self.myIp4Hi = u16(self.myIp4Addr, 0)
+        self.myIp4Lo = u16(self.myIp4Addr, 2)
         self.netIp4Mask = bytearray(netIp4Mask)
         self.gwIp4Addr = bytearray(gwIp4Addr)
         self.configIp4Done = True
+        if self.rxFilterOn and self.rxFilterUdpPort is None:
+            # The ARP pattern contains my IP
+            self.setRxFilter()
+    def setRxFilter(self, bcastUdpPort: int=None) -> None:
+        '''Let the NIC drop broadcast chatter before it costs an SPI read. Frames to my MAC (and multicast if enabled)
+        still pass, a broadcast passes if it is an ARP request for my IP, or with bcastUdpPort an IPv4 UDP datagram to that port.
+        The ENC28J60 has a single pattern: with bcastUdpPort ARP requests are dropped, peers need a static ARP entry'''
+        self.rxFilterOn = True
+        self.rxFilterUdpPort = bcastUdpPort
+        if bcastUdpPort is not None:
+            self.nic.ENC28J60_SetPatternFilter(makeUdp4PortPattern(bcastUdpPort))
+        elif self.configIp4Done:
+            self.nic.ENC28J60_SetPatternFilter(makeArpRequestPattern(self.myIp4Addr))
+    def clearRxFilter(self) -> None:
+        self.rxFilterOn = False
+        self.rxFilterUdpPort = None
+        self.nic.ENC28J60_ClearPatternFilter()
+    def restoreNicFilters(self) -> None:
+        '''Write the RX filter and the multicast hash table again after ENC28J60_Init reset them'''
+        if self.rxFilterOn:
+            self.setRxFilter(self.rxFilterUdpPort)
+        self.nic.ENC28J60_SetHashTable(self.mcastHashTable)
     @property
     def isIPv4Configured(self) -> bool:
         return self.configIp4Done
+    def getEthMTU(self) -> int:
+        return 1500
     @property
     def isEmptyUdpQ(self) -> bool:
         if len(self.UDP_Q) == 0: return True
         else: return False
     def event(self, msg: str) -> None:
         print(f"Network: {msg}")
+    def rxDrainNic(self) -> int:
+        '''Function to move pending packets from NIC into free pool buffers'''
+        queued = 0
+        rxPacketCnt = self.nic.ENC28J60_GetRxPacketCnt()
+        if rxPacketCnt >= self.rxNicHigh or (rxPacketCnt == 0 and self.rxNicPending):
+            self.nic.ENC28J60_CheckRxOverflow()
+        self.rxNicPending = rxPacketCnt > 0
+        # Packets that don't fit in the pool stay in the NIC RX buffer until the next call
+        while rxPacketCnt > 0 and self.rxFreeCnt > 0:
+            rxPacketCnt -= 1
+            pkt = self.rxFree[self.rxFreeCnt - 1]
+            # The ring space is given back here, or once processed for the frames a handler reads from the ring
+            rxLen = self.nic.ENC28J60_ReceivePacket(pkt.frame, pending=True, keep=True)
+            if rxLen == ENC28J60.ENC28J60_ETH_RX_ERR_RESET:
+                # The NIC reset its RX ring, queued frames are only left in their pool buffers
+                for i in range(self.rxReadyCnt):
+                    queuedPkt = self.rxReady[(self.rxReadyHead + i) % len(self.rxReady)]
+                    queuedPkt.nic_addr = -1
+                    queuedPkt.nic_next = -1
+                self.rxNicKept = 0
+                break
+            if rxLen <= 0:
+                self.event(f"Rx ERROR {rxLen}")
+                if self.rxNicKept > 0:
+                    # Released together with the last queued frame, releasing it now would free the kept ones too
+                    self.rxReady[(self.rxReadyHead + self.rxReadyCnt - 1) % len(self.rxReady)].nic_next = self.nic.ENC28J60_GetRxNextPacket
+                else:
+                    self.nic.ENC28J60_ReleasePacket(self.nic.ENC28J60_GetRxNextPacket)
+                continue
+            self.rxFreeCnt -= 1
+            pkt.frame_len = rxLen
+            pkt.nic_next = self.nic.ENC28J60_GetRxNextPacket
+            if self.rxKeepInNic(pkt.frame, rxLen):
+                pkt.nic_addr = self.nic.ENC28J60_GetRxFrameAddr
+                self.rxNicKept += 1
+            else:
+                pkt.nic_addr = -1
+                if self.rxNicKept == 0:
+                    self.nic.ENC28J60_ReleasePacket(pkt.nic_next)
+                    pkt.nic_next = -1
+            self.rxReady[(self.rxReadyHead + self.rxReadyCnt) % len(self.rxReady)] = pkt
+            self.rxReadyCnt += 1
+            queued += 1
+        return queued
+    def rxKeepInNic(self, frame: memoryview, frameLen: int) -> bool:
+        '''True for a frame its handler reads from the NIC RX ring: an ICMP echo request to my IP that is reflected, or
+        a UDP datagram to my IP whose checksum procUdp4 leaves to the DMA. Other frames give their ring space back when
+        they are drained'''
+        if (frame[ETH_DST] & 0x01) != 0 or u16(frame, ETH_TYPE) != ETH_TYPE_IP4:
+            return False
+        if u16(frame, ETH_HDR_LEN + IP4_DST + 2) != self.myIp4Lo or u16(frame, ETH_HDR_LEN + IP4_DST) != self.myIp4Hi:
+            return False
+        offset: int = ETH_HDR_LEN + ((frame[ETH_HDR_LEN + IP4_VER_IHL] & 0x0F) << 2)
+        dataLen: int = ETH_HDR_LEN + u16(frame, ETH_HDR_LEN + IP4_TOTLEN) - offset
+        if frame[ETH_HDR_LEN + IP4_PROTO] == IP4_TYPE_ICMP:
+            return frame[offset] == ICMP4_ECHO_REQUEST and dataLen - 4 >= self.reflectMin
+        if frame[ETH_HDR_LEN + IP4_PROTO] == IP4_TYPE_UDP:
+            return dataLen >= self.checksumOffloadMin and u16(frame, offset + UDP_CHKSM) != 0
+        return False
+    def rxReleaseNic(self, pkt) -> None:
+        '''Give the NIC RX ring space of pkt back. The ring is released in order: frames drained behind a kept frame
+        are released with it when it is the last kept one'''
+        nextPacket: int = pkt.nic_next
+        if nextPacket < 0:
+            return None
+        pkt.nic_next = -1
+        if pkt.nic_addr >= 0:
+            pkt.nic_addr = -1
+            self.rxNicKept -= 1
+            if self.rxNicKept == 0 and self.rxReadyCnt > 0:
+                lastPkt = self.rxReady[(self.rxReadyHead + self.rxReadyCnt - 1) % len(self.rxReady)]
+                if lastPkt.nic_next >= 0:
+                    nextPacket = lastPkt.nic_next
+                for i in range(self.rxReadyCnt):
+                    self.rxReady[(self.rxReadyHead + i) % len(self.rxReady)].nic_next = -1
+        self.nic.ENC28J60_ReleasePacket(nextPacket)
     def rxAllPkt(self) -> None:
         '''Function to rx and process all pending packets from NIC'''
-        while True:
-            if self.dos.flag_state: # dos protection
-                ## lock
-                rxPacketCnt = self.nic.ENC28J60_GetRxPacketCnt()
-                if rxPacketCnt == 0:
-                    ## unlock
-                    break
-                rxLen = self.nic.ENC28J60_ReceivePacket(self.rxBuff)
-                ## unlock
-                if rxLen <= 0:
-                    self.event(f"Rx ERROR {rxLen}")
-                    continue
-                procEth(Packet(self, self.rxBuff, rxLen))
-            else:
+        self.pollLink()
+        # With an INT pin the NIC is not touched until it signals a packet
+        if self.rxReadyCnt == 0 and not self.nic.ENC28J60_IsIntPending():
+            return None
+        while self.dos.flag_state: # dos protection
+            # One bus session for the whole drain, the SPI lock is taken once for all pending frames
+            with self.nic.ENC28J60_Session:
+                self.rxDrainNic()
+            if self.rxReadyCnt == 0:
                 break
-    def txPkt(self, msg: list) -> int:
-        '''Function to tx packet to NIC'''
-        ## lock
-        n = self.nic.ENC28J60_SendPacket(msg)
-        ## unlock
-        return n
+            # The NIC is drained first, slow handlers don't hold up its RX buffer
+            while self.rxReadyCnt > 0 and self.dos.flag_state:
+                pkt = self.rxReady[self.rxReadyHead]
+                self.rxReady[self.rxReadyHead] = None
+                self.rxReadyHead = (self.rxReadyHead + 1) % len(self.rxReady)
+                self.rxReadyCnt -= 1
+                procEth(pkt)
+                self.rxReleaseNic(pkt)
+                if not pkt.held:
+                    self.rxFree[self.rxFreeCnt] = pkt
+                    self.rxFreeCnt += 1
+        # Packets left in the NIC (dos, full pool) must produce a new edge
+        self.nic.ENC28J60_RearmInt()
+    def holdPkt(self, pkt) -> None:
+        '''Keep the frame buffer of pkt after its handler returns, give it back with releasePkt'''
+        pkt.held = True
+    def releasePkt(self, pkt) -> None:
+        if pkt.held:
+            pkt.held = False
+            self.rxFree[self.rxFreeCnt] = pkt
+            self.rxFreeCnt += 1
+    def txPkt(self, msg: list, checksums: list=None, copyFrom: tuple=None) -> int:
+        '''Function to tx packet to NIC, checksums and copyFrom are done by the NIC DMA (see ENC28J60_SendPacket).
+        While the link is down the frame is held and TX_HELD returned, held frames are sent when the link returns'''
+        if self.linkUp and not self.txHold:
+            # ENC28J60_SendPacket holds the SPI bus for the whole frame
+            result = self.nic.ENC28J60_SendPacket(msg, checksums, copyFrom)
+            if result != ENC28J60.ENC28J60_ETH_TX_ERR_LINKDOWN:
+                return result
+            self.pollLink(force=True)
+        return self.holdTx(msg, checksums, copyFrom)
+    def holdTx(self, msg: list, checksums: list=None, copyFrom: tuple=None) -> int:
+        '''Keep a copy of the frame until the link is up, the oldest held frame is dropped when txHold is full'''
+        if copyFrom is not None or self.txHoldMax == 0:
+            # copyFrom points into the NIC RX ring, it is released long before the link returns
+            return ENC28J60.ENC28J60_ETH_TX_ERR_LINKDOWN
+        if len(self.txHold) >= self.txHoldMax:
+            self.txHold.pop(0)
+            self.txHoldDropped += 1
+        frame = bytearray()
+        for chunk in msg:
+            frame.extend(chunk)
+        self.txHold.append((frame, checksums))
+        return TX_HELD
+    def flushTxHold(self) -> int:
+        '''Send the held frames in order, stops if the link goes down again. Returns the number of frames sent'''
+        sent = 0
+        while self.txHold:
+            frame, checksums = self.txHold[0]
+            if self.nic.ENC28J60_SendPacket([frame], checksums) == ENC28J60.ENC28J60_ETH_TX_ERR_LINKDOWN:
+                break
+            self.txHold.pop(0)
+            sent += 1
+        return sent
+    def pollLink(self, force: bool=False) -> bool:
+        '''Track the link state: EIR.LINKIF is read every linkPollInterval ms, and on every call while a change is pending.
+        A new state counts once it held for linkDebounce ms, then the link callbacks run and held frames are sent.
+        Returns the debounced link state'''
+        now: int = ticks_ms()
+        if not force and self.linkRaw == self.linkUp and 0 < ENC28J60.ticksDiff(self.linkPollNext, now):
+            return self.linkUp
+        self.linkPollNext = ENC28J60.ticksAdd(now, self.linkPollInterval)
+        with self.nic.ENC28J60_Session:
+            changed = self.nic.ENC28J60_IsLinkStateChanged()
+            raw = self.nic.ENC28J60_IsLinkUp() if changed or force or self.linkRaw != self.linkUp else self.linkRaw
+        if raw == self.linkUp and (changed or self.linkRaw != raw):
+            # Down and up again before the debounce time
+            self.linkFlaps += 1
+        if raw != self.linkRaw:
+            self.linkRaw = raw
+            self.linkRawSince = now
+        if raw != self.linkUp and ENC28J60.ticksDiff(now, self.linkRawSince) >= self.linkDebounce:
+            self.linkUp = raw
+            self.event(f"Link is {'up' if raw else 'down'}")
+            for cb in self.linkCallbacks:
+                cb(raw)
+            if raw:
+                self.flushTxHold()
+        return self.linkUp
+    def traceSpi(self, on: bool=True, size: int=256):
+        '''Count the SPI commands and bytes of rxAllPkt, of each frame sent (per frame kind) and of the driver operations.
+        on=False unhooks the tracer, the counts stay readable. Returns the SpiTracer, print(tracer.report()) for the costs'''
+        if on:
+            if self.spiTracer is None:
+                # Only loaded when asked for, an untraced stack does not carry it
+                from SpiTrace import SpiTracer
+                self.spiTracer = SpiTracer(self.nic, size)
+            self.spiTracer.start()
+            self.spiTracer.wrap(self, ('rxAllPkt',))
+            self.spiTracer.wrap(self, ('txPkt',), txPktKind)
+        elif self.spiTracer is not None:
+            self.spiTracer.stop()
+        return self.spiTracer
+    def registerLinkCallback(self, cb) -> None:
+        '''cb(up: bool) is called when the debounced link state changes'''
+        if cb not in self.linkCallbacks:
+            self.linkCallbacks.append(cb)
+    def unregisterLinkCallback(self, cb) -> None:
+        if cb in self.linkCallbacks:
+            self.linkCallbacks.remove(cb)
+    def registerEthType(self, ethType: int, handler) -> None:
+        '''handler(pkt) gets the frames of ethType, its payload starts at pkt.eth_offset. None drops the type'''
+        if handler is not None:
+            self.ethHandlers[ethType] = handler
+        else:
+            self.ethHandlers.pop(ethType, None) # type: ignore
+    def registerIp4Proto(self, proto: int, handler) -> None:
+        '''handler(pkt, bcast) gets the IPv4 datagrams of proto sent to my IP, or with bcast=True to broadcast and
+        joined multicast groups. The payload is pkt.frame[pkt.ip_offset:pkt.ip_maxoffset]. None drops the protocol'''
+        if handler is not None:
+            self.ip4Handlers[proto] = handler
+        else:
+            self.ip4Handlers.pop(proto, None) # type: ignore
     def registerUdp4Callback(self, port: int, cb) -> None:
         if cb is not None:
             self.udp4UniBind[port] = cb
@@ -139,14 +410,67 @@ class Network:
             self.udp4BcastBind[port] = cb
         else:
             self.udp4BcastBind.pop(port, None) # type: ignore
+    def joinGroup(self, group: list) -> None:
+        '''Receive the IPv4 multicast group, its UDP datagrams are handled like broadcast ones.
+        The NIC hash table lets the group MAC in, groups sharing its hash bit are dropped in procIp4'''
+        group = bytes(group)
+        if group[0] & 0xF0 != 0xE0:
+            raise ValueError(f"{group[0]}.{group[1]}.{group[2]}.{group[3]} is not a multicast group")
+        joins = self.mcastGroups.get(group, 0)
+        self.mcastGroups[group] = joins + 1
+        if joins == 0:
+            self.mcastWords.append((u16(group, 0), u16(group, 2)))
+            bit = self.nic.ENC28J60_HashTableBit(makeIp4McastMac(group))
+            self.mcastHashRef[bit] += 1
+            if self.mcastHashRef[bit] == 1:
+                self.mcastHashTable[bit >> 3] |= 1 << (bit & 0x07)
+                self.nic.ENC28J60_SetHashTable(self.mcastHashTable)
+    def leaveGroup(self, group: list) -> None:
+        '''Undo one joinGroup, the hash bit is cleared when no joined group uses it anymore'''
+        group = bytes(group)
+        joins = self.mcastGroups.get(group, 0)
+        if joins == 0:
+            return None
+        if joins > 1:
+            self.mcastGroups[group] = joins - 1
+            return None
+        del self.mcastGroups[group]
+        self.mcastWords.remove((u16(group, 0), u16(group, 2)))
+        bit = self.nic.ENC28J60_HashTableBit(makeIp4McastMac(group))
+        self.mcastHashRef[bit] -= 1
+        if self.mcastHashRef[bit] == 0:
+            self.mcastHashTable[bit >> 3] &= ~(1 << (bit & 0x07)) & 0xFF
+            self.nic.ENC28J60_SetHashTable(self.mcastHashTable)
+    def isMcastGroup(self, hi: int, lo: int) -> bool:
+        '''True if the group with the 16 bit words hi and lo is joined'''
+        for groupHi, groupLo in self.mcastWords:
+            if groupLo == lo and groupHi == hi:
+                return True
+        return False
     def addArpEntry(self, ip: int | bytes, mac: bytes) -> None:
+        # The table is keyed by the 4 address bytes
         if isinstance(ip, int):
-            self.arpTable[ip] = bytearray(mac)
+            self.arpTable[ip.to_bytes(4, 'big')] = bytearray(mac)
         else:
-            self.arpTable[struct.unpack('!I',ip)[0]] = bytearray(mac)
+            self.arpTable[bytes(ip)] = bytearray(mac)
+    def hasArpEntry(self, frame, ipOffset: int, macOffset: int) -> bool:
+        '''True if the table already maps the IPv4 address at ipOffset of frame to the MAC at macOffset.
+        The address is compared as two 16 bit words, a known sender costs no bytes object'''
+        hi = u16(frame, ipOffset)
+        lo = u16(frame, ipOffset + 2)
+        for ip in self.arpTable:
+            if u16(ip, 2) == lo and u16(ip, 0) == hi:
+                mac = self.arpTable[ip]
+                for i in range(6):
+                    if mac[i] != frame[macOffset + i]:
+                        return False
+                return True
+        return False
     def getArpEntry(self, ip: int | bytes) -> None:
-        if not isinstance(ip, int):
-            ip = struct.unpack('!I',ip)[0]
+        if isinstance(ip, int):
+            ip = ip.to_bytes(4, 'big')
+        elif not isinstance(ip, bytes):
+            ip = bytes(ip)
 
         if ip in self.arpTable:
             return self.arpTable[ip]
@@ -172,12 +496,128 @@ class Network:
         else:
             return self.getArpEntry(self.gwIp4Addr) is not None
 class Packet:
-    """This class stores received packet information"""
+    """This class stores received packet information.
+    Packets live in the Network pool and are reused for every frame: all fields exist from __init__, the MAC
+    fields are views made once and procIp4 copies the IPv4 addresses into buffers of their own. The UDP data is
+    given by udp_dataOffset and udp_dataLen, udp_data makes a new view of it on each call.
+    Decoding up to the handler makes no objects of its own, event messages and replies still allocate.
+    procIp4 reads the header fields once the destination is accepted, noise for other hosts leaves them stale.
+    __slots__ only holds on the host: CircuitPython does not implement it, every Packet has an attribute dict"""
+    __slots__ = ('ntw', 'frame', 'frame_len', 'held', 'nic_addr', 'nic_next',
+        'eth_type', 'eth_offset', 'eth_dst', 'eth_src',
+        'ip_proto', 'ip_ver', 'ip_hdrlen', 'ip_totlen', 'ip_offset', 'ip_maxoffset', 'ip_src_addr', 'ip_dst_addr',
+        'udp_srcPort', 'udp_dstPort', 'udp_dataLen', 'udp_dataOffset')
     def __init__(self, ntw: Network, frame: bytearray, frame_len: int):
         self.ntw: Network = ntw
         self.frame: memoryview = memoryview(frame)
         self.frame_len: int = frame_len
-
+        self.held: bool = False
+        self.nic_addr: int = -1 # address of the frame in the NIC RX ring while it is kept there, else -1
+        self.nic_next: int = -1 # ERXRDPT release point of the frame while its ring space is not given back, else -1
+        self.eth_type: int = 0
+        self.eth_offset: int = ETH_HDR_LEN
+        self.eth_dst: memoryview = self.frame[ETH_DST:ETH_SRC] # the MACs are at fixed offsets of the frame buffer
+        self.eth_src: memoryview = self.frame[ETH_SRC:ETH_TYPE]
+        self.ip_proto: int = 0
+        self.ip_ver: int = 0
+        self.ip_hdrlen: int = 0
+        self.ip_totlen: int = 0
+        self.ip_offset: int = 0
+        self.ip_maxoffset: int = 0
+        self.ip_src_addr: bytearray = bytearray(4) # copied from the frame, the IPv4 offset depends on the VLAN tag
+        self.ip_dst_addr: bytearray = bytearray(4)
+        self.udp_srcPort: int = 0
+        self.udp_dstPort: int = 0
+        self.udp_dataLen: int = 0
+        self.udp_dataOffset: int = 0
+    @property
+    def udp_data(self) -> memoryview:
+        return self.frame[self.udp_dataOffset:self.udp_dataOffset + self.udp_dataLen]
+
+class Udp4Flow:
+    """Datagrams to one (dst ip, dst port, src port): the Ethernet, IPv4 and UDP headers are built once in one buffer.
+    send() only patches the IPv4 total length, ident and header checksum (RFC 1624 incremental update from the
+    checksum of the template) and the UDP length and checksum, the headers are rebuilt when the next hop MAC or
+    the own IPv4 address change"""
+    def __init__(self, ntw: Network, dstIp: bytes, dstPort: int, srcPort: int, ttl: int=128):
+        self.ntw: Network = ntw
+        self.dstIp: bytes = bytes(dstIp)
+        self.dstPort: int = dstPort
+        self.srcPort: int = srcPort
+        self.ttl: int = ttl
+        self.hdr: bytearray = bytearray(ETH_HDR_LEN + IP4_HDR_LEN + UDP_HDR_LEN)
+        self.dstMac = None # ARP table entry the header was built for
+        self.srcIp4Hi: int = -1 # own address the header was built for, as Network.myIp4Hi and myIp4Lo
+        self.srcIp4Lo: int = -1
+        self.nextHop = None # IPv4 address whose MAC is the Ethernet destination, the ARP table key
+        self.ip4Chksm: int = 0 # IPv4 header checksum of the template: no data, ident 0
+        self.pseudoSum: int = 0 # pseudo-header without the UDP length
+    def _Build(self) -> None:
+        ntw = self.ntw
+        hdr = self.hdr
+        self.srcIp4Hi = ntw.myIp4Hi
+        self.srcIp4Lo = ntw.myIp4Lo
+        self.nextHop = bytes(self.dstIp if ntw.isLocalIp4(self.dstIp) else ntw.gwIp4Addr)
+        self.dstMac = None
+        hdr[ETH_SRC:ETH_TYPE] = ntw.myMacAddr
+        putU16(hdr, ETH_TYPE, ETH_TYPE_IP4)
+        ip4 = makeIp4Hdr(ntw.myIp4Addr, self.dstIp, 0, IP4_TYPE_UDP, 0, ttl=self.ttl)
+        hdr[ETH_HDR_LEN:ETH_HDR_LEN + IP4_HDR_LEN] = ip4
+        self.ip4Chksm = u16(ip4, IP4_CHKSM)
+        putU16(hdr, ETH_HDR_LEN + IP4_HDR_LEN + UDP_SRC_PORT, self.srcPort)
+        putU16(hdr, ETH_HDR_LEN + IP4_HDR_LEN + UDP_DST_PORT, self.dstPort)
+        self.pseudoSum = addrSum(ntw.myIp4Addr) + addrSum(self.dstIp) + IP4_TYPE_UDP
+    def send(self, data: bytes) -> int:
+        """Send data in one datagram, returns txPkt result or -1 if the next hop is not in the ARP table.
+        IPv4 is not fragmented here: data that does not fit in the MTU is not sent, ENC28J60_ETH_TX_ERR_MSGSIZE"""
+        ntw = self.ntw
+        hdr = self.hdr
+        udpLen: int = UDP_HDR_LEN + len(data)
+        totlen: int = IP4_HDR_LEN + udpLen
+        if totlen > ntw.getEthMTU():
+            ntw.event(f"Udp4Flow: {len(data)} bytes exceed the MTU, not sent")
+            return ENC28J60.ENC28J60_ETH_TX_ERR_MSGSIZE
+        if self.srcIp4Lo != ntw.myIp4Lo or self.srcIp4Hi != ntw.myIp4Hi:
+            self._Build()
+        mac = ntw.arpTable.get(self.nextHop)
+        if mac is None:
+            ntw.event(f"{self.dstIp[0]}.{self.dstIp[1]}.{self.dstIp[2]}.{self.dstIp[3]} not in ARP table!")
+            return -1
+        if mac is not self.dstMac:
+            hdr[ETH_DST:ETH_SRC] = mac
+            self.dstMac = mac
+
+        # The whole 16 bit ident field is used, the counter wraps with it
+        ident: int = ntw.ip4TxCount & 0xFFFF
+        ntw.ip4TxCount = ident + 1
+        putU16(hdr, ETH_HDR_LEN + IP4_TOTLEN, totlen)
+        putU16(hdr, ETH_HDR_LEN + IP4_IDENT, ident)
+        putU16(hdr, ETH_HDR_LEN + IP4_CHKSM, adjustChecksum(adjustChecksum(self.ip4Chksm, IP4_HDR_LEN, totlen), 0, ident))
+
+        udp: int = ETH_HDR_LEN + IP4_HDR_LEN
+        putU16(hdr, udp + UDP_LEN, udpLen)
+        if len(data) >= ntw.checksumOffloadMin:
+            # The NIC checksums UDP header + data in its TX buffer, only the pseudo-header is summed here
+            putU16(hdr, udp + UDP_CHKSM, 0)
+            return ntw.txPkt([hdr, data], [(udp, udp + udpLen, udp + UDP_CHKSM, self.pseudoSum + udpLen)])
+        chksm: int = calcChecksum(data, self.pseudoSum + 2 * udpLen + self.srcPort + self.dstPort)
+        putU16(hdr, udp + UDP_CHKSM, chksm if chksm != 0 else 0xFFFF)
+        return ntw.txPkt([hdr, data])
+
+def txPktKind(msg: list, checksums: list=None, copyFrom: tuple=None) -> str:
+    '''Name of the frame for the SPI tracer: tx arp, tx icmp, tx udp, tx ip4 or tx eth'''
+    def frameByte(offset: int) -> int:
+        for chunk in msg:
+            if offset < len(chunk): return chunk[offset]
+            offset -= len(chunk)
+        return -1
+    ethType: int = frameByte(12) << 8 | frameByte(13)
+    if ethType == ETH_TYPE_ARP: return 'tx arp'
+    if ethType != ETH_TYPE_IP4: return 'tx eth'
+    proto: int = frameByte(23)
+    if proto == IP4_TYPE_ICMP: return 'tx icmp'
+    if proto == IP4_TYPE_UDP: return 'tx udp'
+    return 'tx ip4'
 def makeArpReply(eth_dst: bytearray, eth_src: bytearray, ip_src: bytearray, ip_dst: bytes) -> list:
     rsp = []
     rsp.append(eth_dst)
@@ -200,21 +640,50 @@ def makeArpRequest(eth_src: bytearray, ip_src: bytearray, ip_dst: bytes) -> list
     rsp.append(ip_dst)
     return rsp
 
+def makeIp4McastMac(group: bytes) -> bytes:
+    '''Ethernet address of an IPv4 multicast group: 01:00:5E and the low 23 bits of the group'''
+    return bytes([0x01, 0x00, 0x5E, group[1] & 0x7F, group[2], group[3]])
+
+def makeArpRequestPattern(ip_dst: bytearray) -> list:
+    '''Pattern match fields (see ENC28J60_SetPatternFilter) of an ARP request for ip_dst'''
+    return [
+        (12, bytes([ETH_TYPE_ARP >> 8, ETH_TYPE_ARP_S])),
+        (20, bytes([0, ARP_OP_REQUEST])),
+        (38, bytes(ip_dst)),
+    ]
+
+def makeUdp4PortPattern(port: int) -> list:
+    '''Pattern match fields of an IPv4 (no options) UDP datagram to port'''
+    return [
+        (12, bytes([ETH_TYPE_IP4 >> 8, ETH_TYPE_IP4_S])),
+        (14, bytes([0x45])),
+        (23, bytes([IP4_TYPE_UDP])),
+        (36, bytes([(port >> 8) & 0xFF, port & 0xFF])),
+    ]
+
 def procArp(pkt: Packet) -> None:
     pkt.ntw.dos.check_arp_limit() # ARP flood protection
-    hrtype, prtype, hrlen, prlen, oper, sha, spa, tha, tpa = struct.unpack_from("!HHBBH6s4s6s4s", pkt.frame, pkt.eth_offset) # type: ignore
+    frame = pkt.frame
+    offset = pkt.eth_offset
+    oper = u16(frame, offset + ARP_OPER)
     pkt.ntw.event(f"Rx ARP oper={oper}")
     if ARP_OP_REQUEST == oper:
-        if tpa == pkt.ntw.myIp4Addr:
-            pkt.ntw.event(f"Rx ARP_REQUEST for my IP from IP {spa[0]}.{spa[1]}.{spa[2]}.{spa[3]}!")
-            reply = makeArpReply(pkt.eth_src, pkt.ntw.myMacAddr, pkt.ntw.myIp4Addr, spa)
+        if u16(frame, offset + ARP_TPA + 2) == pkt.ntw.myIp4Lo and u16(frame, offset + ARP_TPA) == pkt.ntw.myIp4Hi:
+            spa = offset + ARP_SPA
+            pkt.ntw.event(f"Rx ARP_REQUEST for my IP from IP {frame[spa]}.{frame[spa + 1]}.{frame[spa + 2]}.{frame[spa + 3]}!")
+            # txPkt copies the SPA view before the pool buffer is reused
+            reply = makeArpReply(pkt.eth_src, pkt.ntw.myMacAddr, pkt.ntw.myIp4Addr, frame[spa:spa + 4])
             n = pkt.ntw.txPkt(reply)
             if n < 0:
                 pkt.ntw.event(f"Fail to send ARP REPLY {n}")
 
     elif ARP_OP_REPLY == oper:
-        pkt.ntw.event(f"ARP {spa[0]}.{spa[1]}.{spa[2]}.{spa[3]} is at {sha[0]:02X}:{sha[1]:02X}:{sha[2]:02X}:{sha[3]:02X}:{sha[4]:02X}:{sha[5]:02X}")
-        pkt.ntw.addArpEntry(spa, sha)
+        spa = offset + ARP_SPA
+        sha = offset + ARP_SHA
+        pkt.ntw.event(f"ARP {frame[spa]}.{frame[spa + 1]}.{frame[spa + 2]}.{frame[spa + 3]} is at {frame[sha]:02X}:{frame[sha + 1]:02X}:{frame[sha + 2]:02X}:{frame[sha + 3]:02X}:{frame[sha + 4]:02X}:{frame[sha + 5]:02X}")
+        # A repeated reply leaves the entry alone, a new one is copied by addArpEntry
+        if not pkt.ntw.hasArpEntry(frame, spa, sha):
+            pkt.ntw.addArpEntry(frame[spa:spa + 4], frame[sha:sha + 6])
 
 def makeIp4Hdr(src: bytearray, tgt: bytes, ident: int, proto: int, dataLen: int, ttl=128, dscp=0, ecn=0) -> bytearray:
     totlen = 20 + dataLen
@@ -223,8 +692,8 @@ def makeIp4Hdr(src: bytearray, tgt: bytes, ident: int, proto: int, dataLen: int,
     hdr[1] = (dscp << 2) | (ecn & 0x03)
     hdr[2] = totlen >> 8
     hdr[3] = totlen
-    hdr[4] = ident >> 8
-    hdr[5] = ident
+    hdr[4] = (ident >> 8) & 0xFF
+    hdr[5] = ident & 0xFF
     hdr[6] = 0      # Flags + Fragment Offset
     hdr[7] = 0      # Flags + Fragment Offset
     hdr[8] = ttl
@@ -240,14 +709,37 @@ def makeIp4Hdr(src: bytearray, tgt: bytes, ident: int, proto: int, dataLen: int,
     return hdr
 
 def procIp4(pkt: Packet) -> None:
-    ip_ver_len, _, pkt.ip_totlen, _, ip_flags_fragoffset, ip_ttl, pkt.ip_proto, ip_hdr_chksum, pkt.ip_src_addr, pkt.ip_dst_addr = struct.unpack_from("!BBHHHBBH4s4s", pkt.frame, pkt.eth_offset)  # type: ignore
+    frame = pkt.frame
+    offset = pkt.eth_offset
+    pkt.ip_proto = frame[offset + IP4_PROTO]
+    handler = pkt.ntw.ip4Handlers.get(pkt.ip_proto)
+    if handler is None:
+        return None
+
+    # The destination is compared as two 16 bit words before anything else is read, noise for other hosts costs 5 bytes
+    dstHi = u16(frame, offset + IP4_DST)
+    dstLo = u16(frame, offset + IP4_DST + 2)
+    if dstLo == pkt.ntw.myIp4Lo and dstHi == pkt.ntw.myIp4Hi:
+        mine = True
+    elif dstLo == IP4_BCAST_HALF and dstHi == IP4_BCAST_HALF:
+        mine = False
+    elif (dstHi >> 12) == 0xE and pkt.ntw.isMcastGroup(dstHi, dstLo):
+        # Exact match, the NIC hash table also lets in the groups sharing a hash bit with a joined one
+        mine = False
+    else:
+        return None
 
+    # pkt.ntw.ip4RxCount += 1 # 
+
+    # Accepted: the header fields are read once, handlers use plain attributes
+    ip_ver_len = frame[offset + IP4_VER_IHL]
+    pkt.ip_totlen = u16(frame, offset + IP4_TOTLEN)
     pkt.ip_ver = (ip_ver_len >> 4) & 0xF
     pkt.ip_hdrlen = (ip_ver_len & 0xF) << 2
-    pkt.ip_offset = pkt.eth_offset + pkt.ip_hdrlen
-    pkt.ip_maxoffset = pkt.eth_offset + pkt.ip_totlen
-
-    # pkt.ntw.ip4RxCount += 1 # 
+    pkt.ip_offset = offset + pkt.ip_hdrlen
+    pkt.ip_maxoffset = offset + pkt.ip_totlen
+    copyAddr(pkt.ip_src_addr, frame, offset + IP4_SRC)
+    copyAddr(pkt.ip_dst_addr, frame, offset + IP4_DST)
 
     if pkt.ip_ver != 4:
         pkt.ntw.event(f"ip_ver={pkt.ip_ver} not supported!")
@@ -255,37 +747,37 @@ def procIp4(pkt: Packet) -> None:
     if pkt.ip_hdrlen != 20:
         pkt.ntw.event(f"ip_hdrlen={pkt.ip_hdrlen} not supported!")
 
-    flags_mf = (ip_flags_fragoffset >> 13) & 0x01
-    fragOffset = (ip_flags_fragoffset & 0x1FFF) << 3
+    ip_flags_fragoffset = u16(frame, offset + IP4_FLAGS_FRAG)
+    flags_mf = 1 if ip_flags_fragoffset & IP4_FLAG_MF else 0
+    fragOffset = (ip_flags_fragoffset & IP4_FRAG_MASK) << 3
     if (0 != flags_mf) or (0 != fragOffset):
         pkt.ntw.event(f"Fragmented IPv4 not supported: fragOffset={fragOffset}, flags_mf={flags_mf}")
 
-    if pkt.ip_dst_addr == pkt.ntw.myIp4Addr:
+    if mine:
         pkt.ntw.event(f"Rx my IP proto={pkt.ip_proto}")
-        if pkt.ip_proto == IP4_TYPE_ICMP:
-            procIcmp4(pkt)
-        elif pkt.ip_proto == IP4_TYPE_UDP:
-            procUdp4(pkt, bcast=False)
-        elif pkt.ip_proto == IP4_TYPE_TCP:
-            procTcp4(pkt)
-
-    elif pkt.ip_dst_addr == IP4_ADDR_BCAST:
-        if pkt.ip_proto == IP4_TYPE_UDP:
-            procUdp4(pkt, bcast=True)
+    handler(pkt, not mine)
 
 def sendIcmp4EchoReply(pkt: Packet) -> int:
     offset = pkt.ip_offset
     rsp= []
 
+    if pkt.nic_addr >= 0 and pkt.ip_maxoffset - offset - 4 >= pkt.ntw.reflectMin:
+        return reflectIcmp4EchoReply(pkt)
+
     # ICMP
     icmpRepl = bytearray(pkt.frame[offset:pkt.ip_maxoffset])
     icmpRepl[0] = ICMP4_ECHO_REPLY
     icmpRepl[1] = 0x00
     icmpRepl[2] = 0x00
     icmpRepl[3] = 0x00
-    chksm = calcChecksum(icmpRepl)
-    icmpRepl[2] = (chksm >> 8) & 0xFF
-    icmpRepl[3] = chksm & 0xFF
+    checksums = None
+    if len(icmpRepl) >= pkt.ntw.checksumOffloadMin:
+        # The NIC checksums the reply in its TX buffer: ICMP starts at 14 + 20, the checksum field at 2
+        checksums = [(34, 34 + len(icmpRepl), 36, 0)]
+    else:
+        chksm = calcChecksum(icmpRepl)
+        icmpRepl[2] = (chksm >> 8) & 0xFF
+        icmpRepl[3] = chksm & 0xFF
 
     # IP
     if pkt.ntw.ip4TxCount == 255: pkt.ntw.ip4TxCount = 0
@@ -300,10 +792,29 @@ def sendIcmp4EchoReply(pkt: Packet) -> int:
     rsp.append(ipHdr)
     rsp.append(icmpRepl)
 
-    reply = pkt.ntw.txPkt(rsp)
+    reply = pkt.ntw.txPkt(rsp, checksums)
     return reply
 
-def procIcmp4(pkt: Packet) -> None:
+def reflectIcmp4EchoReply(pkt: Packet) -> int:
+    '''Only the headers are sent over SPI, identifier, sequence and data are copied from the NIC RX ring'''
+    offset = pkt.ip_offset
+    # The request checksum is updated for the type/code word: ECHO_REQUEST, code -> ECHO_REPLY, 0
+    chksm = adjustChecksum((pkt.frame[offset+2] << 8) | pkt.frame[offset+3],
+        (pkt.frame[offset] << 8) | pkt.frame[offset+1], ICMP4_ECHO_REPLY << 8)
+    icmpHdr = bytearray([ICMP4_ECHO_REPLY, 0x00, (chksm >> 8) & 0xFF, chksm & 0xFF])
+    dataLen = pkt.ip_maxoffset - offset - 4
+
+    # IP
+    if pkt.ntw.ip4TxCount == 255: pkt.ntw.ip4TxCount = 0
+    ipHdr = makeIp4Hdr(pkt.ntw.myIp4Addr, pkt.ip_src_addr, pkt.ntw.ip4TxCount, IP4_TYPE_ICMP, 4 + dataLen)
+    pkt.ntw.ip4TxCount += 1
+
+    rsp = [pkt.eth_src, pkt.ntw.myMacAddr, bytearray([ETH_TYPE_IP4 >> 8, ETH_TYPE_IP4_S]), ipHdr, icmpHdr]
+    return pkt.ntw.txPkt(rsp, copyFrom=(pkt.ntw.nic.ENC28J60_RxAddress(pkt.nic_addr, offset + 4), dataLen))
+
+def procIcmp4(pkt: Packet, bcast: bool=False) -> None:
+    if bcast:
+        return None
     pkt.ntw.dos.check_icmp_limit() # ICMP flood protection
     offset = pkt.ip_offset
     if pkt.frame[offset] == ICMP4_ECHO_REQUEST:
@@ -319,26 +830,25 @@ def printEthPkt(pkt) -> None:
         'FCS', ":".join("{:02x}".format(c) for c in pkt.frame[pkt.frame_len:pkt.frame_len + 4]))
 
 def procEth(pkt) -> None:
-    pkt.eth_dst = pkt.frame[0:6]
-    pkt.eth_src = pkt.frame[6:12]
-    pkt.eth_type, = struct.unpack_from("!H", pkt.frame, 12)  # type: ignore
-    pkt.eth_offset = 14
+    frame = pkt.frame
+    pkt.eth_type = u16(frame, ETH_TYPE)
+    pkt.eth_offset = ETH_HDR_LEN
 
     if ETH_80211Q_TAG == pkt.eth_type:
-        pkt.eth_type, = struct.unpack_from("!H", pkt.frame, 14)  # type: ignore
-        pkt.eth_offset = 16
+        pkt.eth_type = u16(frame, ETH_VLAN_TYPE)
+        pkt.eth_offset = ETH_VLAN_HDR_LEN
 
-    if ETH_TYPE_IP4 == pkt.eth_type:
-        procIp4(pkt)
-    elif ETH_TYPE_ARP == pkt.eth_type:
-        procArp(pkt)
+    handler = pkt.ntw.ethHandlers.get(pkt.eth_type)
+    if handler is None:
+        return None
+    handler(pkt)
 
 def makeUdp4Hdr(srcIp: bytearray, srcPort: int, dstIp: bytes, dstPort: int, data: bytes) -> bytearray:
     udpHdr = bytearray(8)
     udpLen = len(data) + 8
 
-    chksm = sum(struct.unpack('!HH', srcIp))
-    chksm += sum(struct.unpack('!HH', dstIp))
+    chksm = addrSum(srcIp)
+    chksm += addrSum(dstIp)
     chksm += IP4_TYPE_UDP + 2*udpLen + srcPort + dstPort
     chksm = calcChecksum(data, chksm)
 
@@ -356,48 +866,74 @@ def makeUdp4Hdr(srcIp: bytearray, srcPort: int, dstIp: bytes, dstPort: int, data
 
 def procUdp4(pkt: Packet, bcast: bool=False) -> None:
     pkt.ntw.dos.check_udp_limit() # UDP flood protection
+    frame = pkt.frame
     offset = pkt.ip_offset
-    pkt.udp_srcPort, pkt.udp_dstPort, udpLen, chksm_rx = struct.unpack_from('!HHHH', pkt.frame, offset)  # type: ignore
-    pkt.udp_dataLen = udpLen - 8
-    pkt.udp_data = memoryview(pkt.frame[offset + 8:offset + udpLen])
-
-    # # find UDP client
-    # cb = None
-    # if (False == bcast) and (pkt.udp_dstPort in pkt.ntw.udp4UniBind):
-    #     cb = pkt.ntw.udp4UniBind[pkt.udp_dstPort]
-    # elif (True == bcast) and (pkt.udp_dstPort in pkt.ntw.udp4BcastBind):
-    #     cb = pkt.ntw.udp4BcastBind[pkt.udp_dstPort]
-
-    # if cb is None:
-    #     return None
+    pkt.udp_srcPort = u16(frame, offset + UDP_SRC_PORT)
+    pkt.udp_dstPort = u16(frame, offset + UDP_DST_PORT)
+    udpLen = u16(frame, offset + UDP_LEN)
+    chksm_rx = u16(frame, offset + UDP_CHKSM)
+    if udpLen < UDP_HDR_LEN or offset + udpLen > pkt.frame_len:
+        pkt.ntw.event(f"Invalid UDP length {udpLen}")
+        return None
+    pkt.udp_dataLen = udpLen - UDP_HDR_LEN
+    pkt.udp_dataOffset = offset + UDP_HDR_LEN
+
+    # find UDP client, datagrams to other ports go to UDP_Q
+    cb = (pkt.ntw.udp4BcastBind if bcast else pkt.ntw.udp4UniBind).get(pkt.udp_dstPort)
+
     # verify checksum
     if (chksm_rx != 0):
-        chksm = sum(struct.unpack('!HH', pkt.ip_src_addr))
-        chksm += sum(struct.unpack('!HH', pkt.ip_dst_addr))
-        chksm += IP4_TYPE_UDP + (2 * udpLen) + pkt.udp_srcPort + pkt.udp_dstPort
-        chksm = calcChecksum(pkt.udp_data, chksm)
+        chksm = addrSum(frame, pkt.eth_offset + IP4_SRC)
+        chksm += addrSum(frame, pkt.eth_offset + IP4_DST)
+        if pkt.nic_addr >= 0 and udpLen >= pkt.ntw.checksumOffloadMin:
+            # The datagram is still in the NIC RX ring: the DMA sums it, the received checksum is taken out again
+            nic = pkt.ntw.nic
+            with nic.ENC28J60_Session:
+                dmaChksm = nic.ENC28J60_DmaChecksum(nic.ENC28J60_RxAddress(pkt.nic_addr, offset),
+                    nic.ENC28J60_RxAddress(pkt.nic_addr, offset + udpLen - 1))
+            chksm += IP4_TYPE_UDP + udpLen + (~dmaChksm & 0xFFFF) + (~chksm_rx & 0xFFFF)
+            chksm = calcChecksum(b'', chksm)
+        else:
+            chksm += IP4_TYPE_UDP + (2 * udpLen) + pkt.udp_srcPort + pkt.udp_dstPort
+            chksm = calcChecksum(frame, chksm, pkt.udp_dataOffset, offset + udpLen)
         if chksm == 0:
             chksm = 0xFFFF
         if (chksm != chksm_rx):
             pkt.ntw.event(f"Invalid UDP chksm: rx={chksm_rx:04X} calc=0x{chksm:04X}")
             return None
+    # The handler does not read the ring, a slow one would hold it
+    pkt.ntw.rxReleaseNic(pkt)
 
-    # # call UDP client
-    # cb(pkt)
+    # call UDP client
+    if cb is not None:
+        cb(pkt)
+        return None
     try:
         rxUdp = str(pkt.udp_data, 'utf-8')
         if len(rxUdp) > 0: pkt.ntw.UDP_Q.append(rxUdp)
     except UnicodeError: pass
 
-def procTcp4(pkt: Packet) -> None:
+def procTcp4(pkt: Packet, bcast: bool=False) -> None:
+    if bcast:
+        return None
     pkt.ntw.dos.check_tcp_limit()
 
-def calcChecksum(data, startValue: int=0) -> int:
+def calcChecksum(data, startValue: int=0, start: int=0, end: int=-1) -> int:
+    '''Checksum of data[start:end] without slicing it, end=-1 is the end of data'''
+    if end < 0:
+        end = len(data)
     chksm = startValue
-    for idx in range(0, len(data)-1, 2):
+    for idx in range(start, end-1, 2):
         chksm += (data[idx] << 8) | data[idx+1]
-    if len(data) & 0x1:
-        chksm += data[-1] << 8
+    if (end - start) & 0x1:
+        chksm += data[end-1] << 8
+    chksm = (chksm >> 16) + (chksm & 0xffff)
+    chksm += (chksm >> 16)
+    return ~chksm & 0xffff
+
+def adjustChecksum(chksm: int, oldWord: int, newWord: int) -> int:
+    '''Update a checksum for one 16 bit word changed from oldWord to newWord (RFC 1624 eqn. 3)'''
+    chksm = (~chksm & 0xffff) + (~oldWord & 0xffff) + newWord
     chksm = (chksm >> 16) + (chksm & 0xffff)
     chksm += (chksm >> 16)
     return ~chksm & 0xffff
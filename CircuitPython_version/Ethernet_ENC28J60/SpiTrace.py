@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# This is version for circuitpython 7.2 or higher
+
+# This file implements an SPI transaction tracer for the ENC28J60 driver.
+# Supports:
+# - Ring of the last SPI commands: operation, opcode, register, bank, bytes
+# - SPI cost per operation: calls, commands, bytes and bank switches
+# Nothing is hooked until start(): the driver runs its own methods, bus and CS pin, so tracing costs nothing when off.
+
+from micropython import const
+import ENC28J60
+
+__version__ = '0.1.0v'
+__repo__ = 'https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60'
+
+TRACE_RING_SIZE = const(256)
+
+# Driver methods traced as operations by default
+DRIVER_OPS = (
+    'ENC28J60_SendPacket',
+    'ENC28J60_ReceivePacket',
+    'ENC28J60_GetRxPacketCnt',
+    'ENC28J60_ReleasePacket',
+    'ENC28J60_PollTx',
+    'ENC28J60_DmaChecksum',
+    'ENC28J60_DmaCopy',
+    'ENC28J60_IsLinkUp',
+    'ENC28J60_IsLinkStateChanged',
+)
+
+OPCODE_NAMES = {
+    ENC28J60.ENC28J60_CMD_RCR: 'RCR',
+    ENC28J60.ENC28J60_CMD_WCR: 'WCR',
+    ENC28J60.ENC28J60_CMD_BFS: 'BFS',
+    ENC28J60.ENC28J60_CMD_BFC: 'BFC',
+}
+
+def decodeCommand(cmd: int) -> tuple:
+    """Return (opcode name, register address) of the first byte of an SPI command, the address is -1 if it has none"""
+    if cmd == ENC28J60.ENC28J60_CMD_SRC: return ('SRC', -1)
+    if cmd == ENC28J60.ENC28J60_CMD_RBM: return ('RBM', -1)
+    if cmd == ENC28J60.ENC28J60_CMD_WBM: return ('WBM', -1)
+    return (OPCODE_NAMES.get(cmd & 0xE0, '???'), cmd & ENC28J60.REG_ADDR_MASK)
+
+class _TracedBus:
+    """SPI bus seen by the driver while tracing, counts the bytes of the current command"""
+    def __init__(self, tracer, bus) -> None:
+        self._tracer = tracer
+        self._bus = bus
+    def write(self, buf, **kwargs) -> None:
+        self._tracer._Transfer(buf, kwargs)
+        self._bus.write(buf, **kwargs)
+    def readinto(self, buf, **kwargs) -> None:
+        self._tracer._Transfer(None, kwargs, len(buf))
+        self._bus.readinto(buf, **kwargs)
+    def write_readinto(self, out, into, **kwargs) -> None:
+        self._tracer._Transfer(out, kwargs)
+        self._bus.write_readinto(out, into, **kwargs)
+    def unlock(self) -> None:
+        self._bus.unlock()
+
+class _TracedCs:
+    """CS pin seen by the driver while tracing, a command lasts from CS low to CS high"""
+    def __init__(self, tracer, cs) -> None:
+        self._tracer = tracer
+        self._cs = cs
+    @property
+    def value(self) -> bool:
+        return self._cs.value
+    @value.setter
+    def value(self, value: bool) -> None:
+        self._cs.value = value
+        if value: self._tracer._EndCommand()
+        else: self._tracer._BeginCommand()
+
+class _TraceOp:
+    def __init__(self, tracer, name: str) -> None:
+        self._tracer = tracer
+        self._name = name
+    def __enter__(self):
+        totals: list = self._tracer._Totals(self._name)
+        totals[0] += 1
+        self._tracer._ops.append((self._name, totals))
+        return self
+    def __exit__(self, *exc) -> bool:
+        self._tracer._ops.pop()
+        return False
+
+class SpiTracer:
+    """Records the SPI commands of an ENC28J60 into a ring and adds them up per operation.
+    An operation is a traced method call or a 'with tracer.operation(name):' block, operations nest and
+    each command counts for all the open ones. Commands outside any operation count for 'other'"""
+    def __init__(self, nic: ENC28J60.ENC28J60, size: int=TRACE_RING_SIZE) -> None:
+        self._nic = nic
+        self._ring: list = [None] * size
+        self._ringNext: int = 0
+        self._ringCnt: int = 0
+        self._totals: dict = {} # {operation: [calls, commands, bytes, bank switches]}
+        self._ops: list = [] # (name, totals) of the open operations
+        self._wrapped: list = [] # (object, method name)
+        self._cmd: int = -1 # first byte of the current command, -1 before it is sent
+        self._bank: int = 0
+        self._bytes: int = 0
+        self.running: bool = False
+    def _Totals(self, name: str) -> list:
+        totals = self._totals.get(name)
+        if totals is None:
+            totals = self._totals[name] = [0, 0, 0, 0]
+        return totals
+    def _BeginCommand(self) -> None:
+        self._cmd = -1
+        self._bytes = 0
+        self._bank = self._nic._currentBank >> 8
+    def _Transfer(self, out, kwargs: dict, length: int=0) -> None:
+        start: int = kwargs.get('start', 0)
+        if out is not None:
+            end = kwargs.get('end', None)
+            length = (len(out) if end is None else end) - start
+            if self._cmd < 0 and length > 0:
+                self._cmd = out[start]
+        else:
+            end = kwargs.get('end', None)
+            if end is not None: length = end - start
+            else: length -= start
+        self._bytes += length
+    def _EndCommand(self) -> None:
+        if self._cmd < 0:
+            return None
+        ops: list = self._ops if self._ops else [('other', self._Totals('other'))]
+        for _, totals in ops:
+            totals[1] += 1
+            totals[2] += self._bytes
+        self._ring[self._ringNext] = (ops[-1][0], self._cmd, self._bank, self._bytes)
+        self._ringNext = (self._ringNext + 1) % len(self._ring)
+        self._ringCnt = min(self._ringCnt + 1, len(self._ring))
+        self._cmd = -1
+    def _SelectBank(self, address: int) -> None:
+        # One switch per bank change, whatever the number of ECON1 commands it takes
+        bank: int = self._nic._currentBank
+        ENC28J60.ENC28J60.ENC28J60_SelectBank(self._nic, address)
+        if self._nic._currentBank != bank:
+            ops: list = self._ops if self._ops else [('other', self._Totals('other'))]
+            for _, totals in ops:
+                totals[3] += 1
+    def _AcquireBus(self) -> bool:
+        acquired: bool = ENC28J60.ENC28J60._AcquireBus(self._nic)
+        if acquired: self._nic._bus = _TracedBus(self, self._nic._bus)
+        return acquired
+    def operation(self, name: str) -> _TraceOp:
+        """with tracer.operation(name): counts the SPI commands of the block for name"""
+        return _TraceOp(self, name)
+    def wrap(self, obj, names: tuple, label=None) -> None:
+        """Trace each call of obj.<name> as an operation, label is the operation name or label(*args, **kwargs) -> str.
+        The default name drops the ENC28J60_ prefix. Only calls through the instance are seen"""
+        for name in names:
+            if (obj, name) in self._wrapped:
+                continue
+            method = getattr(obj, name)
+            opName = name[len('ENC28J60_'):] if name.startswith('ENC28J60_') else name
+            setattr(obj, name, self._Traced(method, opName if label is None else label))
+            self._wrapped.append((obj, name))
+    def _Traced(self, method, label):
+        def traced(*args, **kwargs):
+            with self.operation(label(*args, **kwargs) if callable(label) else label):
+                return method(*args, **kwargs)
+        return traced
+    def start(self) -> None:
+        """Hook the driver: its bus, CS pin, bank selection and DRIVER_OPS. The bus must not be held"""
+        if self.running:
+            return None
+        if self._nic._bus is not None:
+            raise RuntimeError('SPI bus is held, tracing can only start between operations')
+        self._nic._AcquireBus = self._AcquireBus
+        self._nic.ENC28J60_SelectBank = self._SelectBank
+        self._wrapped.append((self._nic, 'ENC28J60_SelectBank'))
+        self._nic._cs = _TracedCs(self, self._nic._cs)
+        self.wrap(self._nic, DRIVER_OPS)
+        self.running = True
+    def stop(self) -> None:
+        """Unhook everything, the driver is back to its untraced methods. Records and totals are kept"""
+        if not self.running:
+            return None
+        if self._nic._bus is not None:
+            raise RuntimeError('SPI bus is held, tracing can only stop between operations')
+        for obj, name in self._wrapped:
+            delattr(obj, name)
+        self._wrapped.clear()
+        del self._nic._AcquireBus
+        self._nic._cs = self._nic._cs._cs
+        self.running = False
+    def reset(self) -> None:
+        """Forget records and totals"""
+        self._ring = [None] * len(self._ring)
+        self._ringNext = 0
+        self._ringCnt = 0
+        self._totals.clear()
+        # Open operations keep counting into fresh totals
+        self._ops = [(name, self._Totals(name)) for name, _ in self._ops]
+    def records(self) -> list:
+        """Last commands, oldest first: (operation, opcode name, register address, bank, bytes)"""
+        out: list = []
+        first: int = (self._ringNext - self._ringCnt) % len(self._ring)
+        for i in range(self._ringCnt):
+            name, cmd, bank, length = self._ring[(first + i) % len(self._ring)]
+            opcode, register = decodeCommand(cmd)
+            out.append((name, opcode, register, bank, length))
+        return out
+    @property
+    def totals(self) -> dict:
+        """{operation: (calls, commands, bytes, bank switches)}"""
+        return {name: tuple(totals) for name, totals in self._totals.items()}
+    def report(self) -> str:
+        """SPI cost per operation, most commands first"""
+        lines: list = ['{:<28}{:>8}{:>10}{:>10}{:>8}{:>10}{:>10}'.format('operation', 'calls', 'commands', 'bytes', 'banks', 'cmd/call', 'B/call')]
+        for name, (calls, commands, length, banks) in sorted(self._totals.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<28}{:>8}{:>10}{:>10}{:>8}{:>10.1f}{:>10.1f}'.format(
+                name, calls, commands, length, banks, commands / max(calls, 1), length / max(calls, 1)))
+        return '\n'.join(lines)
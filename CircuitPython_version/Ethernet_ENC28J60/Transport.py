@@ -47,6 +47,12 @@ class UDP:
     src_port: int=10000, # source port for packets, cannot be letter than 1024!
     dos_conf: tuple=(50, 100, 200, 200), # ARP, ICMP, TCP, UDP limit to check dos attack
     ttc: int=10, # try to connect = ttc
+    int_pin=None, # ENC28J60 INT pin, rx_packet does no SPI traffic while nothing is received
+    rx_buffer_size: int=0x1800, # bytes of the 8 KB ENC28J60 SRAM used as RX ring, the rest is TX buffer
+    rx_filter: bool=False, # the ENC28J60 drops every broadcast except ARP requests for src_addr
+    spi_calibrate: bool=False, # raise the SPI clock to the fastest reliable rate
+    spi_nvm_offset: int=-1, # with spi_calibrate, keep that rate in microcontroller.nvm[spi_nvm_offset:spi_nvm_offset + 6], -1: not kept
+    spi_shared: bool=False, # set when other code on the SPI bus configures it without SPIDevice (e.g. a display)
     ):
         # Target host:
         self._tgt_addr: bytes = bytes(tgt_addr)
@@ -55,8 +61,13 @@ class UDP:
         self._src_addr: list = src_addr
         self._src_port: int = src_port
         # Network config:
-        self._network = Network.Network(spi, cs, dos_conf)
+        self._network = Network.Network(spi, cs, dos_conf, nicIntPin=int_pin, nicSharedBus=spi_shared, nicRxBufferSize=rx_buffer_size)
+        # Calibrated before the filters are set: a failed probe initializes the ENC28J60 again
+        if spi_calibrate: self._network.nic.ENC28J60_CalibrateBaudrate(nvmOffset=spi_nvm_offset)
         self._network.setIPv4(src_addr, sub_net, gateway_addr)
+        if rx_filter: self._network.setRxFilter()
+        self._network.registerLinkCallback(self._link_changed)
+        self._flow: Network.Udp4Flow = Network.Udp4Flow(self._network, self._tgt_addr, self._tgt_port, self._src_port)
         # Functional config:
         self._ttc: int = ttc
         self._kill_switch: bool = OFF
@@ -83,40 +94,13 @@ class UDP:
         self._stat = stat
     def event(self, msg: str) -> None:
         print(f"Transport: {msg}")
+    def _link_changed(self, up: bool) -> None:
+        """Link callback, the ARP table is kept: data sent meanwhile is held and goes out when the link is up"""
+        if up: self.event(f"Link is up, {len(self._network.txHold)} held packets to send")
+        else: self.event('Link is down, packets are held')
     def _send_udp4_unicast(self, payload: str) -> int:
-        """Unicast method to sending payload"""
-        msg: list = []
-        encoded_payload: bytes = payload.encode()
-
-        if self._network.isLocalIp4(self._tgt_addr):
-            tgtMac = self._network.getArpEntry(self._tgt_addr)
-        else:
-            tgtMac = self._network.getArpEntry(self._network.gwIp4Addr)
-
-        if tgtMac is None:
-            self.event(f"{self._tgt_addr[0]}.{self._tgt_addr[1]}.{self._tgt_addr[2]}.{self._tgt_addr[3]} not in ARP table!")
-            return -1
-
-        if self._network.ip4TxCount == 255: self._network.ip4TxCount = 0
-        msg.append(tgtMac)
-        msg.append(self._network.myMacAddr)
-        msg.append(bytearray([Network.ETH_TYPE_IP4 >> 8, Network.ETH_TYPE_IP4_S]))
-        msg.append(Network.makeIp4Hdr(
-            self._network.myIp4Addr,
-            self._tgt_addr,
-            self._network.ip4TxCount,
-            Network.IP4_TYPE_UDP,
-            8 + len(encoded_payload)))
-        self._network.ip4TxCount += 1
-        msg.append(Network.makeUdp4Hdr(
-            self._network.myIp4Addr,
-            self._src_port,
-            self._tgt_addr,
-            self._tgt_port,
-            encoded_payload))
-        msg.append(encoded_payload)
-        result: int = self._network.txPkt(msg)
-        return result
+        """Unicast method to sending payload, the headers to the target are prebuilt once in a flow"""
+        return self._flow.send(payload.encode())
     def _send_udp4_broadcast(self, payload: str, src_ip4_addr=None) -> int:
         """Broadcast method to sending payload"""
         msg: list = []
@@ -261,6 +245,8 @@ class UDP:
                     if what_is_happen < 0:
                         self.event(f"Fail to send data error={what_is_happen}")
                         self.is_link = IDLE
+                    elif what_is_happen == Network.TX_HELD:
+                        print('Ethernet: Data held until the link is up')
                     else:
                         print('Ethernet: Data sent')
                 else:
@@ -287,4 +273,5 @@ class UDP:
         if req: self.send_request(which='alive', waiting_for=3)
     def refresh(self) -> None:
         self._network.nic.ENC28J60_Init()
+        self._network.restoreNicFilters()
         self.event('Ethernet reset')
@@ -23,6 +23,9 @@ except ImportError:
 __version__ = "5.1.8"
 __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_BusDevice.git"
 
+# Last (baudrate, polarity, phase) applied to each bus by an SPIDevice
+_bus_configuration = {}
+
 
 class SPIDevice:
     """
@@ -39,6 +42,9 @@ class SPIDevice:
     :param int phase: The SPI phase
     :param int extra_clocks: The minimum number of clock cycles to cycle the bus after CS is high.
         (Used for SD cards.)
+    :param bool cache_configuration: Skip ``spi.configure`` when the last configuration applied
+        to this bus by an SPIDevice is the same. Set to false if the bus is shared with code that
+        configures it without SPIDevice (e.g. displayio). Defaults to true.
 
     .. note:: This class is **NOT** built into CircuitPython. See
       :ref:`here for install instructions <bus_device_installation>`.
@@ -75,7 +81,8 @@ class SPIDevice:
         baudrate: int = 100000,
         polarity: int = 0,
         phase: int = 0,
-        extra_clocks: int = 0
+        extra_clocks: int = 0,
+        cache_configuration: bool = True
     ) -> None:
         self.spi = spi
         self.baudrate = baudrate
@@ -84,15 +91,32 @@ class SPIDevice:
         self.extra_clocks = extra_clocks
         self.chip_select = chip_select
         self.cs_active_value = cs_active_value
+        self.cache_configuration = cache_configuration
         if self.chip_select:
             self.chip_select.switch_to_output(value=True)
 
-    def __enter__(self) -> SPI:
-        while not self.spi.try_lock():
-            pass
+    def apply_configuration(self) -> bool:
+        """Configure the locked bus for this device, return False if it was already configured"""
+        configuration = (self.baudrate, self.polarity, self.phase)
+        if (
+            self.cache_configuration
+            and _bus_configuration.get(self.spi) == configuration
+        ):
+            return False
         self.spi.configure(
             baudrate=self.baudrate, polarity=self.polarity, phase=self.phase
         )
+        if self.cache_configuration:
+            _bus_configuration[self.spi] = configuration
+        else:
+            # The bus may be left in any mode, the next device has to configure it
+            _bus_configuration.pop(self.spi, None)
+        return True
+
+    def __enter__(self) -> SPI:
+        while not self.spi.try_lock():
+            pass
+        self.apply_configuration()
         if self.chip_select:
             self.chip_select.value = self.cs_active_value
         return self.spi
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# Python 3.10 or higher (host side only)
+
+# SPI cost of the driver operations, measured on the ENC28J60 emulator.
+# Run: python3 Emulator/bench.py [-n 200]
+
+import os
+import sys
+import struct
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, 'CircuitPython_version', 'Ethernet_ENC28J60'))
+
+from enc28j60_emu import ENC28J60Emulator, install_shims, load_micropython_driver
+
+install_shims()
+
+MY_MAC = b'\x0e\x5f\x5f\x19\x98\x00'
+PEER_MAC = b'\x02\x00\x00\x00\x00\x01'
+MY_IP = bytes([192, 168, 1, 198])
+PEER_IP = bytes([192, 168, 1, 200])
+
+def checksum(data: bytes, start: int=0) -> int:
+    chksm = start
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    for (word,) in struct.iter_unpack('!H', data):
+        chksm += word
+    chksm = (chksm >> 16) + (chksm & 0xFFFF)
+    chksm += chksm >> 16
+    return ~chksm & 0xFFFF
+
+def ip4_frame(dst_mac: bytes, proto: int, payload: bytes, dst_ip: bytes=MY_IP) -> bytes:
+    hdr = bytearray(struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 1, 0, 64, proto, 0, PEER_IP, dst_ip))
+    struct.pack_into('!H', hdr, 10, checksum(hdr))
+    return dst_mac + PEER_MAC + b'\x08\x00' + bytes(hdr) + payload
+
+def icmp_echo_frame(size: int=56) -> bytes:
+    icmp = bytearray(struct.pack('!BBHHH', 8, 0, 0, 0x1234, 1) + bytes(range(256))[:size] * 1)
+    struct.pack_into('!H', icmp, 2, checksum(icmp))
+    return ip4_frame(MY_MAC, 1, bytes(icmp))
+
+def udp_frame(payload: bytes, dst_port: int=6000, dst_mac: bytes=MY_MAC, dst_ip: bytes=MY_IP) -> bytes:
+    udp = struct.pack('!HHHH', 5000, dst_port, 8 + len(payload), 0) + payload
+    return ip4_frame(dst_mac, 17, udp, dst_ip)
+
+def arp_request_frame() -> bytes:
+    return b'\xff' * 6 + PEER_MAC + b'\x08\x06' + struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, PEER_MAC, PEER_IP, b'\x00' * 6, MY_IP)
+
+def timed(emu: ENC28J60Emulator, label: str, n: int, fn) -> float:
+    """Run fn n times under emu.measure(label), return microseconds per call"""
+    t0 = perf_counter()
+    for _ in range(n):
+        with emu.measure(label):
+            fn()
+    return (perf_counter() - t0) * 1e6 / n
+
+def bench_circuitpython(n: int) -> None:
+    import ENC28J60
+    import Network
+    emu = ENC28J60Emulator()
+    times = {}
+    nic = ENC28J60.ENC28J60(emu.spi, emu.cs)
+    times['init'] = timed(emu, 'init', 1, nic.ENC28J60_Init)
+    small = [bytes(60)]
+    large = [bytes(1000)]
+    rx = bytearray(ENC28J60.ENC28J60_ETH_RX_BUFFER_SIZE)
+    times['send 60B'] = timed(emu, 'send 60B', n, lambda: nic.ENC28J60_SendPacket(small))
+    times['send 1000B'] = timed(emu, 'send 1000B', n, lambda: nic.ENC28J60_SendPacket(large))
+    emu.chip.pop_sent()
+    frame = udp_frame(b'x' * 32)
+    def receive() -> None:
+        emu.chip.inject(frame)
+        nic.ENC28J60_ReceivePacket(rx)
+    times['receive 74B'] = timed(emu, 'receive 74B', n, receive)
+    def receive_pending() -> None:
+        emu.chip.inject(frame)
+        nic.ENC28J60_ReceivePacket(rx, pending=True)
+    times['receive 74B pending'] = timed(emu, 'receive 74B pending', n, receive_pending)
+    times['poll idle'] = timed(emu, 'poll idle', n, nic.ENC28J60_GetRxPacketCnt)
+    times['dma checksum 1000B'] = timed(emu, 'dma checksum 1000B', n, lambda: nic.ENC28J60_DmaChecksum(0x1800, 0x1800 + 999))
+
+    # Whole stack
+    ntw = Network.Network(emu.spi, emu.cs, (10 ** 9, 10 ** 9, 10 ** 9, 10 ** 9))
+    ntw.setIPv4(list(MY_IP), [255, 255, 255, 0], [192, 168, 1, 1])
+    ntw.event = lambda msg: None
+    ping = icmp_echo_frame()
+    arp = arp_request_frame()
+    udp = udp_frame(b'msg>>Hello Pico')
+    def stack(frame: bytes):
+        def run() -> None:
+            emu.chip.inject(frame)
+            ntw.rxAllPkt()
+            ntw.UDP_Q.clear()
+        return run
+    times['ping reply'] = timed(emu, 'ping reply', n, stack(ping))
+    times['arp reply'] = timed(emu, 'arp reply', n, stack(arp))
+    times['udp receive'] = timed(emu, 'udp receive', n, stack(udp))
+    ntw.addArpEntry(PEER_IP, PEER_MAC)
+    flow = Network.Udp4Flow(ntw, PEER_IP, 5000, 10000)
+    times['udp send flow'] = timed(emu, 'udp send flow', n, lambda: flow.send(b'msg>>Hello Pico'))
+    def burst() -> None:
+        for _ in range(4):
+            emu.chip.inject(ping)
+        ntw.rxAllPkt()
+    times['ping burst x4'] = timed(emu, 'ping burst x4', n, burst)
+    # Echo data copied from the RX ring by the DMA vs. sent back over SPI (IP length stays < 256 on the host)
+    big_ping = icmp_echo_frame(200)
+    times['ping 200B reflect'] = timed(emu, 'ping 200B reflect', n, stack(big_ping))
+    ntw.reflectMin = 10 ** 9
+    times['ping 200B no reflect'] = timed(emu, 'ping 200B no reflect', n, stack(big_ping))
+    ntw.reflectMin = Network.REFLECT_MIN
+    times['rxAllPkt idle'] = timed(emu, 'rxAllPkt idle', n, ntw.rxAllPkt)
+
+    # Same stack woken by the INT pin
+    ntw = Network.Network(emu.spi, emu.cs, (10 ** 9, 10 ** 9, 10 ** 9, 10 ** 9), nicIntPin=emu.int)
+    ntw.setIPv4(list(MY_IP), [255, 255, 255, 0], [192, 168, 1, 1])
+    ntw.event = lambda msg: None
+    times['ping reply INT'] = timed(emu, 'ping reply INT', n, stack(ping))
+    times['rxAllPkt idle INT'] = timed(emu, 'rxAllPkt idle INT', n, ntw.rxAllPkt)
+    report('CircuitPython_version', emu, times)
+
+def bench_micropython(n: int) -> None:
+    enc28j60 = load_micropython_driver(os.path.join(ROOT, 'MicroPython_version', 'enc28j60.py'))
+    emu = ENC28J60Emulator()
+    times = {}
+    nic = enc28j60.ENC28J60(emu.spi, emu.cs)
+    times['init'] = timed(emu, 'init', 1, nic.init)
+    small = [bytes(60)]
+    large = [bytes(1000)]
+    rx = bytearray(enc28j60.ENC28J60_ETH_RX_BUFFER_SIZE)
+    times['send 60B'] = timed(emu, 'send 60B', n, lambda: nic.SendPacket(small))
+    times['send 1000B'] = timed(emu, 'send 1000B', n, lambda: nic.SendPacket(large))
+    emu.chip.pop_sent()
+    frame = udp_frame(b'x' * 32, dst_mac=bytes(nic.getMacAddr()))
+    def receive() -> None:
+        emu.chip.inject(frame)
+        nic.ReceivePacket(rx)
+    times['receive 74B'] = timed(emu, 'receive 74B', n, receive)
+    def receive_pending() -> None:
+        emu.chip.inject(frame)
+        nic.ReceivePacket(rx, pending=True)
+    times['receive 74B pending'] = timed(emu, 'receive 74B pending', n, receive_pending)
+    times['poll idle'] = timed(emu, 'poll idle', n, nic.GetRxPacketCnt)
+    report('MicroPython_version', emu, times)
+
+def report(title: str, emu: ENC28J60Emulator, times: dict) -> None:
+    print(f"\n# {title}")
+    lines = emu.report().split('\n')
+    print(f"{lines[0]}{'us/call':>10}")
+    for line, label in zip(lines[1:], emu.operations):
+        print(f"{line}{times[label]:>10.1f}")
+
+if __name__ == '__main__':
+    count = 200
+    if '-n' in sys.argv:
+        count = int(sys.argv[sys.argv.index('-n') + 1])
+    bench_circuitpython(count)
+    bench_micropython(count)
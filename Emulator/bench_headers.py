@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# Python 3.10 or higher (host side only)
+
+# Per-packet header parse cost: struct.unpack_from format strings against the Headers.py offset accessors.
+# Both parse what procEth, procArp, procIp4 and procUdp4 need. CPython caches compiled formats and runs unpack_from
+# in C, so on the host struct wins on time. Neither port has struct.Struct to precompile a format.
+# The objs columns are counted while each parser runs once, by the MicroPython and CircuitPython rules: every
+# struct result tuple, every 4s/6s field, every frame slice and every int of 2**30 or more is a heap object there,
+# smaller ints are not. CPython's own heap use says nothing about this, it allocates every int above 256.
+# Run: python3 Emulator/bench_headers.py [-n 100000]
+
+import os
+import sys
+import struct as host_struct
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, 'CircuitPython_version', 'Ethernet_ENC28J60'))
+
+from enc28j60_emu import install_shims
+
+install_shims()
+
+from Headers import u16, addrSum, ETH_TYPE, ARP_OPER, ARP_TPA, IP4_VER_IHL, IP4_TOTLEN, IP4_FLAGS_FRAG, \
+    IP4_PROTO, IP4_SRC, IP4_DST, UDP_SRC_PORT, UDP_DST_PORT, UDP_LEN, UDP_CHKSM
+from bench import udp_frame, arp_request_frame, MY_IP
+
+MY_IP_HI = u16(MY_IP, 0)
+MY_IP_LO = u16(MY_IP, 2)
+SMALL_INT_MAX = (1 << 30) - 1 # MicroPython small int, larger ones are heap allocated
+
+class HeapCount:
+    """Objects the parsers would allocate on the MicroPython heap"""
+    def __init__(self) -> None:
+        self.objs = 0
+    def result(self, value):
+        if isinstance(value, int):
+            if value > SMALL_INT_MAX:
+                self.objs += 1
+        elif isinstance(value, (tuple, bytes, bytearray, memoryview)):
+            self.objs += 1
+            if isinstance(value, tuple):
+                for item in value:
+                    self.result(item)
+        return value
+
+class CountingStruct:
+    """struct module seen by the parsers while counting: each result and its fields are counted"""
+    def __init__(self, heap: HeapCount) -> None:
+        self.heap = heap
+    def unpack_from(self, fmt: str, buf, offset: int=0) -> tuple:
+        if isinstance(buf, CountingFrame):
+            buf = buf.frame
+        return self.heap.result(host_struct.unpack_from(fmt, buf, offset))
+    def unpack(self, fmt: str, buf) -> tuple:
+        return self.heap.result(host_struct.unpack(fmt, buf))
+
+class CountingFrame:
+    """Frame seen by the parsers while counting: a slice is a new memoryview"""
+    def __init__(self, frame: memoryview, heap: HeapCount) -> None:
+        self.frame = frame
+        self.heap = heap
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.heap.result(self.frame[index])
+        return self.frame[index]
+    def __len__(self) -> int:
+        return len(self.frame)
+
+struct = host_struct
+
+def struct_udp(frame) -> int:
+    etype, = struct.unpack_from('!H', frame, 12)
+    ver_len, _, totlen, _, frag, ttl, proto, hdr_chksm, src, dst = struct.unpack_from('!BBHHHBBH4s4s', frame, 14)
+    if dst != MY_IP:
+        return 0
+    sport, dport, length, chksm = struct.unpack_from('!HHHH', frame, 34)
+    return sum(struct.unpack('!HH', src)) + sum(struct.unpack('!HH', dst)) + sport + dport + length + chksm + totlen + frag
+
+def offset_udp(frame) -> int:
+    etype = u16(frame, ETH_TYPE)
+    ver_len = frame[14 + IP4_VER_IHL]
+    totlen = u16(frame, 14 + IP4_TOTLEN)
+    frag = u16(frame, 14 + IP4_FLAGS_FRAG)
+    proto = frame[14 + IP4_PROTO]
+    if u16(frame, 14 + IP4_DST + 2) != MY_IP_LO or u16(frame, 14 + IP4_DST) != MY_IP_HI:
+        return 0
+    sport = u16(frame, 34 + UDP_SRC_PORT)
+    dport = u16(frame, 34 + UDP_DST_PORT)
+    length = u16(frame, 34 + UDP_LEN)
+    chksm = u16(frame, 34 + UDP_CHKSM)
+    return addrSum(frame, 14 + IP4_SRC) + addrSum(frame, 14 + IP4_DST) + sport + dport + length + chksm + totlen + frag
+
+def struct_arp(frame) -> int:
+    hrtype, prtype, hrlen, prlen, oper, sha, spa, tha, tpa = struct.unpack_from('!HHBBH6s4s6s4s', frame, 14)
+    return oper if tpa == MY_IP else 0
+
+def offset_arp(frame) -> int:
+    oper = u16(frame, 14 + ARP_OPER)
+    return oper if u16(frame, 14 + ARP_TPA + 2) == MY_IP_LO and u16(frame, 14 + ARP_TPA) == MY_IP_HI else 0
+
+def heap_objs(fn, frame) -> int:
+    """Heap objects of one fn(frame) call by the MicroPython rules"""
+    global struct
+    heap = HeapCount()
+    struct = CountingStruct(heap)
+    try:
+        heap.result(fn(CountingFrame(frame, heap)))
+    finally:
+        struct = host_struct
+    return heap.objs
+
+def measure(fn, frame, n: int) -> float:
+    start = perf_counter()
+    for _ in range(n):
+        fn(frame)
+    return (perf_counter() - start) * 1e9 / n
+
+if __name__ == '__main__':
+    count = 100000
+    if '-n' in sys.argv:
+        count = int(sys.argv[sys.argv.index('-n') + 1])
+    frames = {
+        'udp to me': memoryview(bytearray(udp_frame(b'x' * 32))),
+        'udp bcast noise': memoryview(bytearray(udp_frame(b'x' * 32, dst_ip=bytes([192, 168, 1, 255])))),
+        'arp request': memoryview(bytearray(arp_request_frame())),
+    }
+    cases = [
+        ('udp to me', struct_udp, offset_udp),
+        ('udp bcast noise', struct_udp, offset_udp),
+        ('arp request', struct_arp, offset_arp),
+    ]
+    print(f"{'frame':<18}{'struct ns':>12}{'offsets ns':>12}{'struct objs':>13}{'offsets objs':>14}")
+    for label, old, new in cases:
+        assert old(frames[label]) == new(frames[label])
+        old_ns = measure(old, frames[label], count)
+        new_ns = measure(new, frames[label], count)
+        print(f"{label:<18}{old_ns:>12.0f}{new_ns:>12.0f}{heap_objs(old, frames[label]):>13}{heap_objs(new, frames[label]):>14}")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# Python 3.10 or higher (host side only)
+
+# Receive path cost on a LAN mix: mostly broadcast and multicast noise, some traffic addressed to us.
+# Each frame goes from procEth to the point where a handler has read what it uses (UDP client: ports and data,
+# echo reply: addresses and lengths). 'eager' is the previous decoding, every IPv4 header field read before the
+# destination check; 'early' is Network.procEth, which compares the destination first and reads the header fields
+# into plain Packet attributes once the datagram is accepted. The frame bytes each one inspects are counted next
+# to the time.
+# Run: python3 Emulator/bench_rxmix.py [-n 20000]
+
+import os
+import sys
+import struct
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, 'CircuitPython_version', 'Ethernet_ENC28J60'))
+
+from enc28j60_emu import ENC28J60Emulator, install_shims
+
+install_shims()
+
+import ENC28J60
+import Network
+from Headers import u16, copyAddr, ETH_DST, ETH_SRC, ETH_TYPE, ETH_HDR_LEN, ETH_VLAN_TYPE, ETH_VLAN_HDR_LEN, \
+    ARP_TPA, IP4_VER_IHL, IP4_TOTLEN, IP4_FLAGS_FRAG, IP4_PROTO, IP4_SRC, IP4_DST, IP4_BCAST_HALF, IP4_FLAG_MF, IP4_FRAG_MASK, \
+    UDP_SRC_PORT, UDP_DST_PORT, UDP_LEN, UDP_CHKSM, UDP_HDR_LEN
+from bench import udp_frame, icmp_echo_frame, MY_IP, PEER_MAC, PEER_IP
+
+BCAST_MAC = b'\xff' * 6
+BOUND_PORT = 6000
+REPEAT = 5
+
+def arp_who_has(ip: bytes) -> bytes:
+    return BCAST_MAC + PEER_MAC + b'\x08\x06' + struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, PEER_MAC, PEER_IP, b'\x00' * 6, ip)
+
+# (label, frames per 100, frame)
+MIX = [
+    ('arp who-has other', 30, arp_who_has(bytes([192, 168, 1, 50]))),
+    ('netbios subnet bcast', 15, udp_frame(b'n' * 50, dst_port=137, dst_mac=BCAST_MAC, dst_ip=bytes([192, 168, 1, 255]))),
+    ('ssdp mcast', 10, udp_frame(b's' * 120, dst_port=1900, dst_mac=b'\x01\x00\x5e\x7f\xff\xfa', dst_ip=bytes([239, 255, 255, 250]))),
+    ('dhcp bcast other', 5, udp_frame(b'd' * 240, dst_port=67, dst_mac=BCAST_MAC, dst_ip=bytes([255, 255, 255, 255]))),
+    ('ipv6 mcast', 10, b'\x33\x33\x00\x00\x00\x01' + PEER_MAC + b'\x86\xdd' + bytes(60)),
+    ('udp to me, bound', 20, udp_frame(b'msg>>Hello Pico')),
+    ('ping to me', 10, icmp_echo_frame()),
+]
+
+class CountingFrame:
+    """Frame seen by the parser while counting: indexing a byte counts it, slices are views and count nothing"""
+    def __init__(self, frame: memoryview) -> None:
+        self.frame = frame
+        self.count = 0
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.frame[index]
+        self.count += 1
+        return self.frame[index]
+    def __len__(self) -> int:
+        return len(self.frame)
+
+# Handlers: read what procUdp4 and procIcmp4 use, the same code runs on both packet kinds
+def use_udp(pkt, bcast: bool=False) -> None:
+    if pkt.udp_dstPort != BOUND_PORT or bcast:
+        return None
+    pkt.udp_srcPort, pkt.udp_dataLen, pkt.udp_dataOffset, pkt.ip_src_addr, pkt.ip_maxoffset
+
+def use_icmp(pkt, bcast: bool=False) -> None:
+    if bcast:
+        return None
+    pkt.ip_offset, pkt.ip_totlen, pkt.ip_src_addr, pkt.eth_src
+
+def use_arp(pkt) -> None:
+    u16(pkt.frame, pkt.eth_offset + ARP_TPA + 2) == pkt.ntw.myIp4Lo and u16(pkt.frame, pkt.eth_offset + ARP_TPA) == pkt.ntw.myIp4Hi
+
+# Previous procEth, procIp4 and procUdp4 decoding: plain attributes, all of them set before the destination is compared
+class EagerPacket:
+    __slots__ = ('ntw', 'frame', 'frame_len', 'eth_type', 'eth_offset', 'eth_dst', 'eth_src',
+        'ip_proto', 'ip_ver', 'ip_hdrlen', 'ip_totlen', 'ip_offset', 'ip_maxoffset', 'ip_src_addr', 'ip_dst_addr',
+        'udp_srcPort', 'udp_dstPort', 'udp_dataLen', 'udp_dataOffset')
+    def __init__(self, ntw, frame: bytearray) -> None:
+        self.ntw = ntw
+        self.frame = memoryview(frame)
+        self.frame_len = 0
+        self.eth_dst = self.frame[ETH_DST:ETH_SRC]
+        self.eth_src = self.frame[ETH_SRC:ETH_TYPE]
+        self.ip_src_addr = bytearray(4)
+        self.ip_dst_addr = bytearray(4)
+
+# procUdp4 decoding, the same for both: the UDP fields are read once the datagram reached its handler
+def decode_udp(pkt, bcast: bool=False) -> None:
+    frame = pkt.frame
+    offset = pkt.ip_offset
+    pkt.udp_srcPort = u16(frame, offset + UDP_SRC_PORT)
+    pkt.udp_dstPort = u16(frame, offset + UDP_DST_PORT)
+    udpLen = u16(frame, offset + UDP_LEN)
+    chksm_rx = u16(frame, offset + UDP_CHKSM)
+    pkt.udp_dataLen = udpLen - UDP_HDR_LEN
+    pkt.udp_dataOffset = offset + UDP_HDR_LEN
+    use_udp(pkt, bcast)
+
+EAGER_IP4 = {Network.IP4_TYPE_ICMP: use_icmp, Network.IP4_TYPE_UDP: decode_udp}
+
+def eager_ip4(pkt) -> None:
+    frame = pkt.frame
+    offset = pkt.eth_offset
+    pkt.ip_proto = frame[offset + IP4_PROTO]
+    handler = EAGER_IP4.get(pkt.ip_proto)
+    if handler is None:
+        return None
+    ip_ver_len = frame[offset + IP4_VER_IHL]
+    pkt.ip_totlen = u16(frame, offset + IP4_TOTLEN)
+    ip_flags_fragoffset = u16(frame, offset + IP4_FLAGS_FRAG)
+    pkt.ip_ver = (ip_ver_len >> 4) & 0xF
+    pkt.ip_hdrlen = (ip_ver_len & 0xF) << 2
+    pkt.ip_offset = pkt.eth_offset + pkt.ip_hdrlen
+    pkt.ip_maxoffset = pkt.eth_offset + pkt.ip_totlen
+    if pkt.ip_ver != 4:
+        pkt.ntw.event(f"ip_ver={pkt.ip_ver} not supported!")
+    if pkt.ip_hdrlen != 20:
+        pkt.ntw.event(f"ip_hdrlen={pkt.ip_hdrlen} not supported!")
+    flags_mf = 1 if ip_flags_fragoffset & IP4_FLAG_MF else 0
+    fragOffset = (ip_flags_fragoffset & IP4_FRAG_MASK) << 3
+    if (0 != flags_mf) or (0 != fragOffset):
+        pkt.ntw.event(f"Fragmented IPv4 not supported: fragOffset={fragOffset}, flags_mf={flags_mf}")
+    dstHi = u16(frame, offset + IP4_DST)
+    dstLo = u16(frame, offset + IP4_DST + 2)
+    if dstLo == pkt.ntw.myIp4Lo and dstHi == pkt.ntw.myIp4Hi:
+        mine = True
+    elif dstLo == IP4_BCAST_HALF and dstHi == IP4_BCAST_HALF:
+        mine = False
+    elif (dstHi >> 12) == 0xE and bytes(frame[offset + IP4_DST:offset + IP4_DST + 4]) in pkt.ntw.mcastGroups:
+        mine = False
+    else:
+        return None
+    copyAddr(pkt.ip_src_addr, frame, offset + IP4_SRC)
+    copyAddr(pkt.ip_dst_addr, frame, offset + IP4_DST)
+    if mine:
+        pkt.ntw.event(f"Rx my IP proto={pkt.ip_proto}")
+    handler(pkt, not mine)
+
+EAGER_ETH = {Network.ETH_TYPE_IP4: eager_ip4, Network.ETH_TYPE_ARP: use_arp}
+
+def eager_eth(pkt) -> None:
+    frame = pkt.frame
+    pkt.eth_type = u16(frame, ETH_TYPE)
+    pkt.eth_offset = ETH_HDR_LEN
+    if pkt.eth_type == Network.ETH_80211Q_TAG:
+        pkt.eth_type = u16(frame, ETH_VLAN_TYPE)
+        pkt.eth_offset = ETH_VLAN_HDR_LEN
+    handler = EAGER_ETH.get(pkt.eth_type)
+    if handler is None:
+        return None
+    handler(pkt)
+
+def load(pkt, frame: bytes) -> None:
+    pkt.frame.obj[:len(frame)] = frame
+    pkt.frame_len = len(frame) + 4
+
+def measure(proc, pkt, frame: bytes, n: int) -> tuple:
+    """(ns per frame, best of REPEAT runs, frame bytes inspected)"""
+    load(pkt, frame)
+    view = pkt.frame
+    pkt.frame = counting = CountingFrame(view)
+    proc(pkt)
+    pkt.frame = view
+    best = None
+    for _ in range(REPEAT):
+        start = perf_counter()
+        for _ in range(n):
+            proc(pkt)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best * 1e9 / n, counting.count)
+
+if __name__ == '__main__':
+    count = 20000
+    if '-n' in sys.argv:
+        count = int(sys.argv[sys.argv.index('-n') + 1])
+    emu = ENC28J60Emulator()
+    ntw = Network.Network(emu.spi, emu.cs, (10 ** 9, 10 ** 9, 10 ** 9, 10 ** 9))
+    ntw.setIPv4(list(MY_IP), [255, 255, 255, 0], [192, 168, 1, 1])
+    ntw.registerEthType(Network.ETH_TYPE_ARP, use_arp)
+    ntw.registerIp4Proto(Network.IP4_TYPE_ICMP, use_icmp)
+    ntw.registerIp4Proto(Network.IP4_TYPE_UDP, decode_udp)
+    ntw.event = lambda msg: None
+    eager = EagerPacket(ntw, bytearray(ENC28J60.ENC28J60_ETH_RX_BUFFER_SIZE))
+    early = Network.Packet(ntw, bytearray(ENC28J60.ENC28J60_ETH_RX_BUFFER_SIZE), 0)
+
+    print(f"{'frame':<22}{'/100':>6}{'eager ns':>10}{'early ns':>10}{'eager B':>9}{'early B':>9}")
+    totals = [0.0, 0.0, 0, 0]
+    for label, weight, frame in MIX:
+        eager_ns, eager_bytes = measure(eager_eth, eager, frame, count)
+        early_ns, early_bytes = measure(Network.procEth, early, frame, count)
+        print(f"{label:<22}{weight:>6}{eager_ns:>10.0f}{early_ns:>10.0f}{eager_bytes:>9}{early_bytes:>9}")
+        for i, value in enumerate((eager_ns, early_ns, eager_bytes, early_bytes)):
+            totals[i] += weight * value / 100
+    print(f"{'mix, per frame':<22}{100:>6}{totals[0]:>10.0f}{totals[1]:>10.0f}{totals[2]:>9.1f}{totals[3]:>9.1f}")
@@ -0,0 +1,942 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+#  GPLv3 License
+
+# Copyright (c) 2022 mehrdad
+# Developed by mehrdad-mixtape https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60
+
+# Python 3.10 or higher (host side only, never copy this file to the board)
+
+# This file implements a register level model of the ENC28J60 behind a fake SPI bus.
+# Supports:
+# - SPI command set: RCR, RBM, WCR, WBM, BFS, BFC, SRC (one opcode per CS frame)
+# - Banked ETH/MAC/MII registers, PHY registers through the MII interface (MIIRD, MIISCAN)
+# - 8 KB SRAM, RX ring between ERXST/ERXND with ERXWRPT/ERXRDPT, EPKTCNT and PKTDEC
+# - RX overflow: EIR.RXERIF and ESTAT.BUFER, the next stored frame reports the drop event in its RSV
+# - Receive filters (UCEN, BCEN, MCEN, HTEN, PMEN), TX start via ECON1.TXRTS with status vector
+# - TX faults: collisions, late/excessive collision aborts and the errata abort that leaves TXRTS set
+# - Link up/down with PHIR.PLNKIF and EIR.LINKIF
+# - DMA checksum (CSUMEN) and DMA copy, both wrapping at ERXND inside the RX ring
+# - Active-low INT pin with falling edge callbacks (machine.Pin.irq, countio.Counter)
+# - SPI clock limit: reads are corrupted above max_baudrate
+# - Counters of SPI frames, bytes, bus locks and configure calls, per opcode and per operation
+#
+# Both drivers can run unmodified on top of it:
+#   from enc28j60_emu import ENC28J60Emulator, install_shims
+#   install_shims()                   # busio, digitalio, microcontroller, machine, micropython
+#   emu = ENC28J60Emulator()
+#   nic = ENC28J60.ENC28J60(emu.spi, emu.cs)          # CircuitPython_version
+#   nic = enc28j60.ENC28J60(emu.spi, emu.cs)          # MicroPython_version
+
+import sys
+import time
+import types
+from binascii import crc32
+
+__version__ = '0.1.0v'
+__repo__ = 'https://github.com/mehrdad-mixtape/CircuitPython-ENC28J60'
+
+SRAM_SIZE = 0x2000
+SRAM_MASK = 0x1FFF
+
+# SPI opcodes (upper 3 bits of the first byte)
+OP_RCR = 0
+OP_RBM = 1
+OP_WCR = 2
+OP_WBM = 3
+OP_BFS = 4
+OP_BFC = 5
+OP_SRC = 7
+OP_NAMES = {OP_RCR: 'RCR', OP_RBM: 'RBM', OP_WCR: 'WCR', OP_WBM: 'WBM', OP_BFS: 'BFS', OP_BFC: 'BFC', OP_SRC: 'SRC'}
+
+# Register addresses inside a bank
+ERDPTL, ERDPTH, EWRPTL, EWRPTH = 0x00, 0x01, 0x02, 0x03
+ETXSTL, ETXSTH, ETXNDL, ETXNDH = 0x04, 0x05, 0x06, 0x07
+ERXSTL, ERXSTH, ERXNDL, ERXNDH = 0x08, 0x09, 0x0A, 0x0B
+ERXRDPTL, ERXRDPTH, ERXWRPTL, ERXWRPTH = 0x0C, 0x0D, 0x0E, 0x0F
+EDMASTL, EDMASTH, EDMANDL, EDMANDH = 0x10, 0x11, 0x12, 0x13
+EDMADSTL, EDMADSTH, EDMACSL, EDMACSH = 0x14, 0x15, 0x16, 0x17
+EIE, EIR, ESTAT, ECON2, ECON1 = 0x1B, 0x1C, 0x1D, 0x1E, 0x1F
+EHT0 = 0x00
+EPMM0 = 0x08
+EPMCSL, EPMCSH, EPMOL, EPMOH = 0x10, 0x11, 0x14, 0x15
+ERXFCON, EPKTCNT = 0x18, 0x19
+MACON1, MACON3, MACON4, MABBIPG = 0x00, 0x02, 0x03, 0x04
+MAIPGL, MAIPGH, MACLCON1, MACLCON2 = 0x06, 0x07, 0x08, 0x09
+MAMXFLL, MAMXFLH = 0x0A, 0x0B
+MICMD, MIREGADR, MIWRL, MIWRH, MIRDL, MIRDH = 0x12, 0x14, 0x16, 0x17, 0x18, 0x19
+MAADR1, MAADR0, MAADR3, MAADR2, MAADR5, MAADR4 = 0x00, 0x01, 0x02, 0x03, 0x04, 0x05
+MISTAT, EREVID, ECOCON, EFLOCON, EPAUSL, EPAUSH = 0x0A, 0x12, 0x15, 0x17, 0x18, 0x19
+
+# PHY registers
+PHCON1, PHSTAT1, PHID1, PHID2 = 0x00, 0x01, 0x02, 0x03
+PHCON2, PHSTAT2, PHIE, PHIR, PHLCON = 0x10, 0x11, 0x12, 0x13, 0x14
+
+# Bits
+EIR_PKTIF, EIR_DMAIF, EIR_LINKIF, EIR_TXIF, EIR_TXERIF, EIR_RXERIF = 0x40, 0x20, 0x10, 0x08, 0x02, 0x01
+ESTAT_INT, ESTAT_BUFER, ESTAT_LATECOL, ESTAT_RXBUSY, ESTAT_TXABRT, ESTAT_CLKRDY = 0x80, 0x40, 0x10, 0x04, 0x02, 0x01
+ECON2_AUTOINC, ECON2_PKTDEC = 0x80, 0x40
+ECON1_TXRST, ECON1_RXRST, ECON1_DMAST, ECON1_CSUMEN, ECON1_TXRTS, ECON1_RXEN = 0x80, 0x40, 0x20, 0x10, 0x08, 0x04
+ECON1_BSEL = 0x03
+ERXFCON_UCEN, ERXFCON_ANDOR, ERXFCON_CRCEN, ERXFCON_PMEN = 0x80, 0x40, 0x20, 0x10
+ERXFCON_MPEN, ERXFCON_HTEN, ERXFCON_MCEN, ERXFCON_BCEN = 0x08, 0x04, 0x02, 0x01
+MICMD_MIISCAN, MICMD_MIIRD = 0x02, 0x01
+MISTAT_NVALID, MISTAT_SCAN, MISTAT_BUSY = 0x04, 0x02, 0x01
+PHSTAT1_LLSTAT = 0x0004
+PHSTAT2_LSTAT = 0x0400
+PHIE_PLNKIE, PHIE_PGEIE = 0x0010, 0x0002
+PHIR_PLNKIF, PHIR_PGIF = 0x0010, 0x0004
+
+# Receive status vector bits
+RSV_BROADCAST_PACKET = 0x0200
+RSV_MULTICAST_PACKET = 0x0100
+RSV_RECEIVED_OK = 0x0080
+RSV_DROP_EVENT = 0x0001
+
+# Registers that answer RCR with a dummy byte first (MAC and MII registers)
+_DUMMY_BYTE_REGS = frozenset(
+    [(2, a) for a in range(0x1B)] +
+    [(3, a) for a in (MAADR1, MAADR0, MAADR3, MAADR2, MAADR5, MAADR4, MISTAT)]
+)
+
+def _reg_index(bank: int, addr: int) -> int:
+    """Return the index of a register inside the flat register file"""
+    if addr >= EIE: # common registers are mapped into all banks
+        return addr
+    return (bank << 5) | addr
+
+def _ip_checksum(data: bytearray) -> int:
+    """One's complement checksum as computed by the DMA and the pattern match filter"""
+    chksm = 0
+    for idx in range(0, len(data) - 1, 2):
+        chksm += (data[idx] << 8) | data[idx + 1]
+    if len(data) & 1:
+        chksm += data[-1] << 8
+    chksm = (chksm >> 16) + (chksm & 0xFFFF)
+    chksm += chksm >> 16
+    return ~chksm & 0xFFFF
+
+class SpiStats:
+    """SPI traffic counters, a CS framed transaction is the unit of work"""
+    def __init__(self):
+        self.reset()
+    def reset(self) -> None:
+        self.frames: int = 0
+        self.bytes: int = 0
+        self.locks: int = 0
+        self.configures: int = 0
+        self.by_op: dict = {}
+        self.bytes_by_op: dict = {}
+    def snapshot(self) -> dict:
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'locks': self.locks,
+            'configures': self.configures,
+            'by_op': dict(self.by_op),
+            'bytes_by_op': dict(self.bytes_by_op),
+        }
+    @staticmethod
+    def delta(after: dict, before: dict) -> dict:
+        """Return the difference of two snapshots"""
+        result = {}
+        for key in ('frames', 'bytes', 'locks', 'configures'):
+            result[key] = after[key] - before[key]
+        for key in ('by_op', 'bytes_by_op'):
+            result[key] = {op: n - before[key].get(op, 0) for op, n in after[key].items() if n - before[key].get(op, 0)}
+        return result
+
+class _Measure:
+    """Context manager that records the SPI cost of the enclosed block under a label"""
+    def __init__(self, emu, label: str):
+        self._emu = emu
+        self._label = label
+        self._before: dict = {}
+        self.result: dict = {}
+    def __enter__(self):
+        self._before = self._emu.stats.snapshot()
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.result = SpiStats.delta(self._emu.stats.snapshot(), self._before)
+        ops = self._emu.operations.setdefault(self._label, {'calls': 0, 'frames': 0, 'bytes': 0, 'locks': 0, 'configures': 0})
+        ops['calls'] += 1
+        for key in ('frames', 'bytes', 'locks', 'configures'):
+            ops[key] += self.result[key]
+        return False
+
+class ENC28J60Chip:
+    """Register level model of the ENC28J60"""
+    def __init__(self, link_up: bool=True, rev_id: int=0x06, mii_busy_reads: int=0, tx_latency: int=0, dma_latency: int=0):
+        self.rev_id: int = rev_id
+        # Number of MISTAT reads that still report BUSY after an MII operation
+        self.mii_busy_reads: int = mii_busy_reads
+        # Number of SPI frames a transmission stays in progress after TXRTS is set
+        self.tx_latency: int = tx_latency
+        # Number of SPI frames ECON1.DMAST stays set after a DMA is started
+        self.dma_latency: int = dma_latency
+        self.dma_runs: int = 0
+        self.stats: SpiStats = SpiStats()
+        self.sram = bytearray(SRAM_SIZE)
+        self.regs = bytearray(4 * 32)
+        self.phy: list = [0] * 32
+        self.link_up: bool = link_up
+        self.sent: list = [] # transmitted frames, without per-packet control byte
+        # Outcome of the next transmissions: None, 'collision' (sent after 2 collisions), 'late', 'excessive', 'stuck'
+        # or 'hang' (TXRTS stays set and no flag is raised until TXRST)
+        self.tx_faults: list = []
+        self.dropped: int = 0 # frames rejected by the RX ring (full or EPKTCNT saturated)
+        self.filtered: int = 0 # frames rejected by the receive filters
+        self._drop_event: bool = False # the next stored frame reports the drop in its RSV
+        self._selected: bool = False
+        self._op: int = -1
+        self._arg: int = 0
+        self._pos: int = 0
+        self._frame_bytes: int = 0
+        self._rdpt_latch: int = 0
+        self._mii_busy: int = 0
+        self._tx_pending: int = -1
+        self._dma_pending: int = -1
+        self._int_level: bool = False
+        self.int_listeners: list = [] # called on every falling edge of INT
+        self.reset()
+
+    # ----------------------------- Reset ----------------------------- #
+    def reset(self) -> None:
+        """Power-on / system reset values"""
+        self.regs[:] = bytes(len(self.regs))
+        self._set16(0, ERDPTL, 0x05FA)
+        self._set16(0, ERXSTL, 0x05FA)
+        self._set16(0, ERXNDL, 0x1FFF)
+        self._set16(0, ERXRDPTL, 0x05FA)
+        self._rdpt_latch = 0xFA
+        self.regs[_reg_index(0, ECON2)] = ECON2_AUTOINC
+        self.regs[_reg_index(0, ESTAT)] = ESTAT_CLKRDY
+        self.regs[_reg_index(1, ERXFCON)] = ERXFCON_UCEN | ERXFCON_CRCEN | ERXFCON_BCEN
+        self.regs[_reg_index(2, MACLCON1)] = 0x0F
+        self.regs[_reg_index(2, MACLCON2)] = 0x37
+        self._set16(2, MAMXFLL, 0x0600)
+        self.regs[_reg_index(3, EREVID)] = self.rev_id
+        self.regs[_reg_index(3, ECOCON)] = 0x04
+        self._set16(3, EPAUSL, 0x1000)
+        self.phy = [0] * 32
+        self.phy[PHSTAT1] = 0x1800
+        self.phy[PHID1] = 0x0083
+        self.phy[PHID2] = 0x1400
+        self.phy[PHLCON] = 0x3422
+        if self.link_up:
+            self.phy[PHSTAT1] |= PHSTAT1_LLSTAT
+            self.phy[PHSTAT2] |= PHSTAT2_LSTAT
+        self._mii_busy = 0
+        self._tx_pending = -1
+
+    # ----------------------------- Register helpers ----------------------------- #
+    def _get16(self, bank: int, addr: int) -> int:
+        return self.regs[_reg_index(bank, addr)] | (self.regs[_reg_index(bank, addr + 1)] << 8)
+    def _set16(self, bank: int, addr: int, value: int) -> None:
+        self.regs[_reg_index(bank, addr)] = value & 0xFF
+        self.regs[_reg_index(bank, addr + 1)] = (value >> 8) & 0xFF
+    @property
+    def bank(self) -> int:
+        return self.regs[ECON1] & ECON1_BSEL
+    def reg(self, bank: int, addr: int) -> int:
+        """Peek a register without side effects"""
+        return self.regs[_reg_index(bank, addr)]
+    def pointer(self, name: str) -> int:
+        """Peek a 16-bit bank 0 pointer: ERDPT, EWRPT, ETXST, ETXND, ERXST, ERXND, ERXRDPT, ERXWRPT, EDMAST, EDMAND, EDMADST, EDMACS"""
+        offsets = {'ERDPT': ERDPTL, 'EWRPT': EWRPTL, 'ETXST': ETXSTL, 'ETXND': ETXNDL,
+                   'ERXST': ERXSTL, 'ERXND': ERXNDL, 'ERXRDPT': ERXRDPTL, 'ERXWRPT': ERXWRPTL,
+                   'EDMAST': EDMASTL, 'EDMAND': EDMANDL, 'EDMADST': EDMADSTL, 'EDMACS': EDMACSL}
+        return self._get16(0, offsets[name])
+    @property
+    def packet_count(self) -> int:
+        return self.regs[_reg_index(1, EPKTCNT)]
+    @property
+    def mac_addr(self) -> bytes:
+        r = self.regs
+        return bytes([r[_reg_index(3, MAADR5)], r[_reg_index(3, MAADR4)], r[_reg_index(3, MAADR3)],
+                      r[_reg_index(3, MAADR2)], r[_reg_index(3, MAADR1)], r[_reg_index(3, MAADR0)]])
+
+    def _read_reg(self, addr: int) -> int:
+        """Register read as seen over SPI, including read side effects"""
+        bank = self.bank
+        if bank == 2 and addr in (MIRDL, MIRDH) and self.regs[_reg_index(2, MICMD)] & MICMD_MIISCAN:
+            self._mii_latch(self._phy_read(self.regs[_reg_index(2, MIREGADR)] & 0x1F))
+        elif bank == 3 and addr == MISTAT:
+            if self._mii_busy > 0:
+                self._mii_busy -= 1
+                if self._mii_busy == 0:
+                    self.regs[_reg_index(3, MISTAT)] &= ~MISTAT_BUSY & 0xFF
+                return self.regs[_reg_index(3, MISTAT)] | MISTAT_BUSY
+        return self.regs[_reg_index(bank, addr)]
+
+    def _write_reg(self, addr: int, value: int) -> None:
+        """Register write as seen over SPI (WCR, or result of BFS/BFC)"""
+        bank = self.bank
+        idx = _reg_index(bank, addr)
+        old = self.regs[idx]
+        if addr >= EIE:
+            if addr == EIR:
+                # PKTIF and LINKIF are read-only
+                value = (value & ~(EIR_PKTIF | EIR_LINKIF)) | (old & (EIR_PKTIF | EIR_LINKIF))
+                self.regs[idx] = value & 0xFF
+            elif addr == ESTAT:
+                # Only BUFER, LATECOL and TXABRT can be cleared
+                keep = old & ~(ESTAT_BUFER | ESTAT_LATECOL | ESTAT_TXABRT)
+                self.regs[idx] = (keep | (value & old & (ESTAT_BUFER | ESTAT_LATECOL | ESTAT_TXABRT))) & 0xFF
+            elif addr == ECON2:
+                if value & ECON2_PKTDEC:
+                    self._packet_dec()
+                self.regs[idx] = value & ~ECON2_PKTDEC & 0xFF
+            elif addr == ECON1:
+                self.regs[idx] = value & 0xFF
+                self._econ1_changed(old, value)
+            else:
+                self.regs[idx] = value & 0xFF
+            self._update_int()
+            return
+        if bank == 0:
+            if addr == ERXRDPTL:
+                # The low byte is buffered until the high byte is written
+                self._rdpt_latch = value & 0xFF
+                return
+            if addr == ERXRDPTH:
+                self.regs[_reg_index(0, ERXRDPTL)] = self._rdpt_latch
+                self.regs[idx] = value & 0x1F
+                return
+            if addr in (ERXWRPTL, ERXWRPTH, EDMACSL, EDMACSH):
+                return # read-only
+            self.regs[idx] = value & 0xFF
+            if addr in (ERXSTL, ERXSTH):
+                # Programming ERXST also moves the hardware write pointer
+                self._set16(0, ERXWRPTL, self._get16(0, ERXSTL))
+            return
+        if bank == 1:
+            if addr == EPKTCNT:
+                return # read-only
+            self.regs[idx] = value & 0xFF
+            return
+        if bank == 2:
+            if addr in (MIRDL, MIRDH):
+                return # read-only
+            self.regs[idx] = value & 0xFF
+            if addr == MIWRH:
+                self._phy_write(self.regs[_reg_index(2, MIREGADR)] & 0x1F, self._get16(2, MIWRL))
+                self._start_mii_busy()
+            elif addr == MICMD:
+                if value & MICMD_MIIRD and not old & MICMD_MIIRD:
+                    self._mii_latch(self._phy_read(self.regs[_reg_index(2, MIREGADR)] & 0x1F))
+                    self._start_mii_busy()
+                if value & MICMD_MIISCAN:
+                    self._mii_latch(self._phy_read(self.regs[_reg_index(2, MIREGADR)] & 0x1F))
+                    self.regs[_reg_index(3, MISTAT)] |= MISTAT_SCAN
+                else:
+                    self.regs[_reg_index(3, MISTAT)] &= ~(MISTAT_SCAN | MISTAT_NVALID) & 0xFF
+            return
+        if addr in (EREVID, MISTAT):
+            return # read-only
+        self.regs[idx] = value & 0xFF
+
+    # ----------------------------- MII / PHY ----------------------------- #
+    def _start_mii_busy(self) -> None:
+        if self.mii_busy_reads > 0:
+            self._mii_busy = self.mii_busy_reads
+            self.regs[_reg_index(3, MISTAT)] |= MISTAT_BUSY
+    def _mii_latch(self, value: int) -> None:
+        # The PHY answers immediately, so MISTAT.NVALID never stays set in the model
+        self._set16(2, MIRDL, value)
+    def _phy_read(self, addr: int) -> int:
+        value = self.phy[addr]
+        if addr == PHIR:
+            # Reading PHIR clears the PHY interrupt flags and EIR.LINKIF
+            self.phy[PHIR] = 0
+            self.regs[EIR] &= ~EIR_LINKIF & 0xFF
+            self._update_int()
+        elif addr == PHSTAT1 and self.link_up:
+            # LLSTAT latches low on link loss, reading it re-arms the latch
+            self.phy[PHSTAT1] |= PHSTAT1_LLSTAT
+        return value
+    def _phy_write(self, addr: int, value: int) -> None:
+        if addr in (PHSTAT1, PHSTAT2, PHID1, PHID2, PHIR):
+            return # read-only
+        if addr == PHCON1 and value & 0x8000: # PRST
+            value &= 0x7FFF
+        self.phy[addr] = value & 0xFFFF
+    def set_link(self, up: bool) -> None:
+        """Plug or unplug the cable"""
+        if up == self.link_up:
+            return None
+        self.link_up = up
+        if up:
+            self.phy[PHSTAT2] |= PHSTAT2_LSTAT
+        else:
+            self.phy[PHSTAT2] &= ~PHSTAT2_LSTAT & 0xFFFF
+            self.phy[PHSTAT1] &= ~PHSTAT1_LLSTAT & 0xFFFF
+        self.phy[PHIR] |= PHIR_PLNKIF | PHIR_PGIF
+        if (self.phy[PHIE] & (PHIE_PLNKIE | PHIE_PGEIE)) == (PHIE_PLNKIE | PHIE_PGEIE):
+            self.regs[EIR] |= EIR_LINKIF
+        self._update_int()
+
+    # ----------------------------- Interrupts ----------------------------- #
+    def _update_int(self) -> None:
+        """Keep EIR.PKTIF and ESTAT.INT consistent with the current state"""
+        if self.regs[_reg_index(1, EPKTCNT)]:
+            self.regs[EIR] |= EIR_PKTIF
+        else:
+            self.regs[EIR] &= ~EIR_PKTIF & 0xFF
+        if self.regs[EIR] & self.regs[EIE] & 0x7F:
+            self.regs[ESTAT] |= ESTAT_INT
+        else:
+            self.regs[ESTAT] &= ~ESTAT_INT & 0xFF
+        level = self.int_asserted
+        if level and not self._int_level:
+            for listener in self.int_listeners:
+                listener()
+        self._int_level = level
+    @property
+    def int_asserted(self) -> bool:
+        """Level of the active-low INT pin, True means the pin is pulled low"""
+        return bool(self.regs[EIE] & 0x80) and bool(self.regs[ESTAT] & ESTAT_INT)
+
+    # ----------------------------- ECON1 ----------------------------- #
+    def _econ1_changed(self, old: int, new: int) -> None:
+        if new & ECON1_TXRST:
+            self.regs[ECON1] &= ~ECON1_TXRTS & 0xFF
+            self._tx_pending = -1
+        if new & ECON1_RXRST:
+            self.regs[_reg_index(1, EPKTCNT)] = 0
+            self._set16(0, ERXWRPTL, self._get16(0, ERXSTL))
+        if new & ECON1_TXRTS and not old & ECON1_TXRTS and not new & ECON1_TXRST:
+            if self.tx_latency > 0:
+                self._tx_pending = self.tx_latency
+            else:
+                self._transmit()
+        if new & ECON1_DMAST and not old & ECON1_DMAST:
+            self._dma()
+            if self.dma_latency > 0:
+                self._dma_pending = self.dma_latency
+            else:
+                self._dma_done()
+    def _tick(self) -> None:
+        """Advance time by one SPI frame"""
+        if self._tx_pending > 0:
+            self._tx_pending -= 1
+            if self._tx_pending == 0:
+                self._tx_pending = -1
+                self._transmit()
+        if self._dma_pending > 0:
+            self._dma_pending -= 1
+            if self._dma_pending == 0:
+                self._dma_pending = -1
+                self._dma_done()
+
+    # ----------------------------- DMA ----------------------------- #
+    def _dma_next(self, ptr: int) -> int:
+        """Next DMA address, wrapping at ERXND inside the RX ring"""
+        start = self._get16(0, ERXSTL)
+        stop = self._get16(0, ERXNDL)
+        if ptr == stop and start <= ptr:
+            return start
+        return (ptr + 1) & SRAM_MASK
+    def _dma(self) -> None:
+        """Checksum or copy EDMAST..EDMAND, the result is visible immediately, DMAST clears later"""
+        self.dma_runs += 1
+        ptr = self._get16(0, EDMASTL)
+        end = self._get16(0, EDMANDL)
+        data = bytearray()
+        while True:
+            data.append(self.sram[ptr])
+            if ptr == end:
+                break
+            ptr = self._dma_next(ptr)
+        if self.regs[ECON1] & ECON1_CSUMEN:
+            chksm = _ip_checksum(data)
+            self.regs[_reg_index(0, EDMACSH)] = chksm >> 8
+            self.regs[_reg_index(0, EDMACSL)] = chksm & 0xFF
+        else:
+            dst = self._get16(0, EDMADSTL)
+            for value in data:
+                self.sram[dst] = value
+                dst = self._dma_next(dst)
+    def _dma_done(self) -> None:
+        self.regs[ECON1] &= ~ECON1_DMAST & 0xFF
+        self.regs[EIR] |= EIR_DMAIF
+        self._update_int()
+
+    # ----------------------------- TX ----------------------------- #
+    def _transmit(self) -> None:
+        start = self._get16(0, ETXSTL)
+        end = self._get16(0, ETXNDL)
+        # The first byte is the per-packet control byte
+        if end >= start:
+            frame = bytes(self.sram[start + 1:end + 1])
+        else:
+            frame = bytes(self.sram[start + 1:] + self.sram[:end + 1])
+        fault = self.tx_faults.pop(0) if self.tx_faults else None
+        if fault == 'hang':
+            return None
+        # Transmit status vector, 7 bytes written after ETXND
+        length = len(frame) + 4
+        wire = length
+        tsv = bytearray(7)
+        tsv[0] = length & 0xFF
+        tsv[1] = (length >> 8) & 0xFF
+        if fault is None or fault == 'collision':
+            self.sent.append(frame)
+            tsv[2] = 0x80 # transmit done
+            if fault == 'collision':
+                tsv[2] |= 2
+                wire += 2 * 64
+        elif fault == 'late':
+            tsv[2] = 1
+            tsv[3] = 0x20
+            wire += 100
+            self.regs[ESTAT] |= ESTAT_LATECOL | ESTAT_TXABRT
+        else: # excessive, stuck
+            tsv[2] = 15
+            tsv[3] = 0x10
+            wire += 15 * 64
+            self.regs[ESTAT] |= ESTAT_TXABRT
+        if frame[0] & 0x01:
+            tsv[3] |= 0x01 if frame[0:6] != b'\xff' * 6 else 0x02
+        tsv[4] = wire & 0xFF # total bytes on the wire
+        tsv[5] = (wire >> 8) & 0xFF
+        for i in range(7):
+            self.sram[(end + 1 + i) & SRAM_MASK] = tsv[i]
+        if fault == 'stuck':
+            # Errata: the abort leaves TXRTS set and only TXERIF is raised
+            self.regs[EIR] |= EIR_TXERIF
+        else:
+            self.regs[ECON1] &= ~ECON1_TXRTS & 0xFF
+            self.regs[EIR] |= EIR_TXIF | (0 if fault in (None, 'collision') else EIR_TXERIF)
+        self._update_int()
+    def pop_sent(self) -> list:
+        """Return and forget all transmitted frames"""
+        frames = self.sent
+        self.sent = []
+        return frames
+
+    # ----------------------------- RX ----------------------------- #
+    def _packet_dec(self) -> None:
+        idx = _reg_index(1, EPKTCNT)
+        if self.regs[idx] > 0:
+            self.regs[idx] -= 1
+    def _rx_free(self) -> int:
+        start = self._get16(0, ERXSTL)
+        stop = self._get16(0, ERXNDL)
+        wr = self._get16(0, ERXWRPTL)
+        rd = self._get16(0, ERXRDPTL)
+        size = stop - start + 1
+        if wr > rd:
+            return size - (wr - rd) - 1
+        if wr == rd:
+            return size - 1
+        return rd - wr - 1
+    def _accept(self, frame: bytes) -> bool:
+        fcon = self.regs[_reg_index(1, ERXFCON)]
+        if fcon & ~ERXFCON_CRCEN & 0xFF == 0:
+            return True # promiscuous
+        dst = frame[0:6]
+        matches = []
+        if fcon & ERXFCON_UCEN:
+            matches.append(dst == self.mac_addr)
+        if fcon & ERXFCON_BCEN:
+            matches.append(dst == b'\xff' * 6)
+        if fcon & ERXFCON_MCEN:
+            matches.append(bool(dst[0] & 0x01) and dst != b'\xff' * 6)
+        if fcon & ERXFCON_HTEN:
+            matches.append(self._hash_match(dst))
+        if fcon & ERXFCON_PMEN:
+            matches.append(self._pattern_match(frame))
+        if fcon & ERXFCON_ANDOR:
+            return all(matches)
+        return any(matches)
+    def _hash_match(self, dst: bytes) -> bool:
+        # The hash table pointer is bits 28:23 of the CRC of the destination address, with the register shifted
+        # MSB first and no final inversion (Linux ether_crc): the bit reversed, not inverted binascii.crc32
+        crc = int('{:032b}'.format(~crc32(bytes(dst)) & 0xFFFFFFFF)[::-1], 2)
+        bit = (crc >> 23) & 0x3F
+        return bool(self.regs[_reg_index(1, EHT0 + (bit >> 3))] & (1 << (bit & 0x07)))
+    def _pattern_match(self, frame: bytes) -> bool:
+        # EPMM selects bytes of the 64 byte window at EPMO, their checksum must equal EPMCS.
+        # A window that runs past the end of the packet (FCS included) fails
+        offset = self._get16(1, EPMOL)
+        if offset + 64 > len(frame) + 4:
+            return False
+        packet = bytes(frame) + (crc32(bytes(frame)) & 0xFFFFFFFF).to_bytes(4, 'little')
+        data = bytearray(packet[offset + i] for i in range(64) if self.regs[_reg_index(1, EPMM0 + (i >> 3))] & (1 << (i & 0x07)))
+        return _ip_checksum(data) == (self.regs[_reg_index(1, EPMCSH)] << 8) | self.regs[_reg_index(1, EPMCSL)]
+    def _rx_write(self, ptr: int, data: bytes) -> int:
+        start = self._get16(0, ERXSTL)
+        stop = self._get16(0, ERXNDL)
+        for b in data:
+            self.sram[ptr] = b
+            ptr = start if ptr == stop else (ptr + 1) & SRAM_MASK
+        return ptr
+    def inject(self, frame: bytes, status: int=RSV_RECEIVED_OK) -> bool:
+        """Receive a frame from the wire, FCS is appended by the model"""
+        if not self.regs[ECON1] & ECON1_RXEN:
+            self.dropped += 1
+            return False
+        if not self._accept(frame):
+            self.filtered += 1
+            return False
+        length = len(frame) + 4
+        need = 6 + length + (length & 1)
+        if self.regs[_reg_index(1, EPKTCNT)] == 0xFF or need > self._rx_free():
+            self.regs[EIR] |= EIR_RXERIF
+            self.regs[ESTAT] |= ESTAT_BUFER
+            self.dropped += 1
+            self._drop_event = True
+            self._update_int()
+            return False
+        start = self._get16(0, ERXSTL)
+        stop = self._get16(0, ERXNDL)
+        wr = self._get16(0, ERXWRPTL)
+        nxt = wr
+        for _ in range(need):
+            nxt = start if nxt == stop else (nxt + 1) & SRAM_MASK
+        if frame[0] & 0x01:
+            status |= RSV_BROADCAST_PACKET if frame[0:6] == b'\xff' * 6 else RSV_MULTICAST_PACKET
+        if self._drop_event:
+            status |= RSV_DROP_EVENT
+            self._drop_event = False
+        header = bytes([nxt & 0xFF, nxt >> 8, length & 0xFF, length >> 8, status & 0xFF, (status >> 8) & 0xFF])
+        fcs = (crc32(bytes(frame)) & 0xFFFFFFFF).to_bytes(4, 'little')
+        self._rx_write(wr, header + bytes(frame) + fcs)
+        self._set16(0, ERXWRPTL, nxt)
+        self.regs[_reg_index(1, EPKTCNT)] += 1
+        self._update_int()
+        return True
+
+    # ----------------------------- SPI ----------------------------- #
+    def select(self) -> None:
+        """CS falling edge"""
+        if self._selected:
+            return None
+        self._selected = True
+        self._op = -1
+        self._pos = 0
+        self._frame_bytes = 0
+    def deselect(self) -> None:
+        """CS rising edge, ends the current command"""
+        if not self._selected:
+            return None
+        self._selected = False
+        if self._frame_bytes:
+            name = OP_NAMES.get(self._op, '?')
+            stats = self.stats
+            stats.frames += 1
+            stats.bytes += self._frame_bytes
+            stats.by_op[name] = stats.by_op.get(name, 0) + 1
+            stats.bytes_by_op[name] = stats.bytes_by_op.get(name, 0) + self._frame_bytes
+            self._tick()
+    def exchange(self, out, inp=None, count: int=-1, fill: int=0) -> None:
+        """Shift bytes through the chip, out may be None to clock fill bytes"""
+        if count < 0:
+            count = len(out) if out is not None else len(inp)
+        if not self._selected or count == 0:
+            return None
+        self._frame_bytes += count
+        i = 0
+        if self._op < 0:
+            first = out[0] if out is not None else fill
+            self._op = first >> 5
+            self._arg = first & 0x1F
+            self._pos = 1
+            if inp is not None:
+                inp[0] = 0
+            i = 1
+            if self._op == OP_SRC:
+                self.reset()
+        op = self._op
+        if op == OP_RBM:
+            self._read_buffer(inp, i, count)
+            return None
+        if op == OP_WBM:
+            self._write_buffer(out, i, count, fill)
+            return None
+        while i < count:
+            b = out[i] if out is not None else fill
+            result = 0
+            pos = self._pos
+            if op == OP_RCR:
+                dummy = (self.bank, self._arg) in _DUMMY_BYTE_REGS
+                if pos == (2 if dummy else 1):
+                    result = self._read_reg(self._arg)
+            elif pos == 1:
+                if op == OP_WCR:
+                    self._write_reg(self._arg, b)
+                elif op == OP_BFS or op == OP_BFC:
+                    # Bit field commands only work on ETH registers
+                    if (self.bank, self._arg) not in _DUMMY_BYTE_REGS:
+                        old = self.regs[_reg_index(self.bank, self._arg)]
+                        self._write_reg(self._arg, old | b if op == OP_BFS else old & ~b & 0xFF)
+            if inp is not None:
+                inp[i] = result
+            self._pos = pos + 1
+            i += 1
+    def _read_buffer(self, inp, i: int, count: int) -> None:
+        ptr = self._get16(0, ERDPTL)
+        autoinc = self.regs[ECON2] & ECON2_AUTOINC
+        start = self._get16(0, ERXSTL)
+        stop = self._get16(0, ERXNDL)
+        while i < count:
+            if not autoinc:
+                if inp is not None:
+                    inp[i:count] = bytes([self.sram[ptr]]) * (count - i)
+                break
+            # Copy the longest contiguous run, the pointer wraps at ERXND inside the RX ring
+            limit = stop if start <= ptr <= stop else SRAM_MASK
+            n = min(count - i, limit - ptr + 1)
+            if inp is not None:
+                inp[i:i + n] = self.sram[ptr:ptr + n]
+            i += n
+            ptr += n
+            if ptr > limit:
+                ptr = start if limit == stop else 0
+        self._set16(0, ERDPTL, ptr)
+    def _write_buffer(self, out, i: int, count: int, fill: int) -> None:
+        ptr = self._get16(0, EWRPTL)
+        autoinc = self.regs[ECON2] & ECON2_AUTOINC
+        while i < count:
+            n = min(count - i, SRAM_SIZE - ptr) if autoinc else 1
+            if out is not None:
+                self.sram[ptr:ptr + n] = out[i:i + n]
+            else:
+                self.sram[ptr:ptr + n] = bytes([fill]) * n
+            i += n
+            if autoinc:
+                ptr = (ptr + n) & SRAM_MASK
+        self._set16(0, EWRPTL, ptr)
+
+class FakeSPI:
+    """SPI bus with the busio.SPI and machine.SPI surface, wired to one ENC28J60Chip.
+    Above max_baudrate the wiring is too slow: bit 0 of every byte read back is flipped"""
+    def __init__(self, chip: ENC28J60Chip, max_baudrate: int=None):
+        self.chip: ENC28J60Chip = chip
+        self.max_baudrate = max_baudrate
+        self.baudrate: int = 0
+        self.polarity: int = 0
+        self.phase: int = 0
+        self._locked: bool = False
+    # busio.SPI
+    def try_lock(self) -> bool:
+        if self._locked:
+            return False
+        self._locked = True
+        self.chip.stats.locks += 1
+        return True
+    def unlock(self) -> None:
+        self._locked = False
+    def configure(self, *, baudrate: int=100000, polarity: int=0, phase: int=0, bits: int=8) -> None:
+        self.baudrate = baudrate
+        self.polarity = polarity
+        self.phase = phase
+        self.chip.stats.configures += 1
+    def deinit(self) -> None:
+        pass
+    # machine.SPI
+    def init(self, baudrate: int=0, **kwargs) -> None:
+        if baudrate:
+            self.baudrate = baudrate
+    def _garble(self, view) -> None:
+        if self.max_baudrate is not None and self.baudrate > self.max_baudrate:
+            for idx in range(len(view)):
+                view[idx] ^= 0x01
+    # Both
+    def write(self, buf, start: int=0, end: int=None) -> None:
+        view = memoryview(buf)[start:end]
+        self.chip.exchange(view)
+    def readinto(self, buf, start: int=0, end: int=None, write_value: int=0, write: int=None) -> None:
+        if write is not None:
+            write_value = write
+        view = memoryview(buf)[start:end]
+        self.chip.exchange(None, view, len(view), write_value)
+        self._garble(view)
+    def read(self, nbytes: int, write: int=0) -> bytes:
+        buf = bytearray(nbytes)
+        self.chip.exchange(None, buf, nbytes, write)
+        self._garble(buf)
+        return bytes(buf)
+    def write_readinto(self, out_buf, in_buf, out_start: int=0, out_end: int=None, in_start: int=0, in_end: int=None) -> None:
+        out_view = bytes(memoryview(out_buf)[out_start:out_end])
+        in_view = memoryview(in_buf)[in_start:in_end]
+        self.chip.exchange(out_view, in_view)
+        self._garble(in_view)
+
+class FakePin:
+    """Chip select line with the machine.Pin and digitalio.DigitalInOut surface"""
+    OUT = 1
+    IN = 0
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    def __init__(self, chip: ENC28J60Chip):
+        self.chip: ENC28J60Chip = chip
+        self._value: bool = True
+        self.direction = None
+    def _drive(self, value) -> None:
+        value = bool(value)
+        self._value = value
+        if value:
+            self.chip.deselect()
+        else:
+            self.chip.select()
+    # machine.Pin
+    def init(self, mode: int=-1, pull: int=-1, value=None) -> None:
+        if value is not None:
+            self._drive(value)
+    def __call__(self, value=None):
+        if value is None:
+            return int(self._value)
+        self._drive(value)
+    def on(self) -> None:
+        self._drive(1)
+    def off(self) -> None:
+        self._drive(0)
+    # digitalio.DigitalInOut
+    @property
+    def value(self) -> bool:
+        return self._value
+    @value.setter
+    def value(self, value) -> None:
+        self._drive(value)
+    def switch_to_output(self, value: bool=False, drive_mode=None) -> None:
+        self._drive(value)
+    def deinit(self) -> None:
+        pass
+
+class FakeIntPin:
+    """INT line of the chip, machine.Pin input with irq() and a source for countio.Counter"""
+    IN = 0
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    def __init__(self, chip: ENC28J60Chip):
+        self.chip: ENC28J60Chip = chip
+        self.edges: int = 0
+        self._handler = None
+        chip.int_listeners.append(self._falling)
+    def _falling(self) -> None:
+        self.edges += 1
+        if self._handler is not None:
+            self._handler(self)
+    def init(self, mode: int=-1, pull: int=-1, value=None) -> None:
+        pass
+    def irq(self, handler=None, trigger: int=IRQ_FALLING, hard: bool=False) -> None:
+        self._handler = handler
+    def __call__(self) -> int:
+        return self.value()
+    def value(self) -> int:
+        return 0 if self.chip.int_asserted else 1
+
+class ENC28J60Emulator:
+    """Chip, bus, chip select and INT line bundled together"""
+    def __init__(self, max_baudrate: int=None, **kwargs):
+        self.chip: ENC28J60Chip = ENC28J60Chip(**kwargs)
+        self.spi: FakeSPI = FakeSPI(self.chip, max_baudrate)
+        self.cs: FakePin = FakePin(self.chip)
+        self.int: FakeIntPin = FakeIntPin(self.chip)
+        self.operations: dict = {} # {label: accumulated cost}
+    @property
+    def stats(self) -> SpiStats:
+        return self.chip.stats
+    def measure(self, label: str) -> _Measure:
+        """with emu.measure('send'): nic.ENC28J60_SendPacket(...)"""
+        return _Measure(self, label)
+    def report(self) -> str:
+        lines = [f"{'operation':<24}{'calls':>8}{'frames':>10}{'bytes':>10}{'locks':>8}{'cfg':>8}{'frames/call':>13}"]
+        for label, ops in self.operations.items():
+            lines.append(f"{label:<24}{ops['calls']:>8}{ops['frames']:>10}{ops['bytes']:>10}{ops['locks']:>8}{ops['configures']:>8}{ops['frames'] / ops['calls']:>13.1f}")
+        return '\n'.join(lines)
+
+# ----------------------------- Host shims ----------------------------- #
+class _Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+class _DigitalInOut:
+    """digitalio.DigitalInOut for the host, forwards to a FakePin"""
+    def __init__(self, pin):
+        self._pin = pin
+        self._value: bool = True
+        self.direction = None
+    @property
+    def value(self) -> bool:
+        if isinstance(self._pin, FakePin):
+            return self._pin.value
+        return self._value
+    @value.setter
+    def value(self, value) -> None:
+        if isinstance(self._pin, FakePin):
+            self._pin.value = value
+        self._value = bool(value)
+    def switch_to_output(self, value: bool=False, drive_mode=None) -> None:
+        self.direction = _Direction.OUTPUT
+        self.value = value
+    def deinit(self) -> None:
+        pass
+
+class _Edge:
+    RISE = 1
+    FALL = 2
+    RISE_AND_FALL = 3
+
+class _Counter:
+    """countio.Counter for the host, counts falling edges of a FakeIntPin"""
+    def __init__(self, pin, *, edge: int=_Edge.FALL, pull=None):
+        self._pin = pin
+        self._base: int = pin.edges
+    @property
+    def count(self) -> int:
+        return self._pin.edges - self._base
+    @count.setter
+    def count(self, value: int) -> None:
+        self._base = self._pin.edges - value
+    def reset(self) -> None:
+        self.count = 0
+    def deinit(self) -> None:
+        pass
+
+def _sleep_ms(ms: int) -> None:
+    time.sleep(ms / 1000)
+
+def _sleep_us(us: int) -> None:
+    time.sleep(us / 1000000)
+
+def install_shims() -> None:
+    """Register the board-only modules used by both drivers, does nothing on a real board"""
+    if sys.implementation.name != 'cpython':
+        return None
+    def module(name: str, **attrs) -> None:
+        if name in sys.modules:
+            return None
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+    module('micropython', const=lambda value: value)
+    module('busio', SPI=FakeSPI)
+    module('digitalio', DigitalInOut=_DigitalInOut, Direction=_Direction)
+    module('microcontroller', Pin=FakePin, nvm=bytearray(256))
+    module('countio', Counter=_Counter, Edge=_Edge)
+    module('supervisor', ticks_ms=lambda: int(time.monotonic() * 1000) & ((1 << 29) - 1))
+    module('machine', Pin=FakePin, SPI=FakeSPI, unique_id=lambda: b'\x00\x11\x22\x33\x44\x55')
+    if not hasattr(time, 'sleep_ms'):
+        time.sleep_ms = _sleep_ms
+        time.sleep_us = _sleep_us
+        time.ticks_ms = lambda: int(time.monotonic() * 1000)
+        time.ticks_diff = lambda a, b: a - b
+        time.ticks_add = lambda a, b: a + b
+
+def load_micropython_driver(path: str):
+    """Import MicroPython_version/enc28j60.py so that 'from enc28j60 import enc28j60' works as on the board"""
+    import importlib.util
+    install_shims()
+    spec = importlib.util.spec_from_file_location('enc28j60.enc28j60', path)
+    driver = importlib.util.module_from_spec(spec)
+    package = types.ModuleType('enc28j60')
+    package.__path__ = []
+    package.enc28j60 = driver
+    sys.modules['enc28j60'] = package
+    sys.modules['enc28j60.enc28j60'] = driver
+    spec.loader.exec_module(driver)
+    return driver
@@ -24,6 +24,7 @@ ENC28J60_ETH_RX_BUFFER_SIZE          = const(1518)
 
 # RX error codes
 ENC28J60_ETH_RX_ERR_UNSPECIFIED      = const(-1)
+ENC28J60_ETH_RX_ERR_RESET            = const(-2) # corrupt next packet pointer, the RX ring was reset and its frames are lost
 
 # TX buffer size
 ENC28J60_ETH_TX_BUFFER_SIZE          = const(1518)
@@ -31,12 +32,35 @@ ENC28J60_ETH_TX_BUFFER_SIZE          = const(1518)
 # TX error codes
 ENC28J60_ETH_TX_ERR_MSGSIZE          = const(-1)
 ENC28J60_ETH_TX_ERR_LINKDOWN         = const(-2)
+ENC28J60_ETH_TX_ERR_TIMEOUT          = const(-3)
+ENC28J60_ETH_TX_ERR_ABORTED          = const(-4)
+
+# Retransmissions of a frame aborted by a collision (errata: half-duplex aborts may stall the TX logic)
+ENC28J60_TX_RETRY_LIMIT              = const(3)
+
+# ms before a frame that does not complete is sent again after a TX reset, a full frame takes 1.2 ms at 10 Mbit/s
+ENC28J60_TX_IDLE_TIMEOUT             = const(50)
+
+# MISTAT reads before a MII operation is given up, one takes about 10 us and a read is longer than that
+ENC28J60_MII_POLL_LIMIT              = const(1000)
 
 # Receive and transmit buffers
 ENC28J60_RX_BUFFER_START             = const(0x0000)
 ENC28J60_RX_BUFFER_STOP              = const(0x17FF)
 ENC28J60_TX_BUFFER_START             = const(0x1800)
 ENC28J60_TX_BUFFER_STOP              = const(0x1FFF)
+ENC28J60_SRAM_SIZE                   = const(0x2000)
+
+# Every received frame is preceded by the next packet pointer and the receive status vector
+ENC28J60_RX_HEADER_SIZE              = const(6)
+
+# The transmit status vector is written by the chip after the last byte of the frame
+ENC28J60_TX_STATUS_VECTOR_SIZE       = const(7)
+
+# SPI clock calibration: the chip is specified up to 20 MHz, the probe pattern has many bit transitions
+ENC28J60_BAUDRATE_MIN                = const(1_000_000)
+ENC28J60_BAUDRATE_MAX                = const(20_000_000)
+ENC28J60_PROBE_PATTERN               = b'\x00\xff\xaa\x55\x0f\xf0\x33\xcc\x01\x02\x04\x08\x10\x20\x40\x80\xfe\xfd\xfb\xf7\xef\xdf\xbf\x7f'
 
 # SPI command set
 ENC28J60_CMD_RCR                     = const(0x00)
@@ -431,6 +455,22 @@ ENC28J60_TX_CTRL_PPADEN              = const(0x04)
 ENC28J60_TX_CTRL_PCRCEN              = const(0x02)
 ENC28J60_TX_CTRL_POVERRIDE           = const(0x01)
 
+# Transmit status vector, bits 31:16 (bits 15:0 are the byte count, 47:32 the bytes on the wire)
+ENC28J60_TSV_TRANSMIT_UNDERRUN       = const(0x8000)
+ENC28J60_TSV_TRANSMIT_GIANT          = const(0x4000)
+ENC28J60_TSV_LATE_COLLISION          = const(0x2000)
+ENC28J60_TSV_EXCESSIVE_COLLISION     = const(0x1000)
+ENC28J60_TSV_EXCESSIVE_DEFER         = const(0x0800)
+ENC28J60_TSV_PACKET_DEFER            = const(0x0400)
+ENC28J60_TSV_BROADCAST               = const(0x0200)
+ENC28J60_TSV_MULTICAST               = const(0x0100)
+ENC28J60_TSV_DONE                    = const(0x0080)
+ENC28J60_TSV_LENGTH_OUT_OF_RANGE     = const(0x0040)
+ENC28J60_TSV_LENGTH_CHECK_ERROR      = const(0x0020)
+ENC28J60_TSV_CRC_ERROR               = const(0x0010)
+ENC28J60_TSV_COLLISION_COUNT         = const(0x000F)
+ENC28J60_TSV_ABORTED                 = const(0xB800) # underrun, late collision, excessive collisions or defer
+
 # Receive status vector
 ENC28J60_RSV_VLAN_TYPE               = const(0x4000)
 ENC28J60_RSV_UNKNOWN_OPCODE          = const(0x2000)
@@ -446,6 +486,23 @@ ENC28J60_RSV_CRC_ERROR               = const(0x0010)
 ENC28J60_RSV_CARRIER_EVENT           = const(0x0004)
 ENC28J60_RSV_DROP_EVENT              = const(0x0001)
 
+# Shadow register cache: bits of each register that only the driver changes.
+# EIR, ESTAT, EPKTCNT, ERDPT/EWRPT (auto-increment), ECON1.TXRTS/DMAST and ECON2.PKTDEC (cleared by the chip) are volatile.
+# ERXRDPTH is not cached, writing it commits the latched ERXRDPTL; EDMACS, MII and PHY registers always go to the chip
+ENC28J60_SHADOW_MASKS = {
+    ENC28J60_ECON1: ENC28J60_ECON1_TXRST | ENC28J60_ECON1_RXRST | ENC28J60_ECON1_CSUMEN | ENC28J60_ECON1_RXEN | ENC28J60_ECON1_BSEL1 | ENC28J60_ECON1_BSEL0,
+    ENC28J60_ECON2: ENC28J60_ECON2_AUTOINC | ENC28J60_ECON2_PWRSV | ENC28J60_ECON2_VRPS,
+    ENC28J60_EIE: 0xFF,
+    ENC28J60_ETXSTL: 0xFF, ENC28J60_ETXSTH: 0xFF, ENC28J60_ETXNDL: 0xFF, ENC28J60_ETXNDH: 0xFF,
+    ENC28J60_ERXRDPTL: 0xFF,
+    ENC28J60_EDMASTL: 0xFF, ENC28J60_EDMASTH: 0xFF, ENC28J60_EDMANDL: 0xFF, ENC28J60_EDMANDH: 0xFF,
+    ENC28J60_EDMADSTL: 0xFF, ENC28J60_EDMADSTH: 0xFF,
+    ENC28J60_EPMM0: 0xFF, ENC28J60_EPMM1: 0xFF, ENC28J60_EPMM2: 0xFF, ENC28J60_EPMM3: 0xFF,
+    ENC28J60_EPMM4: 0xFF, ENC28J60_EPMM5: 0xFF, ENC28J60_EPMM6: 0xFF, ENC28J60_EPMM7: 0xFF,
+    ENC28J60_EPMCSL: 0xFF, ENC28J60_EPMCSH: 0xFF, ENC28J60_EPMOL: 0xFF, ENC28J60_EPMOH: 0xFF,
+    ENC28J60_ERXFCON: 0xFF,
+}
+
 def LSB(val):
     return (val & 0xFF)
 
@@ -453,23 +510,101 @@ def MSB(val):
     return ((val >> 8) & 0xFF)
 
 
+class TxStatus:
+    '''
+    Transmit status of the last completed frame
+    '''
+    def __init__(self):
+        self.flags = 0 # ENC28J60_TSV_* bits
+        self.length = 0 # bytes in the frame, padding and CRC included
+        self.wireLength = 0 # bytes put on the wire, collided attempts included
+        self.retries = 0 # retransmissions by the driver
+
+    def decode(self, tsv, retries):
+        self.length, self.flags, self.wireLength = struct.unpack_from("<HHH", tsv)
+        self.retries = retries
+
+    @property
+    def collisions(self):
+        return self.flags & ENC28J60_TSV_COLLISION_COUNT
+
+    @property
+    def deferred(self):
+        return 0 != (self.flags & (ENC28J60_TSV_PACKET_DEFER | ENC28J60_TSV_EXCESSIVE_DEFER))
+
+    @property
+    def aborted(self):
+        return 0 != (self.flags & ENC28J60_TSV_ABORTED) or 0 == (self.flags & ENC28J60_TSV_DONE)
+
+    @property
+    def ok(self):
+        return not self.aborted and 0 == (self.flags & (ENC28J60_TSV_CRC_ERROR | ENC28J60_TSV_LENGTH_CHECK_ERROR | ENC28J60_TSV_TRANSMIT_GIANT))
+
+
 class ENC28J60:
     '''
     This class provides control over ENC28J60 Ethernet chips.
     '''
 
-    def __init__(self, spi, cs, macAddr = None, fullDuplex = True, enableMulticastRx = False):
+    def __init__(self, spi, cs, macAddr = None, fullDuplex = True, enableMulticastRx = False, miiScan = True, txSlots = 2, intPin = None, rxBufferSize = ENC28J60_RX_BUFFER_STOP - ENC28J60_RX_BUFFER_START + 1):
         self.fullDuplex = fullDuplex
         self.enableMulticastRx = enableMulticastRx
+        # SRAM partition: the RX ring starts at address 0, the TX buffer takes the rest of the 8 KB
+        rxBufferSize &= ~1 # ERXND must be odd, ERXRDPT is parked on it when the next packet is at ERXST
+        if rxBufferSize < ENC28J60_ETH_RX_BUFFER_SIZE + ENC28J60_RX_HEADER_SIZE or \
+            ENC28J60_SRAM_SIZE - rxBufferSize < 1 + ENC28J60_ETH_TX_BUFFER_SIZE + ENC28J60_TX_STATUS_VECTOR_SIZE:
+            raise ValueError(f'rxBufferSize={rxBufferSize} leaves no room for a full frame in RX or TX')
+        self.rxStart = ENC28J60_RX_BUFFER_START
+        self.rxStop = ENC28J60_RX_BUFFER_START + rxBufferSize - 1
+        self.txStart = self.rxStop + 1
+        self.txStop = ENC28J60_SRAM_SIZE - 1
+        # Keep the MII interface scanning PHSTAT2 so the link state is a single register read
+        self.miiScan = miiScan
+        self.miiScanning = False
+        # The TX buffer is split in slots, the next frame is written while the previous one is on the wire
+        self.txSlots = max(1, txSlots)
+        self.txSlotSize = (self.txStop - self.txStart + 1) // self.txSlots & ~1
+        self.txSlot = 0
+        self.txInFlight = None # (start, end) of the frame being transmitted
+        self.txAttempts = 0 # retransmissions of the frame in flight
+        self.tsv = bytearray(ENC28J60_TX_STATUS_VECTOR_SIZE)
+        self.txStatus = TxStatus()
+        # In full duplex there are no collisions or deferrals, the TSV is only read when the frame was aborted
+        self.txReadTsv = not fullDuplex
+        self.txRetryLimit = ENC28J60_TX_RETRY_LIMIT
+        # Completed transmissions
+        self.txFrames = 0
+        self.txBytes = 0
+        self.txErrors = 0
+        self.txCollisions = 0
+        self.txDeferrals = 0
+        self.txRetries = 0
+        self.txTimeouts = 0
+        # Received frames with an RSV error, frames dropped before reaching the RX ring
+        self.rxErrors = 0
+        self.rxCrcErrors = 0
+        self.rxLengthErrors = 0
+        self.rxDropEvents = 0 # RSV drop event: at least one frame was dropped before this one
+        self.rxOverflows = 0 # drop events caused by a full RX ring or EPKTCNT at 255 (EIR.RXERIF)
+        self.rxResets = 0
+        self.readPointer = -1
+        self.rxChecksum = -1 # DMA checksum of the last received frame, -1 if not computed
+        self.rxFrameAddr = -1 # SRAM address of the last received frame
+        self.rxFilterInit = 0 # ERXFCON written by init
+        self.hashTable = bytearray(8) # EHT0-7 as last written
         self.revId = None
         self.tmpBytearray1B = bytearray(1)
         self.tmpBytearray2B = bytearray(2)
         self.tmpBytearray3B = bytearray(3)
         self.tmpBytearray6B = bytearray(6)
+        self.tmpChecksum2B = bytearray(2) # WriteSram uses the other scratch buffers
+        self.shadow = {} # last known value of the ENC28J60_SHADOW_MASKS bits, per register
+        self.spiOpsSaved = 0 # SPI commands answered or elided by the shadow cache
 
         # SPI
         self.spi = spi
         self.spi.init()
+        self.baudrate = None # set by CalibrateBaudrate, else the rate the bus was created with
 
         # MAC Address
         if macAddr:
@@ -481,11 +616,30 @@ class ENC28J60:
         self.cs = cs
         self.cs.init(Pin.OUT, value=1)
 
+        # PIN INT, the NIC pulls it low when a packet is pending
+        self.intPin = intPin
+        self.intFlag = False
+        if intPin is not None:
+            self.intPin.init(Pin.IN)
+            self.intPin.irq(handler=self.intHandler, trigger=Pin.IRQ_FALLING)
+
         #self.init()
 
     def getMacAddr(self):
         return self.macAddr
 
+    def GetRxBufferSize(self):
+        return self.rxStop - self.rxStart + 1
+
+    def GetTxBufferSize(self):
+        return self.txStop - self.txStart + 1
+
+    def GetRxCapacity(self, frameLen = ENC28J60_ETH_RX_BUFFER_SIZE - 4):
+        '''Return how many frames of frameLen bytes (without CRC) the RX ring holds before the NIC starts dropping'''
+        # Each frame takes its header, the CRC and a padding byte to the next even address, one byte always stays free
+        frameSize = (ENC28J60_RX_HEADER_SIZE + frameLen + 4 + 1) & ~1
+        return min((self.GetRxBufferSize() - 1) // frameSize, 255) # EPKTCNT saturates at 255
+
     def init(self):
         # Issue a system reset
         self.SoftReset()
@@ -495,79 +649,92 @@ class ENC28J60:
 
         # Initialize driver specific variables
         self.currentBank = 0xFFFF
-        self.nextPacket = ENC28J60_RX_BUFFER_START
+        self.nextPacket = self.rxStart
+        self.miiScanning = False
+        self.txSlot = 0
+        self.txInFlight = None
+        self.readPointer = -1 # ERDPT value left by the last RBM burst, -1 if unknown
 
         # Read silicon revision ID
         self.revId = self.ReadReg(ENC28J60_EREVID) & ENC28J60_EREVID_REV
 
+        # Configure the MAC, the buffers and the filters in one batch, sorted by bank
+        regs = []
+
         # Disable CLKOUT output
-        self.WriteReg(ENC28J60_ECOCON, ENC28J60_ECOCON_COCON_DISABLED)
+        regs.append((ENC28J60_ECOCON, ENC28J60_ECOCON_COCON_DISABLED))
 
         # Set the MAC address of the station
-        self.WriteReg(ENC28J60_MAADR5, self.macAddr[0])
-        self.WriteReg(ENC28J60_MAADR4, self.macAddr[1])
-        self.WriteReg(ENC28J60_MAADR3, self.macAddr[2])
-        self.WriteReg(ENC28J60_MAADR2, self.macAddr[3])
-        self.WriteReg(ENC28J60_MAADR1, self.macAddr[4])
-        self.WriteReg(ENC28J60_MAADR0, self.macAddr[5])
+        regs.append((ENC28J60_MAADR5, self.macAddr[0]))
+        regs.append((ENC28J60_MAADR4, self.macAddr[1]))
+        regs.append((ENC28J60_MAADR3, self.macAddr[2]))
+        regs.append((ENC28J60_MAADR2, self.macAddr[3]))
+        regs.append((ENC28J60_MAADR1, self.macAddr[4]))
+        regs.append((ENC28J60_MAADR0, self.macAddr[5]))
 
         # Set receive buffer location
-        self.WriteReg(ENC28J60_ERXSTL, LSB(ENC28J60_RX_BUFFER_START))
-        self.WriteReg(ENC28J60_ERXSTH, MSB(ENC28J60_RX_BUFFER_START))
-        self.WriteReg(ENC28J60_ERXNDL, LSB(ENC28J60_RX_BUFFER_STOP))
-        self.WriteReg(ENC28J60_ERXNDH, MSB(ENC28J60_RX_BUFFER_STOP))
+        regs.append((ENC28J60_ERXSTL, LSB(self.rxStart)))
+        regs.append((ENC28J60_ERXSTH, MSB(self.rxStart)))
+        regs.append((ENC28J60_ERXNDL, LSB(self.rxStop)))
+        regs.append((ENC28J60_ERXNDH, MSB(self.rxStop)))
 
         # The ERXRDPT register defines a location within the FIFO where the receive hardware is forbidden to write to
-        self.WriteReg(ENC28J60_ERXRDPTL, LSB(ENC28J60_RX_BUFFER_STOP))
-        self.WriteReg(ENC28J60_ERXRDPTH, MSB(ENC28J60_RX_BUFFER_STOP))
+        regs.append((ENC28J60_ERXRDPTL, LSB(self.rxStop)))
+        regs.append((ENC28J60_ERXRDPTH, MSB(self.rxStop)))
 
         # Configure the receive filters
         if self.enableMulticastRx:
-            self.WriteReg(ENC28J60_ERXFCON, ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN | ENC28J60_ERXFCON_MCEN)
+            self.rxFilterInit = ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN | ENC28J60_ERXFCON_MCEN
         else:
-            self.WriteReg(ENC28J60_ERXFCON, ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN)
+            self.rxFilterInit = ENC28J60_ERXFCON_UCEN | ENC28J60_ERXFCON_CRCEN | ENC28J60_ERXFCON_HTEN | ENC28J60_ERXFCON_BCEN
+        regs.append((ENC28J60_ERXFCON, self.rxFilterInit))
 
         # Initialize the hash table
-        self.WriteReg(ENC28J60_EHT0, 0x00)
-        self.WriteReg(ENC28J60_EHT1, 0x00)
-        self.WriteReg(ENC28J60_EHT2, 0x00)
-        self.WriteReg(ENC28J60_EHT3, 0x00)
-        self.WriteReg(ENC28J60_EHT4, 0x00)
-        self.WriteReg(ENC28J60_EHT5, 0x00)
-        self.WriteReg(ENC28J60_EHT6, 0x00)
-        self.WriteReg(ENC28J60_EHT7, 0x00)
+        self.hashTable[:] = bytes(8)
+        regs.append((ENC28J60_EHT0, 0x00))
+        regs.append((ENC28J60_EHT1, 0x00))
+        regs.append((ENC28J60_EHT2, 0x00))
+        regs.append((ENC28J60_EHT3, 0x00))
+        regs.append((ENC28J60_EHT4, 0x00))
+        regs.append((ENC28J60_EHT5, 0x00))
+        regs.append((ENC28J60_EHT6, 0x00))
+        regs.append((ENC28J60_EHT7, 0x00))
 
         # Pull the MAC out of reset
-        self.WriteReg(ENC28J60_MACON2, 0x00)
+        regs.append((ENC28J60_MACON2, 0x00))
 
         # Enable the MAC to receive frames
-        self.WriteReg(ENC28J60_MACON1, ENC28J60_MACON1_TXPAUS | ENC28J60_MACON1_RXPAUS | ENC28J60_MACON1_MARXEN)
+        regs.append((ENC28J60_MACON1, ENC28J60_MACON1_TXPAUS | ENC28J60_MACON1_RXPAUS | ENC28J60_MACON1_MARXEN))
 
         # Enable automatic padding, always append a valid CRC and check frame length. MAC can operate in half-duplex or full-duplex mode
         if self.fullDuplex:
-            self.WriteReg(ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN | ENC28J60_MACON3_FULDPX)
+            regs.append((ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN | ENC28J60_MACON3_FULDPX))
         else:
-            self.WriteReg(ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN)
+            regs.append((ENC28J60_MACON3, ENC28J60_MACON3_PADCFG_AUTO | ENC28J60_MACON3_TXCRCEN | ENC28J60_MACON3_FRMLNEN))
 
         # When the medium is occupied, the MAC will wait indefinitely for it to become free when attempting to transmit
-        self.WriteReg(ENC28J60_MACON4, ENC28J60_MACON4_DEFER)
+        regs.append((ENC28J60_MACON4, ENC28J60_MACON4_DEFER))
 
         # Maximum frame length that can be received or transmitted
-        self.WriteReg(ENC28J60_MAMXFLL, LSB(ENC28J60_ETH_RX_BUFFER_SIZE))
-        self.WriteReg(ENC28J60_MAMXFLH, MSB(ENC28J60_ETH_RX_BUFFER_SIZE))
+        regs.append((ENC28J60_MAMXFLL, LSB(ENC28J60_ETH_RX_BUFFER_SIZE)))
+        regs.append((ENC28J60_MAMXFLH, MSB(ENC28J60_ETH_RX_BUFFER_SIZE)))
 
         # Configure the back-to-back inter-packet gap register
         if self.fullDuplex:
-            self.WriteReg(ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_FD)
+            regs.append((ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_FD))
         else:
-            self.WriteReg(ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_HD)
+            regs.append((ENC28J60_MABBIPG, ENC28J60_MABBIPG_DEFAULT_HD))
 
         # Configure the non-back-to-back inter-packet gap register
-        self.WriteReg(ENC28J60_MAIPGL, ENC28J60_MAIPGL_DEFAULT)
-        self.WriteReg(ENC28J60_MAIPGH, ENC28J60_MAIPGH_DEFAULT)
+        regs.append((ENC28J60_MAIPGL, ENC28J60_MAIPGL_DEFAULT))
+        regs.append((ENC28J60_MAIPGH, ENC28J60_MAIPGH_DEFAULT))
 
         # Collision window register
-        self.WriteReg(ENC28J60_MACLCON2, ENC28J60_MACLCON2_COLWIN_DEFAULT)
+        regs.append((ENC28J60_MACLCON2, ENC28J60_MACLCON2_COLWIN_DEFAULT))
+
+        # One bank switch per bank, starting with the selected one. The sort is stable: the order inside a bank is kept
+        regs.sort(key=lambda reg: ((reg[0] & REG_BANK_MASK) != self.currentBank, reg[0] & REG_BANK_MASK))
+        self.WriteRegs(regs)
 
         # Set the PHY to the proper duplex mode
         if self.fullDuplex:
@@ -581,18 +748,21 @@ class ENC28J60:
         # LEDA displays link status and LEDB displays TX/RX activity
         #self.WritePhyReg(ENC28J60_PHLCON, ENC28J60_PHLCON_LACFG_LINK | ENC28J60_PHLCON_LBCFG_TX_RX | ENC28J60_PHLCON_LFRQ_40_MS | ENC28J60_PHLCON_STRCH)
 
-        # Clear interrupt flags
-        self.WriteReg(ENC28J60_EIR, 0x00)
-
-        # Configure interrupts as desired
-        self.WriteReg(ENC28J60_EIE, ENC28J60_EIE_INTIE | ENC28J60_EIE_PKTIE | ENC28J60_EIE_LINKIE)
-        # | ENC28J60_EIE_TXIE | ENC28J60_EIE_TXERIE)
-
         # Configure PHY interrupts as desired
         self.WritePhyReg(ENC28J60_PHIE, ENC28J60_PHIE_PLNKIE | ENC28J60_PHIE_PGEIE)
 
-        # Set RXEN to enable reception
-        self.WriteReg(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+        self.WriteRegs([
+            # Clear interrupt flags
+            (ENC28J60_EIR, 0x00),
+            # Configure interrupts as desired, with an INT pin only packets drive it: LINKIF would hold INT low until PHIR is read
+            (ENC28J60_EIE, ENC28J60_EIE_INTIE | ENC28J60_EIE_PKTIE | (0 if self.intPin is not None else ENC28J60_EIE_LINKIE)), # | ENC28J60_EIE_TXIE | ENC28J60_EIE_TXERIE)
+            # Set RXEN to enable reception
+            (ENC28J60_ECON1, ENC28J60_ECON1_RXEN),
+        ])
+
+        # Start the continuous link status scan
+        if self.miiScan:
+            self.StartMiiScan()
 
     def writeSpi(self, data):
         self.cs(0)
@@ -602,13 +772,40 @@ class ENC28J60:
     def SoftReset(self):
         self.tmpBytearray1B[0] = ENC28J60_CMD_SRC
         self.writeSpi(self.tmpBytearray1B)
+        # Reset values, the other cached registers are learned on their first write
+        self.shadow.clear()
+        self.shadow[ENC28J60_ECON1] = 0x00
+        self.shadow[ENC28J60_ECON2] = ENC28J60_ECON2_AUTOINC
+        self.shadow[ENC28J60_EIE] = 0x00
+
+    def GetSpiOpsSaved(self):
+        '''Number of SPI commands the shadow register cache made unnecessary'''
+        return self.spiOpsSaved
 
     def ClearBit(self, address, mask):
+        owned = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            shadow = self.shadow.get(address, -1)
+            if 0 <= shadow:
+                # Nothing to do when only cached bits are cleared and they are clear already
+                if 0 == (mask & ~owned) and 0 == (shadow & mask):
+                    self.spiOpsSaved += 1
+                    return
+                self.shadow[address] = shadow & ~mask
         self.tmpBytearray2B[0] = (ENC28J60_CMD_BFC | (address & REG_ADDR_MASK))
         self.tmpBytearray2B[1] = mask
         self.writeSpi(self.tmpBytearray2B)
 
     def SetBit(self, address, mask):
+        owned = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            shadow = self.shadow.get(address, -1)
+            if 0 <= shadow:
+                # Nothing to do when only cached bits are set and they are set already
+                if 0 == (mask & ~owned) and mask == (shadow & mask):
+                    self.spiOpsSaved += 1
+                    return
+                self.shadow[address] = shadow | (mask & owned)
         self.tmpBytearray2B[0] = (ENC28J60_CMD_BFS | (address & REG_ADDR_MASK))
         self.tmpBytearray2B[1] = mask
         self.writeSpi(self.tmpBytearray2B)
@@ -617,8 +814,8 @@ class ENC28J60:
         # uint16_t address
         bank = address & REG_BANK_MASK
 
-        # Rewrite the bank number only if a change is detected
-        if (bank == self.currentBank):
+        # Rewrite the bank number only if a change is detected, EIE to ECON1 are mapped in every bank
+        if (bank == self.currentBank) or (ENC28J60_EIE & REG_ADDR_MASK) <= (address & REG_ADDR_MASK):
             return
 
         # Select the relevant bank
@@ -638,6 +835,14 @@ class ENC28J60:
         return
 
     def WriteReg(self, address, data):
+        owned = ENC28J60_SHADOW_MASKS.get(address, 0)
+        if owned:
+            # A register the driver fully owns already holds data, skip the write and its bank switch
+            if 0xFF == owned and data == self.shadow.get(address, -1):
+                self.spiOpsSaved += 1
+                return
+            self.shadow[address] = data & owned
+
         # Make sure the corresponding bank is selected
         self.SelectBank(address)
 
@@ -647,7 +852,19 @@ class ENC28J60:
         self.writeSpi(self.tmpBytearray2B)
         return
 
+    def WriteRegs(self, regs):
+        '''
+        Write a list of (address, value) pairs in order.
+        SelectBank skips repeated switches, so pairs of the same bank should be next to each other.
+        '''
+        for address, data in regs:
+            self.WriteReg(address, data)
+
     def ReadReg(self, address):
+        if 0xFF == ENC28J60_SHADOW_MASKS.get(address, 0) and address in self.shadow:
+            self.spiOpsSaved += 1
+            return self.shadow[address]
+
         # Make sure the corresponding bank is selected
         self.SelectBank(address)
 
@@ -678,21 +895,58 @@ class ENC28J60:
         # Return register contents
         return data
 
-    def WritePhyReg(self, address, data):
-        # Write register address
-        self.WriteReg(ENC28J60_MIREGADR, address & REG_ADDR_MASK)
+    def WaitMii(self, mask, operation):
+        '''Poll MISTAT until the bits in mask are clear, a missing or unpowered chip reads 0xFF and never clears them'''
+        for _ in range(ENC28J60_MII_POLL_LIMIT):
+            if 0 == (self.ReadReg(ENC28J60_MISTAT) & mask):
+                return
+        raise RuntimeError(f'ENC28J60 MII {operation} timed out, is the chip connected?')
+
+    def StartMiiScan(self):
+        '''Let the MII interface read PHSTAT2 into MIRDL/MIRDH continuously'''
+        self.WriteRegs([
+            (ENC28J60_MIREGADR, ENC28J60_PHSTAT2 & REG_ADDR_MASK),
+            (ENC28J60_MICMD, ENC28J60_MICMD_MIISCAN),
+        ])
+
+        # Wait for the first scan result
+        self.WaitMii(ENC28J60_MISTAT_NVALID, 'scan')
+        self.miiScanning = True
+
+    def StopMiiScan(self):
+        '''Stop the MII scan, it has to be stopped before any other PHY access'''
+        self.WriteReg(ENC28J60_MICMD, 0)
+
+        # Wait for the last scan cycle to complete
+        self.WaitMii(ENC28J60_MISTAT_BUSY, 'scan stop')
+        self.miiScanning = False
 
-        # Write the lower 8 bits
-        self.WriteReg(ENC28J60_MIWRL, LSB(data))
-        # Write the upper 8 bits
-        self.WriteReg(ENC28J60_MIWRH, MSB(data))
+    def WritePhyReg(self, address, data):
+        scanning = self.miiScanning
+        if scanning:
+            self.StopMiiScan()
+
+        self.WriteRegs([
+            # Write register address
+            (ENC28J60_MIREGADR, address & REG_ADDR_MASK),
+            # Write the lower 8 bits
+            (ENC28J60_MIWRL, LSB(data)),
+            # Write the upper 8 bits, this starts the PHY write
+            (ENC28J60_MIWRH, MSB(data)),
+        ])
 
         # Wait until the PHY register has been written
-        while 0 != (self.ReadReg(ENC28J60_MISTAT) & ENC28J60_MISTAT_BUSY):
-            pass
+        self.WaitMii(ENC28J60_MISTAT_BUSY, 'PHY write')
+
+        if scanning:
+            self.StartMiiScan()
         return
 
     def ReadPhyReg(self, address):
+        scanning = self.miiScanning
+        if scanning:
+            self.StopMiiScan()
+
         # Write register address
         self.WriteReg(ENC28J60_MIREGADR, address & REG_ADDR_MASK)
 
@@ -700,8 +954,7 @@ class ENC28J60:
         self.WriteReg(ENC28J60_MICMD, ENC28J60_MICMD_MIIRD)
 
         # Wait for the read operation to complete
-        while 0 != (self.ReadReg(ENC28J60_MISTAT) & ENC28J60_MISTAT_BUSY):
-            pass
+        self.WaitMii(ENC28J60_MISTAT_BUSY, 'PHY read')
 
         # Clear command register
         self.WriteReg(ENC28J60_MICMD, 0)
@@ -711,6 +964,9 @@ class ENC28J60:
         # Read the upper 8 bits
         data |= self.ReadReg(ENC28J60_MIRDH) << 8
 
+        if scanning:
+            self.StartMiiScan()
+
         # Return register contents
         return data
 
@@ -744,12 +1000,273 @@ class ENC28J60:
         # Terminate the operation by raising the CS pin
         self.cs(1)
 
+    def WriteSram(self, address, data):
+        '''Overwrite SRAM at address, without the per-packet control byte'''
+        self.WriteRegs([
+            (ENC28J60_EWRPTL, LSB(address)),
+            (ENC28J60_EWRPTH, MSB(address)),
+        ])
+        self.cs(0)
+        self.tmpBytearray1B[0] = ENC28J60_CMD_WBM
+        self.spi.write(self.tmpBytearray1B)
+        self.spi.write(data)
+        self.cs(1)
+
+    def ReadSram(self, address, data):
+        '''Read SRAM at address into data'''
+        self.WriteRegs([
+            (ENC28J60_ERDPTL, LSB(address)),
+            (ENC28J60_ERDPTH, MSB(address)),
+        ])
+        self.readPointer = -1 # ERDPT no longer points to the next packet
+        self.ReadBuffer(data)
+
+    def ProbeBus(self, seed = 0):
+        '''Write a test pattern (XORed with seed) to the TX buffer and read it back, then read registers whose value is known.
+        False when the SPI clock is too fast for the wiring. The TX buffer content is lost'''
+        self.WaitTxIdle()
+        pattern = bytearray(ENC28J60_PROBE_PATTERN)
+        for idx in range(len(pattern)):
+            pattern[idx] ^= seed & 0xFF
+        readback = bytearray(len(pattern))
+        self.WriteSram(self.txStart, pattern)
+        self.ReadSram(self.txStart, readback)
+        if readback != pattern:
+            return False
+        # ERDPT auto-incremented over the pattern, EREVID and the MAC address (MAC registers send a dummy byte first) are known
+        end = self.txStart + len(pattern)
+        return self.ReadReg(ENC28J60_ERDPTL) == LSB(end) and self.ReadReg(ENC28J60_ERDPTH) == MSB(end) and \
+            (self.ReadReg(ENC28J60_EREVID) & ENC28J60_EREVID_REV) == self.GetRevId() and \
+            self.ReadReg(ENC28J60_MAADR5) == self.macAddr[0] and self.ReadReg(ENC28J60_MAADR0) == self.macAddr[5]
+
+    def SetBaudrate(self, baudrate):
+        self.baudrate = baudrate
+        self.spi.init(baudrate=baudrate)
+
+    def CalibrateBaudrate(self, minBaudrate = ENC28J60_BAUDRATE_MIN, maxBaudrate = ENC28J60_BAUDRATE_MAX, margin = 1, rounds = 4, cacheFile = None, busBaudrate = None):
+        '''Double the SPI clock from minBaudrate while ProbeBus passes rounds times, after a failure go back margin steps
+        below the last good rate. Call it after init. With cacheFile the chosen rate is kept in that file, the next boots
+        only verify it. When minBaudrate itself fails the bus goes back to busBaudrate, the rate init worked at (machine.SPI
+        does not report it, default: the last SetBaudrate), and nothing is cached. Return the baudrate in use.
+        A failed probe may call init again, the receive filters and hash table are then back to their defaults'''
+        if busBaudrate is None:
+            busBaudrate = self.baudrate
+        cached = 0
+        if cacheFile is not None:
+            try:
+                with open(cacheFile) as f:
+                    cached = int(f.read())
+            except (OSError, ValueError):
+                cached = 0
+            if minBaudrate <= cached <= maxBaudrate:
+                self.SetBaudrate(cached)
+                if all(self.ProbeBus(seed) for seed in range(rounds)):
+                    return cached
+
+        self.SetBaudrate(minBaudrate)
+        if not all(self.ProbeBus(seed) for seed in range(rounds)):
+            if busBaudrate is None:
+                raise RuntimeError(f'ENC28J60 SPI fails at {minBaudrate} baud and the bus rate is unknown, pass busBaudrate')
+            self.SetBaudrate(busBaudrate)
+            if not self.ProbeBus():
+                self.init()
+            return busBaudrate
+        good = [minBaudrate]
+        failed = False
+        rate = minBaudrate
+        while rate < maxBaudrate:
+            rate = min(rate * 2, maxBaudrate)
+            self.SetBaudrate(rate)
+            if not all(self.ProbeBus(seed) for seed in range(rounds)):
+                failed = True
+                break
+            good.append(rate)
+        # The last good rate is marginal when the next step failed
+        rate = good[max(0, len(good) - 1 - margin)] if failed else good[-1]
+        self.SetBaudrate(rate)
+        if failed and not self.ProbeBus():
+            # Writes at the failing rate may have hit the wrong registers
+            self.init()
+
+        if cacheFile is not None and rate != cached:
+            with open(cacheFile, 'w') as f:
+                f.write(str(rate))
+        return rate
+
+    def RxAddress(self, address, offset):
+        '''address + offset inside the RX ring, wrapping at ERXND'''
+        address += offset
+        if address > self.rxStop:
+            address -= self.rxStop - self.rxStart + 1
+        return address
+
+    def DmaChecksum(self, begin, end):
+        '''One's complement checksum of SRAM[begin..end] (end included) computed by the DMA, same result as calcChecksum.
+        The DMA wraps at ERXND when the range is in the RX ring'''
+        self.WriteRegs([
+            (ENC28J60_EDMASTL, LSB(begin)),
+            (ENC28J60_EDMASTH, MSB(begin)),
+            (ENC28J60_EDMANDL, LSB(end)),
+            (ENC28J60_EDMANDH, MSB(end)),
+        ])
+        # CSUMEN stays set between checksums, the shadow cache skips setting it again
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_CSUMEN)
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_DMAST)
+
+        # DMAST is cleared by the chip when the checksum is ready
+        while 0 != (self.ReadReg(ENC28J60_ECON1) & ENC28J60_ECON1_DMAST):
+            pass
+        return (self.ReadReg(ENC28J60_EDMACSH) << 8) | self.ReadReg(ENC28J60_EDMACSL)
+
+    def DmaCopy(self, begin, end, dest):
+        '''Copy SRAM[begin..end] (end included) to dest inside the chip, the source wraps at ERXND in the RX ring'''
+        self.WriteRegs([
+            (ENC28J60_EDMASTL, LSB(begin)),
+            (ENC28J60_EDMASTH, MSB(begin)),
+            (ENC28J60_EDMANDL, LSB(end)),
+            (ENC28J60_EDMANDH, MSB(end)),
+            (ENC28J60_EDMADSTL, LSB(dest)),
+            (ENC28J60_EDMADSTH, MSB(dest)),
+        ])
+        # With CSUMEN clear DMAST starts a copy, it is cleared by the chip when it is done
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_CSUMEN)
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_DMAST)
+        while 0 != (self.ReadReg(ENC28J60_ECON1) & ENC28J60_ECON1_DMAST):
+            pass
+
+    def SetRxFilter(self, flags):
+        '''Write ERXFCON, ENC28J60_ERXFCON_* flags'''
+        self.WriteReg(ENC28J60_ERXFCON, flags)
+
+    def SetPatternFilter(self, fields, flags = -1):
+        '''Program the pattern match filter, fields: [(offset, data)] bytes the frame must contain, offsets from the destination MAC.
+        All fields must fit in a 64 byte window. flags (ERXFCON) defaults to the init filters with PMEN instead of BCEN:
+        frames to our MAC still pass, broadcasts only pass if they match the pattern'''
+        first = min(offset for offset, data in fields)
+        last = max(offset + len(data) for offset, data in fields)
+        if 64 < last - first:
+            raise ValueError(f'Pattern fields span {last - first} bytes, the window is 64')
+        # The lowest window covering the fields, a window running past the end of a short frame would fail it
+        window = max(0, last - 64)
+        pattern = bytearray(64)
+        mask = bytearray(8)
+        for offset, data in fields:
+            for idx in range(len(data)):
+                pattern[offset - window + idx] = data[idx]
+                mask[(offset - window + idx) >> 3] |= 1 << ((offset - window + idx) & 0x07)
+
+        # The chip checksums the selected bytes as one stream, the same way as the DMA
+        chksm = 0
+        high = True
+        for idx in range(64):
+            if mask[idx >> 3] & (1 << (idx & 0x07)):
+                chksm += pattern[idx] << 8 if high else pattern[idx]
+                high = not high
+        chksm = (chksm >> 16) + (chksm & 0xFFFF)
+        chksm += chksm >> 16
+        chksm = ~chksm & 0xFFFF
+
+        if 0 > flags:
+            flags = (self.rxFilterInit & ~ENC28J60_ERXFCON_BCEN) | ENC28J60_ERXFCON_PMEN
+        regs = [(ENC28J60_EPMM0 + idx, mask[idx]) for idx in range(8)]
+        regs.append((ENC28J60_EPMCSL, LSB(chksm)))
+        regs.append((ENC28J60_EPMCSH, MSB(chksm)))
+        regs.append((ENC28J60_EPMOL, LSB(window)))
+        regs.append((ENC28J60_EPMOH, MSB(window)))
+        regs.append((ENC28J60_ERXFCON, flags))
+        self.WriteRegs(regs)
+
+    def HashTableBit(self, macAddr):
+        '''Bit of the hash table (0-63, EHT0 bit 0 first) selected by the destination macAddr: bits 28:23 of its CRC'''
+        crc = 0xFFFFFFFF
+        for byte in macAddr:
+            for _ in range(8):
+                # The CRC register shifts MSB first, the address bits come in LSB first
+                feedback = ((crc >> 31) ^ byte) & 0x01
+                crc = (crc << 1) & 0xFFFFFFFF
+                if feedback:
+                    crc ^= 0x04C11DB7
+                byte >>= 1
+        return (crc >> 23) & 0x3F
+
+    def SetHashTable(self, table):
+        '''Write the 8 byte hash table, only the EHT registers that changed are written. Return their number'''
+        regs = []
+        for idx in range(8):
+            if table[idx] != self.hashTable[idx]:
+                regs.append((ENC28J60_EHT0 + idx, table[idx]))
+                self.hashTable[idx] = table[idx]
+        if regs:
+            self.WriteRegs(regs)
+        return len(regs)
+
+    def ClearPatternFilter(self):
+        '''Back to the receive filters set by init'''
+        self.SetRxFilter(self.rxFilterInit)
+
+    def ReleasePacket(self, nextPacket):
+        '''Give the RX ring back to the chip up to nextPacket, frames are released in the order they were received'''
+        # Advance the ERXRDPT pointer, taking care to wrap back at the end of the received memory buffer
+        if self.rxStart == nextPacket:
+            rxReadPointer = self.rxStop
+        else:
+            rxReadPointer = nextPacket - 1
+        self.WriteRegs([
+            (ENC28J60_ERXRDPTL, LSB(rxReadPointer)),
+            (ENC28J60_ERXRDPTH, MSB(rxReadPointer)),
+        ])
+
+    def CheckRxOverflow(self):
+        '''
+        True if frames were dropped because the RX ring was full or EPKTCNT saturated, counted in rxOverflows.
+        ReceivePacket calls it when an RSV reports a drop event, so the check costs nothing while no frame is lost
+        '''
+        if 0 == (self.ReadReg(ENC28J60_EIR) & ENC28J60_EIR_RXERIF):
+            return False
+        self.rxOverflows += 1
+        self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_RXERIF)
+        return True
+
+    def ResetRx(self):
+        '''Reset the receive logic and the RX ring, the frames it holds are lost'''
+        self.rxResets += 1
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_RXRST)
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_RXRST)
+        self.WriteRegs([
+            (ENC28J60_ERXSTL, LSB(self.rxStart)),
+            (ENC28J60_ERXSTH, MSB(self.rxStart)),
+            (ENC28J60_ERXNDL, LSB(self.rxStop)),
+            (ENC28J60_ERXNDH, MSB(self.rxStop)),
+            (ENC28J60_ERXRDPTL, LSB(self.rxStop)),
+            (ENC28J60_ERXRDPTH, MSB(self.rxStop)),
+        ])
+        self.nextPacket = self.rxStart
+        self.readPointer = -1
+        self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_RXERIF)
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_RXEN)
+
+    def GetRxNextPacket(self):
+        '''Address of the packet after the last received one, pass it to ReleasePacket'''
+        return self.nextPacket
+
+    def GetRxFrameAddr(self):
+        '''SRAM address of the first byte of the last received frame'''
+        return self.rxFrameAddr
+
+    def GetRxChecksum(self):
+        '''DMA checksum of the last received frame, -1 if ReceivePacket did not compute it'''
+        return self.rxChecksum
+
     def GetRevId(self):
         if self.revId is None:
             self.revId = self.ReadReg(ENC28J60_EREVID) & ENC28J60_EREVID_REV
         return self.revId
 
     def IsLinkUp(self):
+        if self.miiScanning:
+            # MIRDH holds the upper byte of PHSTAT2, refreshed by the MII scan
+            return 0 != (self.ReadReg(ENC28J60_MIRDH) & MSB(ENC28J60_PHSTAT2_LSTAT))
         return 0 != (self.ReadPhyReg(ENC28J60_PHSTAT2) & ENC28J60_PHSTAT2_LSTAT)
 
     def IsLinkStateChanged(self):
@@ -767,14 +1284,142 @@ class ENC28J60:
         self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_LINKIF)
         return True
 
+    def intHandler(self, pin):
+        self.intFlag = True
+
+    def IsIntPending(self):
+        '''True when INT fell since the last call or is still low, always True without an INT pin. No SPI traffic'''
+        if self.intPin is None:
+            return True
+        if self.intFlag or 0 == self.intPin.value():
+            self.intFlag = False
+            return True
+        return False
+
     def GetRxPacketCnt(self):
         return self.ReadReg(ENC28J60_EPKTCNT)
 
-    def SendPacket(self, chunks):
+    def PollTx(self):
+        '''
+        Non-blocking, True once the frame in flight is completed (or none is), its status is in GetTxStatus().
+        Frames aborted by a late or excessive collision are sent again up to txRetryLimit times
+        '''
+        if self.txInFlight is None:
+            return True
+        status = self.ReadReg(ENC28J60_EIR)
+        if 0 == (status & (ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)):
+            return False
+        txStatus = self.txStatus
+        if 0 != (status & ENC28J60_EIR_TXERIF):
+            # Errata: an aborted transmission can leave TXRTS set
+            self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+            self.ClearBit(ENC28J60_ESTAT, ENC28J60_ESTAT_LATECOL | ENC28J60_ESTAT_TXABRT)
+            self.ReadSram(self.txInFlight[1] + 1, self.tsv)
+            txStatus.decode(self.tsv, self.txAttempts)
+            if 0 != (txStatus.flags & (ENC28J60_TSV_LATE_COLLISION | ENC28J60_TSV_EXCESSIVE_COLLISION)) and self.txAttempts < self.txRetryLimit:
+                # The frame is still in the TX buffer, ETXST and ETXND still point to it
+                self.txAttempts += 1
+                self.txRetries += 1
+                self.StartTx()
+                return False
+            # TXERIF: the frame was aborted, whatever the TSV says when TXRTS was stuck
+            txStatus.flags &= ~ENC28J60_TSV_DONE
+        elif self.txReadTsv:
+            self.ReadSram(self.txInFlight[1] + 1, self.tsv)
+            txStatus.decode(self.tsv, self.txAttempts)
+        else:
+            # Sent without error in full duplex, padded to 60 bytes plus the CRC
+            txStatus.length = max(self.txInFlight[1] - self.txInFlight[0], 60) + 4
+            txStatus.wireLength = txStatus.length
+            txStatus.flags = ENC28J60_TSV_DONE
+            txStatus.retries = self.txAttempts
+        self.txInFlight = None
+
+        if txStatus.ok:
+            self.txFrames += 1
+            self.txBytes += txStatus.length
+        else:
+            self.txErrors += 1
+        self.txCollisions += txStatus.collisions
+        if txStatus.deferred:
+            self.txDeferrals += 1
+        return True
+
+    def WaitTx(self, timeout):
+        '''Wait up to timeout ms for the frame in flight, False if it is still being sent'''
+        start = time.ticks_ms()
+        while not self.PollTx():
+            if time.ticks_diff(time.ticks_ms(), start) >= timeout:
+                self.txTimeouts += 1
+                return False
+        return True
+
+    def WaitTxIdle(self, timeout = ENC28J60_TX_IDLE_TIMEOUT):
+        '''Wait until the frame on the wire has been sent. A frame still in flight after timeout ms (errata: TXRTS
+        can stay set) is sent again up to txRetryLimit times, then aborted. False if it was aborted'''
+        while not self.WaitTx(timeout):
+            if self.txAttempts >= self.txRetryLimit:
+                self.AbortTx()
+                return False
+            # StartTx resets the transmit logic, ETXST and ETXND still point to the frame
+            self.txAttempts += 1
+            self.txRetries += 1
+            self.StartTx()
+        return True
+
+    def AbortTx(self):
+        '''Reset the transmit logic and drop the frame in flight, it is counted as an error'''
+        if self.txInFlight is None:
+            return
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+        self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
+        txStatus = self.txStatus
+        txStatus.length = 0
+        txStatus.wireLength = 0
+        txStatus.flags = 0 # not done: aborted
+        txStatus.retries = self.txAttempts
+        self.txInFlight = None
+        self.txErrors += 1
+
+    def GetTxStatus(self):
+        '''Status of the last completed frame, updated by PollTx'''
+        return self.txStatus
+
+    def StartTx(self):
+        '''Send the frame between ETXST and ETXND'''
+        # It is recommended to reset the transmit logic before attempting to transmit a packet
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
+
+        # Interrupt flags should be cleared after the reset is completed
+        self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
+
+        # Start transmission
+        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+
+    def SendPacket(self, chunks, checksums = None, copyFrom = None, timeout = None):
+        '''checksums: [(csBegin, csEnd, csField, csSeed)] offsets in the frame, the DMA checksums frame[csBegin:csEnd]
+        plus csSeed (an unfolded sum, e.g. the pseudo-header) and the result is written at frame[csField].
+        copyFrom: (address, length) of data kept in the RX ring, the DMA appends it after the chunks.
+        timeout: ms to wait for the frame to be sent, None returns as soon as the transmission is started'''
+        length = self.StartPacket(chunks, checksums, copyFrom)
+        if timeout is None or 0 > length:
+            return length
+        if not self.WaitTx(timeout):
+            return ENC28J60_ETH_TX_ERR_TIMEOUT
+        if not self.txStatus.ok:
+            return ENC28J60_ETH_TX_ERR_ABORTED
+        return length
+
+    def StartPacket(self, chunks, checksums, copyFrom):
         # Retrieve the length of the packet
         length = 0
         for data in chunks:
             length += len(data)
+        if copyFrom is not None:
+            length += copyFrom[1]
 
         # Check the frame length
         if length > ENC28J60_ETH_TX_BUFFER_SIZE:
@@ -784,42 +1429,89 @@ class ENC28J60:
         if False == self.IsLinkUp():
             return ENC28J60_ETH_TX_ERR_LINKDOWN
 
-        # It is recommended to reset the transmit logic before attempting to transmit a packet
-        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
-        self.ClearBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRST)
-
-        # Interrupt flags should be cleared after the reset is completed
-        self.ClearBit(ENC28J60_EIR, ENC28J60_EIR_TXIF | ENC28J60_EIR_TXERIF)
-
-        # Set transmit buffer location
-        self.WriteReg(ENC28J60_ETXSTL, LSB(ENC28J60_TX_BUFFER_START))
-        self.WriteReg(ENC28J60_ETXSTH, MSB(ENC28J60_TX_BUFFER_START))
-
-        # Point to start of transmit buffer
-        self.WriteReg(ENC28J60_EWRPTL, LSB(ENC28J60_TX_BUFFER_START))
-        self.WriteReg(ENC28J60_EWRPTH, MSB(ENC28J60_TX_BUFFER_START))
+        # Pick the next slot, a frame larger than a slot uses the whole TX buffer
+        if length + 1 + ENC28J60_TX_STATUS_VECTOR_SIZE <= self.txSlotSize:
+            start = self.txStart + self.txSlot * self.txSlotSize
+            self.txSlot = (self.txSlot + 1) % self.txSlots
+        else:
+            start = self.txStart
+            self.txSlot = 1 % self.txSlots
+        # The control byte is at start, ETXND points to the last byte of the frame
+        end = start + length
+
+        # Never overwrite the frame that is still on the wire (including its status vector)
+        if self.txInFlight is not None:
+            if start <= self.txInFlight[1] + ENC28J60_TX_STATUS_VECTOR_SIZE and self.txInFlight[0] <= end + ENC28J60_TX_STATUS_VECTOR_SIZE:
+                self.WaitTxIdle()
+
+        # Point to start of the slot
+        self.WriteRegs([
+            (ENC28J60_EWRPTL, LSB(start)),
+            (ENC28J60_EWRPTH, MSB(start)),
+        ])
 
         # Copy the data to the transmit buffer
         self.WriteBuffer(chunks)
-
-        # ETXND should point to the last byte in the data payload
-        self.WriteReg(ENC28J60_ETXNDL, LSB(ENC28J60_TX_BUFFER_START + length))
-        self.WriteReg(ENC28J60_ETXNDH, MSB(ENC28J60_TX_BUFFER_START + length))
-
-        # Start transmission
-        self.SetBit(ENC28J60_ECON1, ENC28J60_ECON1_TXRTS)
+        if copyFrom is not None and 0 < copyFrom[1]:
+            # The tail of the frame is copied from the RX ring inside the chip, it never crosses SPI
+            self.DmaCopy(copyFrom[0], self.RxAddress(copyFrom[0], copyFrom[1] - 1), end - copyFrom[1] + 1)
+
+        # Fill in the checksums over the data already in the TX buffer, the frame starts after the control byte
+        if checksums:
+            for csBegin, csEnd, csField, csSeed in checksums:
+                chksm = (~self.DmaChecksum(start + 1 + csBegin, start + csEnd) & 0xFFFF) + csSeed
+                while chksm >> 16:
+                    chksm = (chksm >> 16) + (chksm & 0xFFFF)
+                # 0x0000 and 0xFFFF are the same in one's complement, a zero UDP checksum would mean "no checksum"
+                chksm = (~chksm & 0xFFFF) or 0xFFFF
+                self.tmpChecksum2B[0] = MSB(chksm)
+                self.tmpChecksum2B[1] = LSB(chksm)
+                self.WriteSram(start + 1 + csField, self.tmpChecksum2B)
+
+        # ETXST and ETXND must not change while the previous frame is being sent
+        self.WaitTxIdle()
+
+        self.WriteRegs([
+            # Set transmit buffer location
+            (ENC28J60_ETXSTL, LSB(start)),
+            (ENC28J60_ETXSTH, MSB(start)),
+            # ETXND should point to the last byte in the data payload
+            (ENC28J60_ETXNDL, LSB(end)),
+            (ENC28J60_ETXNDH, MSB(end)),
+        ])
+
+        self.StartTx()
+        self.txInFlight = (start, end)
+        self.txAttempts = 0
         return length
 
-    def ReceivePacket(self, rxBuffer):
-        if 0 == self.GetRxPacketCnt():
+    def ReceivePacket(self, rxBuffer, pending = False, checksumFrom = 0, checksumMin = 0, keep = False):
+        '''Read the next frame into rxBuffer, pending=True skips the EPKTCNT check when the caller already did it.
+        checksumFrom > 0 lets the DMA checksum frames of at least checksumMin bytes from that offset to the CRC.
+        keep=True leaves the frame in the RX ring (for DMA copies) until ReleasePacket(GetRxNextPacket())'''
+        if not pending and 0 == self.GetRxPacketCnt():
             return 0
+        packetStart = self.nextPacket
+        self.rxChecksum = -1
+        self.rxFrameAddr = self.RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE)
+
+        # Point to the start of the received packet, the previous burst normally left ERDPT there already
+        if self.readPointer != self.nextPacket:
+            self.WriteRegs([
+                (ENC28J60_ERDPTL, LSB(self.nextPacket)),
+                (ENC28J60_ERDPTH, MSB(self.nextPacket)),
+            ])
+
+        # Header and frame are read in one RBM burst, the read pointer auto-increments and wraps inside the RX buffer
+        # Pull the CS pin low
+        self.cs(0)
 
-        # Point to the start of the received packet
-        self.WriteReg(ENC28J60_ERDPTL, LSB(self.nextPacket))
-        self.WriteReg(ENC28J60_ERDPTH, MSB(self.nextPacket))
+        # Write opcode
+        self.tmpBytearray1B[0] = ENC28J60_CMD_RBM
+        self.spi.write(self.tmpBytearray1B)
 
         # The packet is preceded by a 6-byte header
-        self.ReadBuffer(self.tmpBytearray6B)
+        self.spi.readinto(self.tmpBytearray6B)
 
         # Unpack header, little-endian
         headerStruct = struct.unpack("<HHH", self.tmpBytearray6B)
@@ -833,25 +1525,52 @@ class ENC28J60:
         # Get the receive status vector (RSV)
         status = headerStruct[2]
 
+        # Frames start at even addresses inside the ring, any other pointer means the header is garbage
+        if self.nextPacket < self.rxStart or self.nextPacket > self.rxStop or 0 != (self.nextPacket & 0x01):
+            self.cs(1)
+            self.ResetRx()
+            return ENC28J60_ETH_RX_ERR_RESET
+
         # Make sure no error occurred
+        whole = False
         if 0 != (status & ENC28J60_RSV_RECEIVED_OK):
             # Limit the number of data to read
+            whole = length <= ENC28J60_ETH_RX_BUFFER_SIZE and length <= len(rxBuffer)
             length = min(length, ENC28J60_ETH_RX_BUFFER_SIZE)
             length = min(length, len(rxBuffer))
 
             # Read the Ethernet frame
-            self.ReadBuffer(memoryview(rxBuffer)[0:length])
+            self.spi.readinto(memoryview(rxBuffer)[0:length])
+
+            # Frames start at even addresses, also read the padding byte so ERDPT lands on the next packet
+            if whole and 0 != (length & 0x01):
+                self.spi.readinto(self.tmpBytearray1B)
         else:
             # The received packet contains an error
             length = ENC28J60_ETH_RX_ERR_UNSPECIFIED
+            self.rxErrors += 1
+            if 0 != (status & ENC28J60_RSV_CRC_ERROR):
+                self.rxCrcErrors += 1
+            if 0 != (status & ENC28J60_RSV_LENGTH_CHECK_ERROR):
+                self.rxLengthErrors += 1
 
-        # Advance the ERXRDPT pointer, taking care to wrap back at the end of the received memory buffer
-        if ENC28J60_RX_BUFFER_START == self.nextPacket:
-            self.WriteReg(ENC28J60_ERXRDPTL, LSB(ENC28J60_RX_BUFFER_STOP))
-            self.WriteReg(ENC28J60_ERXRDPTH, MSB(ENC28J60_RX_BUFFER_STOP))
-        else:
-            self.WriteReg(ENC28J60_ERXRDPTL, LSB(self.nextPacket - 1))
-            self.WriteReg(ENC28J60_ERXRDPTH, MSB(self.nextPacket - 1))
+        # Terminate the operation by raising the CS pin
+        self.cs(1)
+        self.readPointer = self.nextPacket if whole else -1
+
+        # Frames were dropped between the previous frame and this one
+        if 0 != (status & ENC28J60_RSV_DROP_EVENT):
+            self.rxDropEvents += 1
+            self.CheckRxOverflow()
+
+        # The frame is still in the RX ring until ERXRDPT moves, the DMA can checksum it there
+        if 0 < checksumFrom and whole and length >= checksumMin and checksumFrom < length - 4:
+            self.rxChecksum = self.DmaChecksum(
+                self.RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE + checksumFrom),
+                self.RxAddress(packetStart, ENC28J60_RX_HEADER_SIZE + length - 4 - 1))
+
+        if not keep:
+            self.ReleasePacket(self.nextPacket)
 
         # Decrement the packet counter
         self.SetBit(ENC28J60_ECON2, ENC28J60_ECON2_PKTDEC)
@@ -17,7 +17,10 @@ from machine import Pin
 from machine import SPI
 from micropython import const
 from enc28j60 import enc28j60
-import struct
+from Headers import u16, putU16, addrSum, copyAddr, ETH_DST, ETH_SRC, ETH_TYPE, ETH_VLAN_TYPE, ARP_OPER, ARP_SHA, ARP_SPA, ARP_TPA, \
+    IP4_VER_IHL, IP4_TOTLEN, IP4_IDENT, IP4_FLAGS_FRAG, IP4_PROTO, IP4_CHKSM, IP4_SRC, IP4_DST, IP4_FLAG_MF, IP4_FRAG_MASK, IP4_BCAST_HALF, \
+    UDP_SRC_PORT, UDP_DST_PORT, UDP_LEN, UDP_CHKSM
+import time
 
 
 ETH_TYPE_IP4        = const(0x0800)
@@ -47,30 +50,85 @@ ICMP4_ECHO_REQUEST  = const(8)
 
 UDP_HDR_SIZE        = const(8)
 
+# Shorter data is cheaper to checksum in Python than with the ENC28J60 DMA (about a dozen SPI commands)
+CHECKSUM_OFFLOAD_MIN = const(256)
+# Echo replies with at least this much data are reflected: the data is copied from the RX ring by the ENC28J60 DMA
+# (8 more SPI commands, but no copy, checksum or transfer of the data in Python)
+REFLECT_MIN = const(64)
+# Link monitor: LINKIF is polled this often (ms), a new link state counts once it held this long (ms)
+LINK_POLL_INTERVAL  = const(500)
+LINK_DEBOUNCE       = const(1000)
+# Frames sent while the link is down are held, up to this many, and sent when it returns
+TX_HOLD_MAX         = const(4)
+# txPkt result for a held frame
+TX_HELD             = const(0)
+
 
 class Packet:
-    '''This class stores received packet information'''
+    '''This class stores received packet information.
+    Packets live in the Ntw pool and are reused for every frame: all fields exist from __init__, the MAC
+    fields are views made once and procIp4 copies the IPv4 addresses into buffers of their own. The UDP data is
+    given by udp_dataOffset and udp_dataLen, udp_data makes a new view of it on each call.
+    Decoding up to the handler makes no objects of its own, prints and replies still allocate.
+    procIp4 reads the header fields once the destination is accepted, noise for other hosts leaves them stale.
+    __slots__ only holds on the host: MicroPython does not implement it, every Packet has an attribute dict'''
+    __slots__ = ('ntw', 'frame', 'frame_len', 'held', 'nic_addr', 'nic_next',
+        'eth_type', 'eth_offset', 'eth_dst', 'eth_src',
+        'ip_proto', 'ip_ver', 'ip_hdrlen', 'ip_totlen', 'ip_offset', 'ip_maxoffset', 'ip_src_addr', 'ip_dst_addr',
+        'udp_srcPort', 'udp_dstPort', 'udp_chksm', 'udp_dataLen', 'udp_dataOffset')
     def __init__(self, ntw, frame, frame_len):
         self.ntw = ntw
         self.frame = memoryview(frame)
         self.frame_len = frame_len
+        self.held = False
+        self.nic_addr = -1 # address of the frame in the NIC RX ring while it is kept there, else -1
+        self.nic_next = -1 # ERXRDPT release point of the frame while its ring space is not given back, else -1
+        self.eth_type = 0
+        self.eth_offset = ETH_HDR_SIZE
+        self.eth_dst = self.frame[ETH_DST:ETH_SRC] # the MACs are at fixed offsets of the frame buffer
+        self.eth_src = self.frame[ETH_SRC:ETH_TYPE]
+        self.ip_proto = 0
+        self.ip_ver = 0
+        self.ip_hdrlen = 0
+        self.ip_totlen = 0
+        self.ip_offset = 0
+        self.ip_maxoffset = 0
+        self.ip_src_addr = bytearray(4) # copied from the frame, the IPv4 offset depends on the VLAN tag
+        self.ip_dst_addr = bytearray(4)
+        self.udp_srcPort = 0
+        self.udp_dstPort = 0
+        self.udp_chksm = 0
+        self.udp_dataLen = 0
+        self.udp_dataOffset = 0
+
+    @property
+    def udp_data(self):
+        return self.frame[self.udp_dataOffset:self.udp_dataOffset+self.udp_dataLen]
 
 
 def procArp(pkt):
-    hrtype, prtype, hrlen, prlen, oper, sha, spa, tha, tpa = struct.unpack_from("!HHBBH6s4s6s4s", pkt.frame, pkt.eth_offset)
+    frame = pkt.frame
+    offset = pkt.eth_offset
+    oper = u16(frame, offset + ARP_OPER)
 
     print(f'Rx ARP oper={oper}')
 
     if ARP_OP_REQUEST == oper:
-        if tpa == pkt.ntw.myIp4Addr:
-            print(f'Rx ARP_REQUEST for my IP from IP {spa[0]}.{spa[1]}.{spa[2]}.{spa[3]}!')
-            reply = makeArpReply(pkt.eth_src, pkt.ntw.myMacAddr, pkt.ntw.myIp4Addr, spa)
+        if u16(frame, offset + ARP_TPA + 2) == pkt.ntw.myIp4Lo and u16(frame, offset + ARP_TPA) == pkt.ntw.myIp4Hi:
+            spa = offset + ARP_SPA
+            print(f'Rx ARP_REQUEST for my IP from IP {frame[spa]}.{frame[spa+1]}.{frame[spa+2]}.{frame[spa+3]}!')
+            # txPkt copies the SPA view before the pool buffer is reused
+            reply = makeArpReply(pkt.eth_src, pkt.ntw.myMacAddr, pkt.ntw.myIp4Addr, frame[spa:spa+4])
             n = pkt.ntw.txPkt(reply)
             if 0 > n:
                 print(f'Fail to send ARP REPLY {n}')
     elif ARP_OP_REPLY == oper:
-        print(f'ARP {spa[0]}.{spa[1]}.{spa[2]}.{spa[3]} is at {sha[0]:02X}:{sha[1]:02X}:{sha[2]:02X}:{sha[3]:02X}:{sha[4]:02X}:{sha[5]:02X}')
-        pkt.ntw.addArpEntry(spa, sha)
+        spa = offset + ARP_SPA
+        sha = offset + ARP_SHA
+        print(f'ARP {frame[spa]}.{frame[spa+1]}.{frame[spa+2]}.{frame[spa+3]} is at {frame[sha]:02X}:{frame[sha+1]:02X}:{frame[sha+2]:02X}:{frame[sha+3]:02X}:{frame[sha+4]:02X}:{frame[sha+5]:02X}')
+        # A repeated reply leaves the entry alone, a new one is copied by addArpEntry
+        if not pkt.ntw.hasArpEntry(frame, spa, sha):
+            pkt.ntw.addArpEntry(frame[spa:spa+4], frame[sha:sha+6])
 
 
 def makeArpReply(eth_dst, eth_src, ip_src, ip_dst):
@@ -97,12 +155,47 @@ def makeArpRequest(eth_src, ip_src, ip_dst):
     return rsp
 
 
-def calcChecksum(data, startValue = 0):
+def makeIp4McastMac(group):
+    '''Ethernet address of an IPv4 multicast group: 01:00:5E and the low 23 bits of the group'''
+    return bytes([0x01, 0x00, 0x5E, group[1] & 0x7F, group[2], group[3]])
+
+
+def makeArpRequestPattern(ip_dst):
+    '''Pattern match fields (see ENC28J60.SetPatternFilter) of an ARP request for ip_dst'''
+    return [
+        (12, bytes([ETH_TYPE_ARP >> 8, ETH_TYPE_ARP & 0xFF])),
+        (20, bytes([0, ARP_OP_REQUEST])),
+        (38, bytes(ip_dst)),
+    ]
+
+
+def makeUdp4PortPattern(port):
+    '''Pattern match fields of an IPv4 (no options) UDP datagram to port'''
+    return [
+        (12, ETH_TYPE_IP4_BYTES),
+        (14, bytes([0x45])),
+        (23, bytes([IP4_TYPE_UDP])),
+        (36, bytes([(port >> 8) & 0xFF, port & 0xFF])),
+    ]
+
+
+def calcChecksum(data, startValue = 0, start = 0, end = -1):
+    '''Checksum of data[start:end] without slicing it, end=-1 is the end of data'''
+    if 0 > end:
+        end = len(data)
     chksm = startValue
-    for idx in range(0, len(data)-1, 2):
+    for idx in range(start, end-1, 2):
         chksm += (data[idx] << 8) | data[idx+1]
-    if len(data) & 0x1:
-        chksm += data[-1] << 8
+    if (end - start) & 0x1:
+        chksm += data[end-1] << 8
+    chksm = (chksm >> 16) + (chksm & 0xffff)
+    chksm += (chksm >> 16)
+    return ~chksm & 0xffff
+
+
+def adjustChecksum(chksm, oldWord, newWord):
+    '''Update a checksum for one 16 bit word changed from oldWord to newWord (RFC 1624 eqn. 3)'''
+    chksm = (~chksm & 0xffff) + (~oldWord & 0xffff) + newWord
     chksm = (chksm >> 16) + (chksm & 0xffff)
     chksm += (chksm >> 16)
     return ~chksm & 0xffff
@@ -115,8 +208,8 @@ def makeIp4Hdr(src, tgt, ident, prot, dataLen, flags=0, fragOffset=0, ttl=128, d
     hdr[1] = (dscp << 2) | (ecn & 0x03)
     hdr[2] = totlen >> 8
     hdr[3] = totlen
-    hdr[4] = ident >> 8
-    hdr[5] = ident
+    hdr[4] = (ident >> 8) & 0xFF
+    hdr[5] = ident & 0xFF
     hdr[6] = flags | ((fragOffset >> 8) & 0x1F)
     hdr[7] = fragOffset & 0xFF
     hdr[8] = ttl
@@ -136,15 +229,24 @@ def sendIcmp4EchoReply(pkt):
     offset = pkt.ip_offset
     rsp = []
 
+    if 0 <= pkt.nic_addr and pkt.ip_maxoffset - offset - 4 >= pkt.ntw.reflectMin:
+        return reflectIcmp4EchoReply(pkt)
+
     # ICMP
     icmpRepl = bytearray(pkt.frame[offset:pkt.ip_maxoffset])
     icmpRepl[0] = ICMP4_ECHO_REPLY
     icmpRepl[1] = 0x00
     icmpRepl[2] = 0x00
     icmpRepl[3] = 0x00
-    chksm = calcChecksum(icmpRepl)
-    icmpRepl[2] = (chksm >> 8) & 0xFF
-    icmpRepl[3] = chksm & 0xFF
+    checksums = None
+    if len(icmpRepl) >= pkt.ntw.checksumOffloadMin:
+        # The NIC checksums the reply in its TX buffer
+        icmpOffset = ETH_HDR_SIZE + IP4_HDR_NOOPT_SIZE
+        checksums = [(icmpOffset, icmpOffset + len(icmpRepl), icmpOffset + 2, 0)]
+    else:
+        chksm = calcChecksum(icmpRepl)
+        icmpRepl[2] = (chksm >> 8) & 0xFF
+        icmpRepl[3] = chksm & 0xFF
 
     # IP
     ipHdr = makeIp4Hdr(pkt.ntw.myIp4Addr, pkt.ip_src_addr, pkt.ntw.ip4TxCount, IP4_TYPE_ICMP, len(icmpRepl))
@@ -158,11 +260,30 @@ def sendIcmp4EchoReply(pkt):
     rsp.append(ipHdr)
     rsp.append(icmpRepl)
 
-    n = pkt.ntw.txPkt(rsp)
+    n = pkt.ntw.txPkt(rsp, checksums)
     return n
 
 
-def procIcmp4(pkt):
+def reflectIcmp4EchoReply(pkt):
+    '''Only the headers are sent over SPI, identifier, sequence and data are copied from the NIC RX ring'''
+    offset = pkt.ip_offset
+    # The request checksum is updated for the type/code word: ECHO_REQUEST, code -> ECHO_REPLY, 0
+    chksm = adjustChecksum((pkt.frame[offset+2] << 8) | pkt.frame[offset+3],
+        (pkt.frame[offset] << 8) | pkt.frame[offset+1], ICMP4_ECHO_REPLY << 8)
+    icmpHdr = bytearray([ICMP4_ECHO_REPLY, 0x00, (chksm >> 8) & 0xFF, chksm & 0xFF])
+    dataLen = pkt.ip_maxoffset - offset - 4
+
+    # IP
+    ipHdr = makeIp4Hdr(pkt.ntw.myIp4Addr, pkt.ip_src_addr, pkt.ntw.ip4TxCount, IP4_TYPE_ICMP, 4 + dataLen)
+    pkt.ntw.ip4TxCount += 1
+
+    rsp = [pkt.eth_src, pkt.ntw.myMacAddr, ETH_TYPE_IP4_BYTES, ipHdr, icmpHdr]
+    return pkt.ntw.txPkt(rsp, copyFrom=(pkt.ntw.nic.RxAddress(pkt.nic_addr, offset + 4), dataLen))
+
+
+def procIcmp4(pkt, bcast=False):
+    if bcast:
+        return
     offset = pkt.ip_offset
     if ICMP4_ECHO_REQUEST == pkt.frame[offset]:
         sendIcmp4EchoReply(pkt)
@@ -171,14 +292,37 @@ def procIcmp4(pkt):
 
 
 def procIp4(pkt):
-    ip_ver_len, _, pkt.ip_totlen, _, ip_flags_fragoffset, ip_ttl, pkt.ip_proto, ip_hdr_chksum, pkt.ip_src_addr, pkt.ip_dst_addr = struct.unpack_from("!BBHHHBBH4s4s", pkt.frame, pkt.eth_offset)
+    frame = pkt.frame
+    offset = pkt.eth_offset
+    pkt.ip_proto = frame[offset+IP4_PROTO]
+    handler = pkt.ntw.ip4Handlers.get(pkt.ip_proto)
+    if handler is None:
+        return
+
+    pkt.ntw.ip4RxCount += 1
 
+    # The destination is compared as two 16 bit words before anything else is read, noise for other hosts costs 5 bytes
+    dstHi = u16(frame, offset+IP4_DST)
+    dstLo = u16(frame, offset+IP4_DST+2)
+    if pkt.ntw.myIp4Lo == dstLo and pkt.ntw.myIp4Hi == dstHi:
+        mine = True
+    elif IP4_BCAST_HALF == dstLo and IP4_BCAST_HALF == dstHi:
+        mine = False
+    elif 0xE == (dstHi >> 12) and pkt.ntw.isMcastGroup(dstHi, dstLo):
+        # Exact match, the NIC hash table also lets in the groups sharing a hash bit with a joined one
+        mine = False
+    else:
+        return
+
+    # Accepted: the header fields are read once, handlers use plain attributes
+    ip_ver_len = frame[offset+IP4_VER_IHL]
+    pkt.ip_totlen = u16(frame, offset+IP4_TOTLEN)
     pkt.ip_ver = (ip_ver_len >> 4) & 0xF
     pkt.ip_hdrlen = (ip_ver_len & 0xF) << 2
-    pkt.ip_offset = pkt.eth_offset + pkt.ip_hdrlen
-    pkt.ip_maxoffset = pkt.eth_offset + pkt.ip_totlen
-
-    pkt.ntw.ip4RxCount += 1
+    pkt.ip_offset = offset + pkt.ip_hdrlen
+    pkt.ip_maxoffset = offset + pkt.ip_totlen
+    copyAddr(pkt.ip_src_addr, frame, offset+IP4_SRC)
+    copyAddr(pkt.ip_dst_addr, frame, offset+IP4_DST)
 
     if 4 != pkt.ip_ver:
         print(f'ip_ver={pkt.ip_ver} not supported!')
@@ -193,23 +337,16 @@ def procIp4(pkt):
         #print(f'IPv4 chksm={chksm} invalid!')
         #return
 
-    flags_mf = (ip_flags_fragoffset >> 13) & 0x01
-    fragOffset = (ip_flags_fragoffset & 0x1FFF) << 3
+    ip_flags_fragoffset = u16(frame, offset+IP4_FLAGS_FRAG)
+    flags_mf = 1 if ip_flags_fragoffset & IP4_FLAG_MF else 0
+    fragOffset = (ip_flags_fragoffset & IP4_FRAG_MASK) << 3
     if (0 != flags_mf) or (0 != fragOffset):
         print(f'Fragmented IPv4 not supported: fragOffset={fragOffset}, flags_mf={flags_mf}')
         return
 
-    if pkt.ip_dst_addr == pkt.ntw.myIp4Addr:
+    if mine:
         print(f'Rx my IP proto={pkt.ip_proto}')
-        if IP4_TYPE_ICMP == pkt.ip_proto:
-            procIcmp4(pkt)
-        elif IP4_TYPE_TCP == pkt.ip_proto:
-            pass
-        elif IP4_TYPE_UDP == pkt.ip_proto:
-            procUdp4(pkt, bcast=False)
-    elif pkt.ip_dst_addr == IP4_ADDR_BCAST:
-        if IP4_TYPE_UDP == pkt.ip_proto:
-            procUdp4(pkt, bcast=True)
+    handler(pkt, not mine)
 
 
 def printEthPkt(pkt):
@@ -223,29 +360,31 @@ def printEthPkt(pkt):
 def procEth(pkt):
     #printEthPkt(pkt)
 
-    pkt.eth_dst = pkt.frame[0:6]
-    pkt.eth_src = pkt.frame[6:12]
-    pkt.eth_type, = struct.unpack_from("!H", pkt.frame, 12)
+    frame = pkt.frame
+    pkt.eth_type = u16(frame, ETH_TYPE)
     pkt.eth_offset = ETH_HDR_SIZE
 
     if ETH_TYPE_8021Q == pkt.eth_type:
-        pkt.eth_type, = struct.unpack_from("!H", pkt.frame, 14)
+        pkt.eth_type = u16(frame, ETH_VLAN_TYPE)
         pkt.eth_offset += 2
 
-    if ETH_TYPE_IP4 == pkt.eth_type:
-        procIp4(pkt)
-    elif ETH_TYPE_ARP == pkt.eth_type:
-        procArp(pkt)
     # ignore not supported types
+    handler = pkt.ntw.ethHandlers.get(pkt.eth_type)
+    if handler is None:
+        return
+    handler(pkt)
 
 
-def makeUdp4Hdr(srcIp, srcPort, dstIp, dstPort, data):
+def makeUdp4Hdr(srcIp, srcPort, dstIp, dstPort, data, calcChksm=True):
+    '''calcChksm=False leaves the checksum at 0 for the NIC DMA to fill in'''
     udpLen = len(data) + UDP_HDR_SIZE
 
-    chksm = sum(struct.unpack('!HH', srcIp))
-    chksm += sum(struct.unpack('!HH', dstIp))
-    chksm += IP4_TYPE_UDP + 2*udpLen + srcPort + dstPort
-    chksm = calcChecksum(data, chksm)
+    chksm = 0
+    if calcChksm:
+        chksm = addrSum(srcIp)
+        chksm += addrSum(dstIp)
+        chksm += IP4_TYPE_UDP + 2*udpLen + srcPort + dstPort
+        chksm = calcChecksum(data, chksm)
 
     udpHdr = bytearray(UDP_HDR_SIZE)
     udpHdr[0] = srcPort >> 8
@@ -260,10 +399,18 @@ def makeUdp4Hdr(srcIp, srcPort, dstIp, dstPort, data):
 
 
 def procUdp4(pkt, bcast=False):
+    frame = pkt.frame
     offset = pkt.ip_offset
-    pkt.udp_srcPort, pkt.udp_dstPort, udpLen, chksm_rx = struct.unpack_from('!HHHH', pkt.frame, offset)
+    pkt.udp_srcPort = u16(frame, offset+UDP_SRC_PORT)
+    pkt.udp_dstPort = u16(frame, offset+UDP_DST_PORT)
+    udpLen = u16(frame, offset+UDP_LEN)
+    chksm_rx = u16(frame, offset+UDP_CHKSM)
+    pkt.udp_chksm = chksm_rx
+    if UDP_HDR_SIZE > udpLen or offset + udpLen > pkt.frame_len:
+        print(f'Invalid UDP length {udpLen}')
+        return
     pkt.udp_dataLen = udpLen - UDP_HDR_SIZE
-    pkt.udp_data = memoryview(pkt.frame[offset+UDP_HDR_SIZE:offset+udpLen])
+    pkt.udp_dataOffset = offset + UDP_HDR_SIZE
 
     # find UDP client
     cb = None
@@ -277,34 +424,68 @@ def procUdp4(pkt, bcast=False):
 
     # verify checksum
     if (0 != chksm_rx):
-        chksm = sum(struct.unpack('!HH', pkt.ip_src_addr))
-        chksm += sum(struct.unpack('!HH', pkt.ip_dst_addr))
-        chksm += IP4_TYPE_UDP + 2*udpLen + pkt.udp_srcPort + pkt.udp_dstPort
-        chksm = calcChecksum(pkt.udp_data, chksm)
+        chksm = addrSum(frame, pkt.eth_offset+IP4_SRC)
+        chksm += addrSum(frame, pkt.eth_offset+IP4_DST)
+        if 0 <= pkt.nic_addr and udpLen >= pkt.ntw.checksumOffloadMin:
+            # The datagram is still in the NIC RX ring: the DMA sums it, the received checksum is taken out again
+            nic = pkt.ntw.nic
+            dmaChksm = nic.DmaChecksum(nic.RxAddress(pkt.nic_addr, offset), nic.RxAddress(pkt.nic_addr, offset + udpLen - 1))
+            chksm += IP4_TYPE_UDP + udpLen + (~dmaChksm & 0xFFFF) + (~chksm_rx & 0xFFFF)
+            chksm = calcChecksum(b'', chksm)
+        else:
+            chksm += IP4_TYPE_UDP + 2*udpLen + pkt.udp_srcPort + pkt.udp_dstPort
+            chksm = calcChecksum(frame, chksm, pkt.udp_dataOffset, offset+udpLen)
         if 0 == chksm:
             chksm = 0xFFFF
         if (chksm != chksm_rx):
             print(f'Invalid UDP chksm: rx={chksm_rx:04X} calc=0x{chksm:04X}')
             return
+    if pkt.udp_dstPort not in pkt.ntw.udp4Reflect:
+        # The handler does not read the ring, a slow one would hold it
+        pkt.ntw.rxReleaseNic(pkt)
 
     # call UDP client
     cb(pkt)
 
 
 class Ntw:
-    def __init__(self, nicSpi, nicCsPin):
-        self.rxBuff = bytearray(enc28j60.ENC28J60_ETH_RX_BUFFER_SIZE)
-        self.nic = enc28j60.ENC28J60(nicSpi, nicCsPin)
+    def __init__(self, nicSpi, nicCsPin, rxPoolSize=4, nicIntPin=None,
+                 nicRxBufferSize=enc28j60.ENC28J60_RX_BUFFER_STOP - enc28j60.ENC28J60_RX_BUFFER_START + 1):
+        # RX frame pool: frames are drained from the NIC into free buffers, then processed
+        self.rxPool = [Packet(self, bytearray(enc28j60.ENC28J60_ETH_RX_BUFFER_SIZE), 0) for _ in range(rxPoolSize)]
+        self.rxFree = list(self.rxPool) # free list, used as a stack
+        self.rxFreeCnt = rxPoolSize
+        self.rxReady = [None] * rxPoolSize # received frames waiting for processing, ring
+        self.rxReadyHead = 0
+        self.rxReadyCnt = 0
+        # Queued frames kept in the NIC RX ring for their handler, see rxKeepInNic
+        self.rxNicKept = 0
+        # Checksums over at least this many bytes are computed by the NIC DMA
+        self.checksumOffloadMin = CHECKSUM_OFFLOAD_MIN
+        self.reflectMin = REFLECT_MIN
+        self.nic = enc28j60.ENC28J60(nicSpi, nicCsPin, intPin=nicIntPin, rxBufferSize=nicRxBufferSize)
+        # A drop is reported in the RSV of the next received frame only: EIR.RXERIF is also checked from the drain when
+        # EPKTCNT reaches 3/4 of what the ring holds in minimum size frames, and when the NIC is found empty after frames
+        rxCapacity = self.nic.GetRxCapacity(60)
+        self.rxNicHigh = rxCapacity - rxCapacity // 4
+        self.rxNicPending = False
 
         # Eth settings
         self.myMacAddr = self.nic.getMacAddr()
 
         # IPv4 settings
         self.myIp4Addr = bytearray(4)
+        # myIp4Addr as two 16 bit words, compared with received addresses: small ints, a 32 bit one would be a long
+        self.myIp4Hi = -1
+        self.myIp4Lo = -1
         self.netIp4Mask = bytearray(4)
         self.gwIp4Addr = bytearray(4)
         self.configIp4Done = False
 
+        # Hardware RX filter: the UDP port of the broadcast pattern, None for ARP requests for my IP
+        self.rxFilterUdpPort = None
+        self.rxFilterOn = False
+
         # Stats
         self.ip4TxCount = 0
         self.ip4RxCount = 0
@@ -312,35 +493,189 @@ class Ntw:
         self.arpTable = {}
         self.udp4UniBind = {}   # {port:callback(Pkt)}
         self.udp4BcastBind = {} # {port:callback(Pkt)}
+        self.udp4Reflect = set() # ports whose datagrams stay in the NIC RX ring until processed
+        # Protocol handlers, frames and datagrams of other types are dropped before their headers are decoded
+        self.ethHandlers = {ETH_TYPE_IP4: procIp4, ETH_TYPE_ARP: procArp} # {EtherType:handler(Pkt)}
+        self.ip4Handlers = {IP4_TYPE_ICMP: procIcmp4, IP4_TYPE_UDP: procUdp4} # {proto:handler(Pkt, bcast)}
+        # Multicast: {group IP: joins}, groups per NIC hash table bit and the table as written to the NIC
+        self.mcastGroups = {}
+        self.mcastWords = [] # (high, low) 16 bit words of each joined group, procIp4 matches without a bytes object
+        self.mcastHashRef = [0] * 64 # a bytearray would overflow at 256 groups on one bit
+        self.mcastHashTable = bytearray(8)
+
+        # Link monitor: debounced state, raw state and when it last changed, callbacks cb(up)
+        self.linkUp = False
+        self.linkRaw = False
+        self.linkRawSince = 0
+        self.linkPollNext = 0
+        self.linkPollInterval = LINK_POLL_INTERVAL
+        self.linkDebounce = LINK_DEBOUNCE
+        self.linkCallbacks = []
+        self.linkFlaps = 0
+        # Frames held while the link is down: (frame, checksums)
+        self.txHold = []
+        self.txHoldMax = TX_HOLD_MAX
+        self.txHoldDropped = 0
 
         self.nic.init()
 
         print("MAC ADDR:", ":".join("{:02x}".format(c) for c in self.myMacAddr))
         print("ENC28J60 revision ID: 0x{:02x}".format(self.nic.GetRevId()))
+        self.nic.IsLinkStateChanged()
+        self.linkUp = self.linkRaw = self.nic.IsLinkUp()
+        self.linkPollNext = time.ticks_ms()
 
     def setIPv4(self, myIp4Addr, netIp4Mask, gwIp4Addr):
         self.myIp4Addr = bytearray(myIp4Addr)
+        self.myIp4Hi = u16(self.myIp4Addr, 0)
+        self.myIp4Lo = u16(self.myIp4Addr, 2)
         self.netIp4Mask = bytearray(netIp4Mask)
         self.gwIp4Addr = bytearray(gwIp4Addr)
         self.configIp4Done = True
+        if self.rxFilterOn and self.rxFilterUdpPort is None:
+            # The ARP pattern contains my IP
+            self.setRxFilter()
+
+    def setRxFilter(self, bcastUdpPort=None):
+        '''Let the NIC drop broadcast chatter before it costs an SPI read. Frames to my MAC (and multicast if enabled)
+        still pass, a broadcast passes if it is an ARP request for my IP, or with bcastUdpPort an IPv4 UDP datagram to that port.
+        The ENC28J60 has a single pattern: with bcastUdpPort ARP requests are dropped, peers need a static ARP entry'''
+        self.rxFilterOn = True
+        self.rxFilterUdpPort = bcastUdpPort
+        if bcastUdpPort is not None:
+            self.nic.SetPatternFilter(makeUdp4PortPattern(bcastUdpPort))
+        elif self.configIp4Done:
+            self.nic.SetPatternFilter(makeArpRequestPattern(self.myIp4Addr))
+
+    def clearRxFilter(self):
+        self.rxFilterOn = False
+        self.rxFilterUdpPort = None
+        self.nic.ClearPatternFilter()
+
+    def restoreNicFilters(self):
+        '''Write the RX filter and the multicast hash table again after init reset them'''
+        if self.rxFilterOn:
+            self.setRxFilter(self.rxFilterUdpPort)
+        self.nic.SetHashTable(self.mcastHashTable)
 
     def isIPv4Configured(self):
         return self.configIp4Done
 
+    def rxDrainNic(self):
+        '''Function to move pending packets from NIC into free pool buffers'''
+        queued = 0
+        rxPacketCnt = self.nic.GetRxPacketCnt()
+        if self.rxNicHigh <= rxPacketCnt or (0 == rxPacketCnt and self.rxNicPending):
+            self.nic.CheckRxOverflow()
+        self.rxNicPending = 0 < rxPacketCnt
+        # Packets that don't fit in the pool stay in the NIC RX buffer until the next call
+        while 0 < rxPacketCnt and 0 < self.rxFreeCnt:
+            rxPacketCnt -= 1
+            pkt = self.rxFree[self.rxFreeCnt - 1]
+            # The ring space is given back here, or once processed for the frames a handler reads from the ring
+            rxLen = self.nic.ReceivePacket(pkt.frame, pending=True, keep=True)
+            if enc28j60.ENC28J60_ETH_RX_ERR_RESET == rxLen:
+                # The NIC reset its RX ring, queued frames are only left in their pool buffers
+                for i in range(self.rxReadyCnt):
+                    queuedPkt = self.rxReady[(self.rxReadyHead + i) % len(self.rxReady)]
+                    queuedPkt.nic_addr = -1
+                    queuedPkt.nic_next = -1
+                self.rxNicKept = 0
+                break
+            if 0 >= rxLen:
+                print(f'Rx ERROR {rxLen}')
+                if 0 < self.rxNicKept:
+                    # Released together with the last queued frame, releasing it now would free the kept ones too
+                    self.rxReady[(self.rxReadyHead + self.rxReadyCnt - 1) % len(self.rxReady)].nic_next = self.nic.GetRxNextPacket()
+                else:
+                    self.nic.ReleasePacket(self.nic.GetRxNextPacket())
+                continue
+            self.rxFreeCnt -= 1
+            pkt.frame_len = rxLen
+            pkt.nic_next = self.nic.GetRxNextPacket()
+            if self.rxKeepInNic(pkt.frame, rxLen):
+                pkt.nic_addr = self.nic.GetRxFrameAddr()
+                self.rxNicKept += 1
+            else:
+                pkt.nic_addr = -1
+                if 0 == self.rxNicKept:
+                    self.nic.ReleasePacket(pkt.nic_next)
+                    pkt.nic_next = -1
+            self.rxReady[(self.rxReadyHead + self.rxReadyCnt) % len(self.rxReady)] = pkt
+            self.rxReadyCnt += 1
+            queued += 1
+        return queued
+
+    def rxKeepInNic(self, frame, frameLen):
+        '''True for a frame its handler reads from the NIC RX ring: an ICMP echo request to my IP that is reflected, a UDP
+        datagram to a port registered with reflect=True, or one to my IP whose checksum procUdp4 leaves to the DMA.
+        Other frames give their ring space back when they are drained'''
+        if 0 != (frame[ETH_DST] & 0x01) or ETH_TYPE_IP4 != u16(frame, ETH_TYPE):
+            return False
+        if self.myIp4Lo != u16(frame, ETH_HDR_SIZE + IP4_DST + 2) or self.myIp4Hi != u16(frame, ETH_HDR_SIZE + IP4_DST):
+            return False
+        offset = ETH_HDR_SIZE + ((frame[ETH_HDR_SIZE + IP4_VER_IHL] & 0x0F) << 2)
+        dataLen = ETH_HDR_SIZE + u16(frame, ETH_HDR_SIZE + IP4_TOTLEN) - offset
+        proto = frame[ETH_HDR_SIZE + IP4_PROTO]
+        if IP4_TYPE_ICMP == proto:
+            return ICMP4_ECHO_REQUEST == frame[offset] and dataLen - 4 >= self.reflectMin
+        if IP4_TYPE_UDP == proto:
+            if dataLen >= self.checksumOffloadMin and 0 != u16(frame, offset + UDP_CHKSM):
+                return True
+            return u16(frame, offset + UDP_DST_PORT) in self.udp4Reflect and dataLen - UDP_HDR_SIZE >= self.reflectMin
+        return False
+
+    def rxReleaseNic(self, pkt):
+        '''Give the NIC RX ring space of pkt back. The ring is released in order: frames drained behind a kept frame
+        are released with it when it is the last kept one'''
+        nextPacket = pkt.nic_next
+        if 0 > nextPacket:
+            return
+        pkt.nic_next = -1
+        if 0 <= pkt.nic_addr:
+            pkt.nic_addr = -1
+            self.rxNicKept -= 1
+            if 0 == self.rxNicKept and 0 < self.rxReadyCnt:
+                lastPkt = self.rxReady[(self.rxReadyHead + self.rxReadyCnt - 1) % len(self.rxReady)]
+                if 0 <= lastPkt.nic_next:
+                    nextPacket = lastPkt.nic_next
+                for i in range(self.rxReadyCnt):
+                    self.rxReady[(self.rxReadyHead + i) % len(self.rxReady)].nic_next = -1
+        self.nic.ReleasePacket(nextPacket)
+
     def rxAllPkt(self):
         '''Function to rx and process all pending packets from NIC'''
+        self.pollLink()
+        # With an INT pin the NIC is not touched until it signals a packet
+        if 0 == self.rxReadyCnt and not self.nic.IsIntPending():
+            return
         while True:
             ## lock
-            rxPacketCnt = self.nic.GetRxPacketCnt()
-            if 0 == rxPacketCnt:
-                ## unlock
-                break
-            rxLen = self.nic.ReceivePacket(self.rxBuff)
+            self.rxDrainNic()
             ## unlock
-            if 0 >= rxLen:
-                print(f'Rx ERROR {rxLen}')
-                continue
-            procEth(Packet(self, self.rxBuff, rxLen))
+            if 0 == self.rxReadyCnt:
+                break
+            # The NIC is drained first, slow handlers don't hold up its RX buffer
+            while 0 < self.rxReadyCnt:
+                pkt = self.rxReady[self.rxReadyHead]
+                self.rxReady[self.rxReadyHead] = None
+                self.rxReadyHead = (self.rxReadyHead + 1) % len(self.rxReady)
+                self.rxReadyCnt -= 1
+                procEth(pkt)
+                self.rxReleaseNic(pkt)
+                if not pkt.held:
+                    self.rxFree[self.rxFreeCnt] = pkt
+                    self.rxFreeCnt += 1
+
+    def holdPkt(self, pkt):
+        '''Keep the frame buffer of pkt after its handler returns, give it back with releasePkt'''
+        pkt.held = True
+
+    def releasePkt(self, pkt):
+        if pkt.held:
+            pkt.held = False
+            self.rxFree[self.rxFreeCnt] = pkt
+            self.rxFreeCnt += 1
 
     def isLinkUp(self):
         return self.nic.IsLinkUp()
@@ -351,18 +686,104 @@ class Ntw:
     def getEthMTU(self):
         return 1500
 
-    def txPkt(self, msg):
-        '''Function to tx packet to NIC'''
+    def txPkt(self, msg, checksums=None, copyFrom=None):
+        '''Function to tx packet to NIC, checksums and copyFrom are done by the NIC DMA (see ENC28J60.SendPacket).
+        While the link is down the frame is held and TX_HELD returned, held frames are sent when the link returns'''
+        if self.linkUp and not self.txHold:
+            ## lock
+            n = self.nic.SendPacket(msg, checksums, copyFrom)
+            ## unlock
+            if enc28j60.ENC28J60_ETH_TX_ERR_LINKDOWN != n:
+                return n
+            self.pollLink(True)
+        return self.holdTx(msg, checksums, copyFrom)
+
+    def holdTx(self, msg, checksums=None, copyFrom=None):
+        '''Keep a copy of the frame until the link is up, the oldest held frame is dropped when txHold is full'''
+        if copyFrom is not None or 0 == self.txHoldMax:
+            # copyFrom points into the NIC RX ring, it is released long before the link returns
+            return enc28j60.ENC28J60_ETH_TX_ERR_LINKDOWN
+        if len(self.txHold) >= self.txHoldMax:
+            self.txHold.pop(0)
+            self.txHoldDropped += 1
+        frame = bytearray()
+        for chunk in msg:
+            frame.extend(chunk)
+        self.txHold.append((frame, checksums))
+        return TX_HELD
+
+    def flushTxHold(self):
+        '''Send the held frames in order, stops if the link goes down again. Returns the number of frames sent'''
+        sent = 0
+        while self.txHold:
+            frame, checksums = self.txHold[0]
+            if enc28j60.ENC28J60_ETH_TX_ERR_LINKDOWN == self.nic.SendPacket([frame], checksums):
+                break
+            self.txHold.pop(0)
+            sent += 1
+        return sent
+
+    def pollLink(self, force=False):
+        '''Track the link state: EIR.LINKIF is read every linkPollInterval ms, and on every call while a change is pending.
+        A new state counts once it held for linkDebounce ms, then the link callbacks run and held frames are sent.
+        Returns the debounced link state'''
+        now = time.ticks_ms()
+        if not force and self.linkRaw == self.linkUp and 0 < time.ticks_diff(self.linkPollNext, now):
+            return self.linkUp
+        self.linkPollNext = time.ticks_add(now, self.linkPollInterval)
         ## lock
-        n = self.nic.SendPacket(msg)
+        changed = self.nic.IsLinkStateChanged()
+        raw = self.nic.IsLinkUp() if changed or force or self.linkRaw != self.linkUp else self.linkRaw
         ## unlock
-        return n
+        if raw == self.linkUp and (changed or self.linkRaw != raw):
+            # Down and up again before the debounce time
+            self.linkFlaps += 1
+        if raw != self.linkRaw:
+            self.linkRaw = raw
+            self.linkRawSince = now
+        if raw != self.linkUp and time.ticks_diff(now, self.linkRawSince) >= self.linkDebounce:
+            self.linkUp = raw
+            print("Link is", "up" if raw else "down")
+            for cb in self.linkCallbacks:
+                cb(raw)
+            if raw:
+                self.flushTxHold()
+        return self.linkUp
+
+    def registerLinkCallback(self, cb):
+        '''cb(up) is called when the debounced link state changes'''
+        if cb not in self.linkCallbacks:
+            self.linkCallbacks.append(cb)
+
+    def unregisterLinkCallback(self, cb):
+        if cb in self.linkCallbacks:
+            self.linkCallbacks.remove(cb)
+
+    def registerEthType(self, ethType, handler):
+        '''handler(pkt) gets the frames of ethType, its payload starts at pkt.eth_offset. None drops the type'''
+        if handler is not None:
+            self.ethHandlers[ethType] = handler
+        else:
+            self.ethHandlers.pop(ethType, None)
+
+    def registerIp4Proto(self, proto, handler):
+        '''handler(pkt, bcast) gets the IPv4 datagrams of proto sent to my IP, or with bcast=True to broadcast and
+        joined multicast groups. The payload is pkt.frame[pkt.ip_offset:pkt.ip_maxoffset]. None drops the protocol'''
+        if handler is not None:
+            self.ip4Handlers[proto] = handler
+        else:
+            self.ip4Handlers.pop(proto, None)
 
-    def registerUdp4Callback(self, port, cb):
+    def registerUdp4Callback(self, port, cb, reflect=False):
+        '''reflect=True: cb may call reflectUdp4, datagrams to port stay in the NIC RX ring until cb returns'''
         if cb is not None:
             self.udp4UniBind[port] = cb
         else:
             self.udp4UniBind.pop(port, None)
+        if reflect and cb is not None:
+            self.udp4Reflect.add(port)
+        else:
+            self.udp4Reflect.discard(port)
 
     def registerUdp4BcastCallback(self, port, cb):
         if cb is not None:
@@ -370,15 +791,72 @@ class Ntw:
         else:
             self.udp4BcastBind.pop(port, None)
 
+    def joinGroup(self, group):
+        '''Receive the IPv4 multicast group, its UDP datagrams go to the registerUdp4BcastCallback handlers.
+        The NIC hash table lets the group MAC in, groups sharing its hash bit are dropped in procIp4'''
+        group = bytes(group)
+        if 0xE0 != group[0] & 0xF0:
+            raise ValueError(f'{group[0]}.{group[1]}.{group[2]}.{group[3]} is not a multicast group')
+        joins = self.mcastGroups.get(group, 0)
+        self.mcastGroups[group] = joins + 1
+        if 0 == joins:
+            self.mcastWords.append((u16(group, 0), u16(group, 2)))
+            bit = self.nic.HashTableBit(makeIp4McastMac(group))
+            self.mcastHashRef[bit] += 1
+            if 1 == self.mcastHashRef[bit]:
+                self.mcastHashTable[bit >> 3] |= 1 << (bit & 0x07)
+                self.nic.SetHashTable(self.mcastHashTable)
+
+    def leaveGroup(self, group):
+        '''Undo one joinGroup, the hash bit is cleared when no joined group uses it anymore'''
+        group = bytes(group)
+        joins = self.mcastGroups.get(group, 0)
+        if 0 == joins:
+            return
+        if 1 < joins:
+            self.mcastGroups[group] = joins - 1
+            return
+        del self.mcastGroups[group]
+        self.mcastWords.remove((u16(group, 0), u16(group, 2)))
+        bit = self.nic.HashTableBit(makeIp4McastMac(group))
+        self.mcastHashRef[bit] -= 1
+        if 0 == self.mcastHashRef[bit]:
+            self.mcastHashTable[bit >> 3] &= ~(1 << (bit & 0x07)) & 0xFF
+            self.nic.SetHashTable(self.mcastHashTable)
+
+    def isMcastGroup(self, hi, lo):
+        '''True if the group with the 16 bit words hi and lo is joined'''
+        for groupHi, groupLo in self.mcastWords:
+            if groupLo == lo and groupHi == hi:
+                return True
+        return False
+
     def addArpEntry(self, ip, mac):
+        # The table is keyed by the 4 address bytes
         if type(ip) == int:
-            self.arpTable[ip] = bytearray(mac)
+            self.arpTable[ip.to_bytes(4, 'big')] = bytearray(mac)
         else:
-            self.arpTable[struct.unpack('!I',ip)[0]] = bytearray(mac)
+            self.arpTable[bytes(ip)] = bytearray(mac)
+
+    def hasArpEntry(self, frame, ipOffset, macOffset):
+        '''True if the table already maps the IPv4 address at ipOffset of frame to the MAC at macOffset.
+        The address is compared as two 16 bit words, a known sender costs no bytes object'''
+        hi = u16(frame, ipOffset)
+        lo = u16(frame, ipOffset+2)
+        for ip in self.arpTable:
+            if u16(ip, 2) == lo and u16(ip, 0) == hi:
+                mac = self.arpTable[ip]
+                for i in range(6):
+                    if mac[i] != frame[macOffset+i]:
+                        return False
+                return True
+        return False
 
     def getArpEntry(self, ip):
-        if type(ip) != int:
-            ip = struct.unpack('!I',ip)[0]
+        if type(ip) == int:
+            ip = ip.to_bytes(4, 'big')
+        elif type(ip) != bytes:
+            ip = bytes(ip)
 
         if ip in self.arpTable:
             return self.arpTable[ip]
@@ -429,9 +907,17 @@ class Ntw:
         ip_totlen = IP4_HDR_NOOPT_SIZE + UDP_HDR_SIZE + data_len
         if ip_totlen <= self.getEthMTU():
             msg.append(makeIp4Hdr(self.myIp4Addr, tgt_ip, self.ip4TxCount, IP4_TYPE_UDP, UDP_HDR_SIZE + data_len))
-            msg.append(makeUdp4Hdr(self.myIp4Addr, src_port, tgt_ip, tgt_port, data))
-            msg.append(data)
-            n = self.txPkt(msg)
+            if data_len >= self.checksumOffloadMin:
+                # The NIC checksums UDP header + data in its TX buffer, only the pseudo-header is summed here
+                udpOffset = ETH_HDR_SIZE + IP4_HDR_NOOPT_SIZE
+                seed = addrSum(self.myIp4Addr) + addrSum(tgt_ip) + IP4_TYPE_UDP + UDP_HDR_SIZE + data_len
+                msg.append(makeUdp4Hdr(self.myIp4Addr, src_port, tgt_ip, tgt_port, data, calcChksm=False))
+                msg.append(data)
+                n = self.txPkt(msg, [(udpOffset, udpOffset + UDP_HDR_SIZE + data_len, udpOffset + 6, seed)])
+            else:
+                msg.append(makeUdp4Hdr(self.myIp4Addr, src_port, tgt_ip, tgt_port, data))
+                msg.append(data)
+                n = self.txPkt(msg)
         else:
             # IP fragmentation
             ip_mfo = ((self.getEthMTU() - IP4_HDR_NOOPT_SIZE) >> 3) << 3
@@ -469,6 +955,19 @@ class Ntw:
         self.ip4TxCount += 1
         return n
 
+    def reflectUdp4(self, pkt):
+        '''Send the data of the received pkt back to its sender, the data is copied from the NIC RX ring'''
+        msg = [pkt.eth_src, self.myMacAddr, ETH_TYPE_IP4_BYTES]
+        msg.append(makeIp4Hdr(self.myIp4Addr, pkt.ip_src_addr, self.ip4TxCount, IP4_TYPE_UDP, UDP_HDR_SIZE + pkt.udp_dataLen))
+        self.ip4TxCount += 1
+        # Swapped addresses and ports give the same sums, the request checksum is valid for the reply
+        udpHdr = makeUdp4Hdr(self.myIp4Addr, pkt.udp_dstPort, pkt.ip_src_addr, pkt.udp_srcPort, b'', calcChksm=False)
+        putU16(udpHdr, UDP_LEN, UDP_HDR_SIZE + pkt.udp_dataLen)
+        udpHdr[6] = pkt.udp_chksm >> 8
+        udpHdr[7] = pkt.udp_chksm & 0xFF
+        msg.append(udpHdr)
+        return self.txPkt(msg, copyFrom=(self.nic.RxAddress(pkt.nic_addr, pkt.ip_offset + UDP_HDR_SIZE), pkt.udp_dataLen))
+
     def sendUdp4Bcast(self, tgt_port, src_port, data, src_ip4Addr=None):
         msg = []
         tgt_ip4Addr = IP4_ADDR_BCAST
@@ -485,6 +984,78 @@ class Ntw:
         return n
 
 
+class Udp4Flow:
+    '''Datagrams to one (dst ip, dst port, src port): the Ethernet, IPv4 and UDP headers are built once in one buffer.
+    send() only patches the IPv4 total length, ident and header checksum (RFC 1624 incremental update from the
+    checksum of the template) and the UDP length and checksum, the headers are rebuilt when the next hop MAC or
+    the own IPv4 address change'''
+    def __init__(self, ntw, dstIp, dstPort, srcPort, ttl=128):
+        self.ntw = ntw
+        self.dstIp = bytes(dstIp)
+        self.dstPort = dstPort
+        self.srcPort = srcPort
+        self.ttl = ttl
+        self.hdr = bytearray(ETH_HDR_SIZE + IP4_HDR_NOOPT_SIZE + UDP_HDR_SIZE)
+        self.dstMac = None # ARP table entry the header was built for
+        self.srcIp4Hi = -1 # own address the header was built for, as Ntw.myIp4Hi and myIp4Lo
+        self.srcIp4Lo = -1
+        self.nextHop = None # IPv4 address whose MAC is the Ethernet destination, the ARP table key
+        self.ip4Chksm = 0 # IPv4 header checksum of the template: no data, ident 0
+        self.pseudoSum = 0 # pseudo-header without the UDP length
+
+    def _build(self):
+        ntw = self.ntw
+        hdr = self.hdr
+        self.srcIp4Hi = ntw.myIp4Hi
+        self.srcIp4Lo = ntw.myIp4Lo
+        self.nextHop = bytes(self.dstIp if ntw.isLocalIp4(self.dstIp) else ntw.gwIp4Addr)
+        self.dstMac = None
+        hdr[ETH_SRC:ETH_TYPE] = ntw.myMacAddr
+        putU16(hdr, ETH_TYPE, ETH_TYPE_IP4)
+        ip4 = makeIp4Hdr(ntw.myIp4Addr, self.dstIp, 0, IP4_TYPE_UDP, 0, ttl=self.ttl)
+        hdr[ETH_HDR_SIZE:ETH_HDR_SIZE+IP4_HDR_NOOPT_SIZE] = ip4
+        self.ip4Chksm = u16(ip4, IP4_CHKSM)
+        putU16(hdr, ETH_HDR_SIZE+IP4_HDR_NOOPT_SIZE+UDP_SRC_PORT, self.srcPort)
+        putU16(hdr, ETH_HDR_SIZE+IP4_HDR_NOOPT_SIZE+UDP_DST_PORT, self.dstPort)
+        self.pseudoSum = addrSum(ntw.myIp4Addr) + addrSum(self.dstIp) + IP4_TYPE_UDP
+
+    def send(self, data):
+        '''Send data, returns txPkt result or -1 if the next hop is not in the ARP table'''
+        ntw = self.ntw
+        hdr = self.hdr
+        udpLen = UDP_HDR_SIZE + len(data)
+        totlen = IP4_HDR_NOOPT_SIZE + udpLen
+        if totlen > ntw.getEthMTU():
+            # Fragments have headers of their own
+            return ntw.sendUdp4(self.dstIp, self.dstPort, data, self.srcPort)
+        if self.srcIp4Lo != ntw.myIp4Lo or self.srcIp4Hi != ntw.myIp4Hi:
+            self._build()
+        mac = ntw.arpTable.get(self.nextHop)
+        if mac is None:
+            print(f'Udp4Flow: {self.dstIp[0]}.{self.dstIp[1]}.{self.dstIp[2]}.{self.dstIp[3]} not in ARP table!')
+            return -1
+        if mac is not self.dstMac:
+            hdr[ETH_DST:ETH_SRC] = mac
+            self.dstMac = mac
+
+        # The whole 16 bit ident field is used, the counter wraps with it
+        ident = ntw.ip4TxCount & 0xFFFF
+        ntw.ip4TxCount = ident + 1
+        putU16(hdr, ETH_HDR_SIZE+IP4_TOTLEN, totlen)
+        putU16(hdr, ETH_HDR_SIZE+IP4_IDENT, ident)
+        putU16(hdr, ETH_HDR_SIZE+IP4_CHKSM, adjustChecksum(adjustChecksum(self.ip4Chksm, IP4_HDR_NOOPT_SIZE, totlen), 0, ident))
+
+        udp = ETH_HDR_SIZE + IP4_HDR_NOOPT_SIZE
+        putU16(hdr, udp+UDP_LEN, udpLen)
+        if len(data) >= ntw.checksumOffloadMin:
+            # The NIC checksums UDP header + data in its TX buffer, only the pseudo-header is summed here
+            putU16(hdr, udp+UDP_CHKSM, 0)
+            return ntw.txPkt([hdr, data], [(udp, udp + udpLen, udp + UDP_CHKSM, self.pseudoSum + udpLen)])
+        chksm = calcChecksum(data, self.pseudoSum + 2*udpLen + self.srcPort + self.dstPort)
+        putU16(hdr, udp+UDP_CHKSM, chksm if 0 != chksm else 0xFFFF)
+        return ntw.txPkt([hdr, data])
+
+
 class Udp4EchoServer:
     '''Simple UDP Echo server'''
     def __init__(self, ntw):
@@ -493,7 +1064,10 @@ class Udp4EchoServer:
     def __call__(self, pkt):
         print(f'Rx UDP Echo req from IP {pkt.ip_src_addr[0]}.{pkt.ip_src_addr[1]}.{pkt.ip_src_addr[2]}.{pkt.ip_src_addr[3]}')
         pkt.ntw.addArpEntry(pkt.ip_src_addr, pkt.eth_src)
-        pkt.ntw.sendUdp4(pkt.ip_src_addr, pkt.udp_srcPort, pkt.udp_data, pkt.udp_dstPort)
+        if 0 <= pkt.nic_addr and pkt.udp_dataLen >= pkt.ntw.reflectMin:
+            pkt.ntw.reflectUdp4(pkt)
+        else:
+            pkt.ntw.sendUdp4(pkt.ip_src_addr, pkt.udp_srcPort, pkt.udp_data, pkt.udp_dstPort)
 
 
 def main():
@@ -501,6 +1075,8 @@ def main():
     nicSpi = SPI(1, baudrate=10000000, sck=Pin(10), mosi=Pin(11), miso=Pin(8))
     nicCsPin = Pin(13)
     ntw = Ntw(nicSpi, nicCsPin)
+    print('SPI baudrate:', ntw.nic.CalibrateBaudrate(cacheFile='enc28j60.cal', busBaudrate=10000000))
+    ntw.restoreNicFilters()
 
     # Set static IP address
     ntw.setIPv4([192,168,40,233], [255,255,255,0], [192,168,40,1])
@@ -509,7 +1085,7 @@ def main():
     udpecho = Udp4EchoServer(ntw)
 
     # Bind UDP Echo server to UDP port 7
-    ntw.registerUdp4Callback(7, udpecho)
+    ntw.registerUdp4Callback(7, udpecho, reflect=True)
 
     while True:
         ntw.rxAllPkt()
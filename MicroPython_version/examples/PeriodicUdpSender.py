@@ -14,6 +14,7 @@ class PeriodicUdpSender:
         self.ntw = ntw
         self.tgt_addr = bytes(tgt_addr)
         self.tgt_port = tgt_port
+        self.flow = Ntw.Udp4Flow(ntw, self.tgt_addr, tgt_port, 0)
         self.period_sec = period_sec
         # Define states: 0 - idle, 1 - connecting, 2 - connected
         self.state = 0
@@ -48,7 +49,7 @@ class PeriodicUdpSender:
                 self.init_time += self.period_sec
 
     def send_data(self):
-        n = self.ntw.sendUdp4(self.tgt_addr, self.tgt_port, '<134>I am alive!'.encode())
+        n = self.flow.send('<134>I am alive!'.encode())
         if 0 > n:
             print(f'Fail to send data error={n}')
         else: